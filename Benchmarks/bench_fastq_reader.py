@@ -0,0 +1,82 @@
+"""Fastq Reader Benchmark
+
+    Usage:
+        bench_fastq_reader <fastq_filename> [--repeat=<n>]
+        bench_fastq_reader -h | --help
+
+    Options:
+        -h --help       Show this screen
+        --repeat=<n>    number of times each reader is timed (the best time is reported) [default: 3]
+"""
+
+########################################################################################################################
+# Main goal:            Compares the parsing throughput of the text line reader ('generatesKLines' + stripping the
+#                       newlines, as the scripts used to parse) with the block record reader
+#                       ('fastq_reader.generate_fastq_records', one record or one block of records at a time).
+########################################################################################################################
+
+import os
+import sys
+import time
+from docopt import docopt
+from Utility.generators_utilities import generatesKLines
+from Utility.fastq_reader import generate_fastq_records, generate_fastq_record_batches
+
+
+def read_with_generates_k_lines(fastq_filename):
+    num_records = 0
+    with open(fastq_filename, "r") as fastq_file:
+        for lines in generatesKLines(fastq_file, num_lines=4):
+            last_line = lines[3] if lines[3][-1:] != "\n" else lines[3][:-1]
+            [lines[0][:-1], lines[1][:-1], lines[2][:-1], last_line]
+            num_records += 1
+    return num_records
+
+
+def read_with_fastq_reader(fastq_filename):
+    num_records = 0
+    for _ in generate_fastq_records(fastq_filename):
+        num_records += 1
+    return num_records
+
+
+def read_with_fastq_reader_batches(fastq_filename):
+    num_records = 0
+    for batch in generate_fastq_record_batches(fastq_filename):
+        num_records += len(batch)
+    return num_records
+
+
+READERS = [("generatesKLines", read_with_generates_k_lines),
+           ("fastq_reader", read_with_fastq_reader),
+           ("fastq_reader batches", read_with_fastq_reader_batches)]
+
+
+def benchmark_readers(fastq_filename, repeat=3):
+    """
+    :param fastq_filename: the fastq file to parse
+    :param repeat: number of times each reader is timed
+    :return: a list of (reader name, number of records, best time in seconds, MB per second)
+    """
+    file_size_mb = os.path.getsize(fastq_filename) / float(1 << 20)
+    results = []
+    for name, reader in READERS:
+        best_time = None
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            num_records = reader(fastq_filename)
+            elapsed = time.perf_counter() - start_time
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+        results.append((name, num_records, best_time, file_size_mb / best_time if best_time else float("inf")))
+    return results
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+    try:
+        for name, num_records, best_time, throughput in benchmark_readers(arguments["<fastq_filename>"],
+                                                                          int(arguments["--repeat"])):
+            print("%-22s %12d records %10.3f s %10.1f MB/s" % (name, num_records, best_time, throughput))
+    except Exception as exp:
+        print(exp)
+        sys.exit(2)
@@ -0,0 +1,226 @@
+"""Benchmark Suite
+
+    Usage:
+        bench_suite run [--scales=<list>] [--read-length=<n>] [--duplication=<rate>] [--polya=<fraction>]
+                        [--seed=<n>] [--repeat=<n>] [--stages=<list>] [--output=<json>] [--work-dir=<dir>]
+        bench_suite compare <old_json> <new_json>
+        bench_suite -h | --help
+
+    Options:
+        -h --help               Show this screen
+        --scales=<list>         comma separated numbers of reads of the synthetic inputs [default: 10000,100000]
+        --read-length=<n>       length of each synthetic read [default: 100]
+        --duplication=<rate>    fraction of the synthetic reads which are duplicates [default: 0.3]
+        --polya=<fraction>      fraction of the unique sequences starting with a poly-A run [default: 0.05]
+        --seed=<n>              random seed of the synthetic inputs [default: 1]
+        --repeat=<n>            number of times each stage is run (the best run is reported) [default: 1]
+        --stages=<list>         comma separated stages to run (default: all - see STAGES)
+        --output=<json>         write the results to this JSON file (to be compared with 'compare')
+        --work-dir=<dir>        directory of the synthetic inputs and outputs (default: a new temp directory)
+"""
+
+########################################################################################################################
+# Main goal:            Times each stage of trimming and collapse (and the end-to-end scripts) on synthetic fastq
+#                       inputs of several scales. Each run is made in a fresh process, so its peak memory (max RSS) is
+#                       measured on its own. The results are written as JSON, and 2 result files (e.g. of 2 commits)
+#                       can be compared.
+########################################################################################################################
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from docopt import docopt
+from Benchmarks.synthetic_fastq import generate_synthetic_fastq
+from Utility.generators_utilities import generatesKLines
+from Utility.fastq_reader import generate_fastq_records
+from Processing.fastq_collapse import maximum_score, collapse_fastq_to_dict, collapse_fastq_to_table
+from Processing.fastq_trimming import trimmByRange
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_SCORE_PAIRS = 100000  # number of quality pairs merged by the 'maximum_score' stage
+
+
+def stage_generates_k_lines(fastq_filename, work_dir, read_length):
+    with open(fastq_filename, "r") as fastq_file:
+        return sum(1 for _ in generatesKLines(fastq_file, num_lines=4))
+
+
+def stage_fastq_reader(fastq_filename, work_dir, read_length):
+    return sum(1 for _ in generate_fastq_records(fastq_filename, validate=True))
+
+
+def stage_maximum_score(fastq_filename, work_dir, read_length):
+    qualities = [lines[3] for _, lines in zip(range(2 * MAX_SCORE_PAIRS), generate_fastq_records(fastq_filename))]
+    for curr_score, dict_score in zip(qualities[0::2], qualities[1::2]):
+        maximum_score(curr_score, dict_score)
+    return len(qualities) // 2
+
+
+def stage_collapse_fastq_to_dict(fastq_filename, work_dir, read_length):
+    return len(collapse_fastq_to_dict(generate_fastq_records(fastq_filename, validate=True)))
+
+
+def stage_collapse_fastq_to_table(fastq_filename, work_dir, read_length):
+    return len(collapse_fastq_to_table(generate_fastq_records(fastq_filename, validate=True)))
+
+
+def stage_trimm_by_range(fastq_filename, work_dir, read_length):
+    trimmByRange(fastq_filename, os.path.join(work_dir, "trimmed.fq"), 2, read_length - 2)
+    return os.path.getsize(os.path.join(work_dir, "trimmed.fq"))
+
+
+def run_script(script, args, work_dir):
+    """
+    :param script: a script of 'Processing'
+    :param args: the arguments of the script
+    :param work_dir: the working directory of the script
+    :return: the peak memory (max RSS, KB) of the script and its sub-processes
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])))
+    subprocess.run([sys.executable, os.path.join(REPO_ROOT, "Processing", script)] + args, cwd=work_dir, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+
+def stage_fastq_trimming_script(fastq_filename, work_dir, read_length):
+    return run_script("fastq_trimming.py", [fastq_filename, "trimmed.fq", "2", str(read_length - 2)], work_dir)
+
+
+def stage_fastq_collapse_script(fastq_filename, work_dir, read_length):
+    if os.path.exists(os.path.join(work_dir, "collapsed.fq")):
+        os.remove(os.path.join(work_dir, "collapsed.fq"))  # the collapse appends to its output
+    return run_script("fastq_collapse.py", [fastq_filename, "collapsed.fq", "--count"], work_dir)
+
+
+def stage_fastq_pipeline_script(fastq_filename, work_dir, read_length):
+    if os.path.exists(os.path.join(work_dir, "pipeline.fq")):
+        os.remove(os.path.join(work_dir, "pipeline.fq"))
+    return run_script("fastq_pipeline.py", [fastq_filename, "pipeline.fq", "2", str(read_length - 2), "--count"],
+                      work_dir)
+
+
+# stage name -> (function, whether the peak memory is of a sub-process (a script) rather than of the stage itself)
+STAGES = {"generatesKLines": (stage_generates_k_lines, False),
+          "fastq_reader": (stage_fastq_reader, False),
+          "maximum_score": (stage_maximum_score, False),
+          "collapse_fastq_to_dict": (stage_collapse_fastq_to_dict, False),
+          "collapse_fastq_to_table": (stage_collapse_fastq_to_table, False),
+          "trimmByRange": (stage_trimm_by_range, False),
+          "fastq_trimming.py": (stage_fastq_trimming_script, True),
+          "fastq_collapse.py": (stage_fastq_collapse_script, True),
+          "fastq_pipeline.py": (stage_fastq_pipeline_script, True)}
+
+
+def measure_stage(stage_args):
+    """
+    Runs a stage (in a fresh worker process)
+    :param stage_args: a tuple of (stage name, fastq filename, work directory, read length)
+    :return: (seconds, peak memory in KB)
+    """
+    stage, fastq_filename, work_dir, read_length = stage_args
+    function, is_script = STAGES[stage]
+    sys.stderr = open(os.devnull, "w")  # progress bars
+    start_time = time.perf_counter()
+    result = function(fastq_filename, work_dir, read_length)
+    elapsed = time.perf_counter() - start_time
+    return elapsed, result if is_script else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def benchmark(scales, stages, work_dir, read_length=100, duplication_rate=0.3, polya_fraction=0.05, seed=1,
+              repeat=1):
+    """
+    :param scales: numbers of reads of the synthetic inputs
+    :param stages: names of the stages to run (keys of 'STAGES')
+    :param work_dir: directory of the synthetic inputs and outputs
+    :return: a list of result dictionaries - one for each scale and stage
+    """
+    results = []
+    # 'spawn' - every run starts from a clean interpreter, so the peak memory is of that run only
+    context = multiprocessing.get_context("spawn")
+    for num_reads in scales:
+        fastq_filename = os.path.join(work_dir, "synthetic_%d.fq" % num_reads)
+        generate_synthetic_fastq(fastq_filename, num_reads, read_length, duplication_rate, polya_fraction, seed)
+        file_size_mb = os.path.getsize(fastq_filename) / float(1 << 20)
+        for stage in stages:
+            runs = []
+            for _ in range(repeat):
+                pool = context.Pool(1)
+                try:
+                    runs.append(pool.apply(measure_stage, ((stage, fastq_filename, work_dir, read_length),)))
+                finally:
+                    pool.close()
+                    pool.join()
+            seconds, peak_kb = min(runs)
+            results.append({"stage": stage, "reads": num_reads, "input_mb": round(file_size_mb, 3),
+                            "seconds": round(seconds, 4), "mb_per_second": round(file_size_mb / seconds, 2),
+                            "peak_rss_mb": round(peak_kb / 1024.0, 1)})
+            print("%-24s %10d reads %10.3f s %10.1f MB/s %10.1f MB peak" % (stage, num_reads, seconds,
+                                                                             file_size_mb / seconds,
+                                                                             peak_kb / 1024.0))
+        os.remove(fastq_filename)
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(old_filename, new_filename):
+    """
+    Prints the time and peak memory ratios (new / old) of the stages in both result files
+    """
+    with open(old_filename) as old_file, open(new_filename) as new_file:
+        old_report, new_report = json.load(old_file), json.load(new_file)
+    old_results = {(result["stage"], result["reads"]): result for result in old_report["results"]}
+    print("old: %s\nnew: %s" % (old_report.get("commit"), new_report.get("commit")))
+    for result in new_report["results"]:
+        old_result = old_results.get((result["stage"], result["reads"]))
+        if old_result is None:
+            continue
+        print("%-24s %10d reads %10.3f s -> %8.3f s (x%.2f) %8.1f MB -> %8.1f MB (x%.2f)" % (
+            result["stage"], result["reads"], old_result["seconds"], result["seconds"],
+            result["seconds"] / old_result["seconds"], old_result["peak_rss_mb"], result["peak_rss_mb"],
+            result["peak_rss_mb"] / old_result["peak_rss_mb"]))
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+    try:
+        if arguments["compare"]:
+            compare_results(arguments["<old_json>"], arguments["<new_json>"])
+            sys.exit()
+        stages = arguments["--stages"].split(",") if arguments["--stages"] else list(STAGES)
+        unknown_stages = [stage for stage in stages if stage not in STAGES]
+        if unknown_stages:
+            raise ValueError("Unknown stages: %s - should be some of: %s" % (", ".join(unknown_stages),
+                                                                            ", ".join(STAGES)))
+        work_dir = arguments["--work-dir"] or tempfile.mkdtemp(prefix="fastq_benchmarks_")
+        read_length = int(arguments["--read-length"])
+        parameters = {"read_length": read_length, "duplication_rate": float(arguments["--duplication"]),
+                      "polya_fraction": float(arguments["--polya"]), "seed": int(arguments["--seed"]),
+                      "repeat": int(arguments["--repeat"])}
+        try:
+            results = benchmark([int(scale) for scale in arguments["--scales"].split(",")], stages, work_dir,
+                                **parameters)
+        finally:
+            if not arguments["--work-dir"]:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        if arguments["--output"]:
+            with open(arguments["--output"], "w") as output_file:
+                json.dump({"commit": current_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                           "python": platform.python_version(), "platform": platform.platform(),
+                           "parameters": parameters, "results": results}, output_file, indent=2)
+    except Exception as exp:
+        print(exp)
+        sys.exit(2)
@@ -0,0 +1,76 @@
+"""Synthetic Fastq
+
+    Usage:
+        synthetic_fastq <fastq_filename> [--reads=<n>] [--read-length=<n>] [--duplication=<rate>] [--polya=<fraction>]
+                        [--seed=<n>]
+        synthetic_fastq -h | --help
+
+    Options:
+        -h --help               Show this screen
+        --reads=<n>             number of reads [default: 100000]
+        --read-length=<n>       length of each read [default: 100]
+        --duplication=<rate>    fraction of the reads which are duplicates of other reads [default: 0.3]
+        --polya=<fraction>      fraction of the unique sequences starting with a poly-A run (skews the prefix
+                                partitions) [default: 0.05]
+        --seed=<n>              random seed - the same arguments and seed always give the same file [default: 1]
+"""
+
+########################################################################################################################
+# Main goal:            Writes a reproducible synthetic fastq file for the benchmarks - random sequences and quality
+#                       scores, with a configurable number of reads, read length, duplication rate and prefix skew.
+########################################################################################################################
+
+import sys
+import numpy as np
+from docopt import docopt
+
+NUCLEOTIDES = np.frombuffer(b"ACGT", dtype=np.uint8)
+MIN_QUALITY_CHAR = ord("!")
+MAX_QUALITY_CHAR = ord("J")
+POLYA_LENGTH = 20  # length of the poly-A run at the beginning of a poly-A sequence
+WRITE_BATCH_SIZE = 100000  # number of reads built in memory at a time
+
+
+def generate_synthetic_fastq(fastq_filename, num_reads, read_length=100, duplication_rate=0.3, polya_fraction=0.05,
+                             seed=1):
+    """
+    :param fastq_filename: the fastq file to write
+    :param num_reads: number of reads
+    :param read_length: length of each read
+    :param duplication_rate: fraction of the reads which are duplicates of other reads (with their own headers and
+                             quality scores)
+    :param polya_fraction: fraction of the unique sequences starting with a poly-A run
+    :param seed: random seed
+    :return: the number of unique sequences in the file
+    """
+    rng = np.random.RandomState(seed)
+    num_unique = max(1, int(round(num_reads * (1 - duplication_rate)))) if num_reads else 0
+    unique_sequences = NUCLEOTIDES[rng.randint(0, len(NUCLEOTIDES), size=(num_unique, read_length))]
+    polya = rng.random_sample(num_unique) < polya_fraction
+    unique_sequences[polya, :POLYA_LENGTH] = ord("A")
+    # every unique sequence appears at least once, the duplicates are drawn from them, in a random order
+    sequence_indices = np.concatenate([np.arange(num_unique), rng.randint(0, max(1, num_unique),
+                                                                          size=num_reads - num_unique)])
+    sequence_indices = sequence_indices[rng.permutation(num_reads)]
+    with open(fastq_filename, "wb") as fastq_file:
+        for batch_start in range(0, num_reads, WRITE_BATCH_SIZE):
+            batch_indices = sequence_indices[batch_start:batch_start + WRITE_BATCH_SIZE]
+            sequences = unique_sequences[batch_indices]
+            qualities = rng.randint(MIN_QUALITY_CHAR, MAX_QUALITY_CHAR + 1, size=sequences.shape).astype(np.uint8)
+            records = []
+            for read_number, sequence, quality in zip(range(batch_start, batch_start + len(batch_indices)),
+                                                      sequences, qualities):
+                records.append(b"@SYNTH:%d\n%s\n+\n%s\n" % (read_number, sequence.tobytes(), quality.tobytes()))
+            fastq_file.write(b"".join(records))
+    return num_unique
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+    try:
+        generate_synthetic_fastq(arguments["<fastq_filename>"], int(arguments["--reads"]),
+                                 int(arguments["--read-length"]), float(arguments["--duplication"]),
+                                 float(arguments["--polya"]), int(arguments["--seed"]))
+    except Exception as exp:
+        print(exp)
+        sys.exit(2)
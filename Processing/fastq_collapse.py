@@ -1,14 +1,57 @@
 """Fastq Collapse
 
     Usage:
-        fastq_collapse <fastq_filename> <new_filename> [ <prefix>] [--count]
+        fastq_collapse <fastq_filename> <new_filename> [ <prefix>] [--count] [--workers=<n>] [--merge=<strategy>]
+                       [--mem=<size>] [--buckets=<n>] [--max-partition-size=<size>] [--compact]
+                       [--singleton-filter] [--method=<method>] [--run-size=<n>] [--metrics=<json>]
+                       [--profile=<file>] [--no-progress] [--pipelined] [--queue-size=<n>] [--compress-temp]
+                       [--existing=<fastq>] [--checkpoint] [--paired=<fastq> --paired-out=<fastq>]
         fastq_collapse param
         fastq_collapse example
         fastq_collapse -h | --help
 
     Options:
-        -h --help   Show this screen
-        --count     include a count of each gene in the collapsed file
+        -h --help           Show this screen
+        --count             include a count of each gene in the collapsed file
+        --workers=<n>       number of prefix partitions collapsed concurrently, each in its own process [default: 1]
+        --merge=<strategy>  how quality scores of duplicates are merged - max, mean (phred) or sum (capped phred)
+                            [default: max]
+        --mem=<size>        memory budget, e.g. 8G - an input estimated to fit is collapsed in a single pass,
+                            without prefix temp files
+        --buckets=<n>       split into <n> hash buckets of the sequence instead of by its prefix
+        --max-partition-size=<size>  re-split (recursively, by a second hash) any partition larger than this
+                            (default: derived from --mem and --workers, or no re-splitting without --mem)
+        --compact           collapse into a compact table (2-bit packed sequences, array counts) instead of a
+                            dictionary of 'FastqRecord' objects - about half the memory per sequence (1.9x less
+                            for 150 bp reads; the headers and qualities are kept as they are)
+        --singleton-filter  count sequences in a first pass over each partition, so reads that certainly appear
+                            once are written straight to the output and only candidate duplicates take memory
+        --method=<method>   partition - split by prefix (or hash) and collapse each partition in memory, or
+                            sort - external-sort the records by sequence and collapse equal neighbours in a single
+                            streaming pass (memory is bounded by --run-size, the output is ordered by sequence)
+                            [default: partition]
+        --run-size=<n>      number of records sorted in memory at a time by the sort method [default: 500000]
+        --metrics=<json>    write a JSON report of the metrics of each stage (read, parse, split, collapse,
+                            quality_merge, write...) - time, records, bytes, process peak memory, partitions,
+                            duplicate ratio
+        --profile=<file>    profile the run with cProfile and dump the stats to <file> (the main process only)
+        --no-progress       do not show progress bars
+        --pipelined         overlap reading, collapsing and writing - the input and the partitions are read ahead in a
+                            reader thread, and the partitions and the output are written by a writer thread, through
+                            bounded queues (with --workers, the partitions are collapsed in the worker processes)
+        --queue-size=<n>    number of blocks waiting in each queue of --pipelined (bounds its memory) [default: 4]
+        --compress-temp     compress the temp partitions (with a fast level) - less temp disk space and I/O
+        --existing=<fastq>  incremental collapse - an existing collapsed file (written with --count and the max merge
+                            strategy) that the reads of <fastq_filename> are folded into: the output is the collapse
+                            of the reads of both, and only the new reads are collapsed in memory
+        --checkpoint        keep a manifest (<new_filename>.checkpoint) of the finished stages and partitions - an
+                            interrupted run is resumed, after its last finished partition, by running it again with
+                            the same arguments, and a new run starts <new_filename> over (the partition method only)
+        --paired=<fastq>    paired-end collapse - the R2 file of <fastq_filename>, its records in the same order: pairs
+                            are duplicates if both of their mates are
+        --paired-out=<fastq>  the collapsed R2 file of --paired (in the order of <new_filename>, with the same counts)
+
+    Files ending with .gz (or .bgz) are read and written compressed - the output in BGZF blocks.
 """
 
 ########################################################################################################################
@@ -19,12 +62,48 @@
 
 import os
 import sys
+import zlib
+import shutil
+import hashlib
+from functools import partial
+from contextlib import ExitStack
+from itertools import groupby
+from operator import attrgetter
+from multiprocessing import Pool
 from docopt import docopt
-from tqdm import tqdm
-from Utility.Fastq_class import Fastq
-from Utility.generators_utilities import BAR_DEFAULT_VIEW, generatesKLines
-from Utility.generators_utilities import num_of_lines_in_file as calc_num_lines_in_file
+from Utility.Fastq_class import FastqRecord
+from Utility.generators_utilities import progress_bar, set_progress_bars
+from Utility.metrics import current_metrics, enable_metrics, reset_worker_metrics, run_profiled
+from Utility.partition_writers import PartitionWriterPool, DEFAULT_FLUSH_THRESHOLD
+from Utility.quality_merge import QualityAggregator, DEFAULT_MERGE_STRATEGY, DEFAULT_MAX_PENDING_BYTES
+from Utility.memory_utilities import parse_memory_size, estimate_collapse_memory, max_partition_size_for_budget, \
+    max_pending_bytes_for_budget
+from Utility.collapse_table import CollapseTable, MATE_SEPARATOR
+from Utility.sketch import CountingBloomFilter
+from Utility.fastq_shards import estimate_num_of_records
+from Utility.fastq_reader import generate_fastq_records, generate_fastq_record_batches, generate_paired_records
+from Utility.file_utilities import input_size, is_stdio
+from Utility.compressed_io import open_file, is_compressed, uncompressed_size, DEFAULT_COMPRESSION_THREADS
+from Utility.external_sort import external_sort
+from Utility.pipelined_io import WriterThread, DEFAULT_QUEUE_SIZE
+from Utility.checkpoint import Checkpoint, CHECKPOINT_SUFFIX
 DEFAULT_PREFIX = 3
+RESPLIT_FANOUT = 16  # number of sub-partitions an oversized partition is split into
+MAX_RESPLIT_DEPTH = 4
+COUNT_SUFFIX = "_count:"  # the suffix of the header of a collapsed record, followed by its count
+EXISTING_PARTITIONS_SUFFIX = ".existing"  # added to the base filename of the partitions of an existing collapsed file
+TEMP_SUFFIX = ".temp"  # the suffix of a partition file
+COMPRESSED_TEMP_SUFFIX = ".temp.gz"  # the suffix of a compressed partition file
+PARTITIONS_DIR_SUFFIX = ".partitions"  # the partitions of a run are kept in the directory <new_filename><suffix>
+SINGLETONS_BATCH_SIZE = 10000  # number of singleton records held in memory between writes
+WRITE_CHUNK_SIZE = 10000  # number of collapsed sequences written together by the pipelined collapse
+COLLAPSE_METHODS = ("partition", "sort")
+DEFAULT_COLLAPSE_METHOD = "partition"
+SORT_RUN_SIZE = 500000  # number of records sorted in memory at a time by the sort method
+SORT_WINDOW_SIZE = 10000  # number of collapsed sequences held in memory between quality merges (sort method)
+PAIR_SEPARATOR = MATE_SEPARATOR  # joins the lines of the mates of a paired-end read (packed apart by --compact)
+PAIR_QUALITY_SEPARATOR = "!"  # joins the qualities of the mates - phred 0, which every merge strategy keeps as is
+PAIRS_SUFFIX = ".pairs"  # the collapsed joined pairs are written to <new_filename><suffix> before they are split
 
 
 def maximum_score(curr_score, dict_score):
@@ -34,158 +113,1028 @@ def maximum_score(curr_score, dict_score):
     :return: A new string of score, where each index is the maximum score
             between the 2 score strings
     """
-    new_score = ""
-    for i in range(len(curr_score)):  # For each char in score
-        curr_char = curr_score[i]
-        dict_char = dict_score[i]
-        new_score += curr_char if curr_char > dict_char else dict_char  # Put maximum
-
-    return new_score
+    return "".join(map(max, curr_score, dict_score))  # Put maximum of each char
 
 
-def collapse_fastq_to_dict(generator_file):
+def collapse_fastq_to_dict(generator_file, merge_strategy=DEFAULT_MERGE_STRATEGY,
+                           max_pending_bytes=DEFAULT_MAX_PENDING_BYTES):
     """
-    :param generator_file: A generator of 4 lines of the file of 'FastQ' elements'.
-    :return: A dictionary of the format: { 'string' : ('FastQ' object, 'int') }. With 'string' being
-             the base-pair seq, 'object' being the best 'FastQ' seq found,
-             and 'int' being that particular base-pair seq counter
+    :param generator_file: A generator of validated 'FastqRecord' objects (see
+                           'fastq_reader.generate_fastq_records').
+    :param merge_strategy: how the quality scores of duplicates are merged (see 'quality_merge.merge_qualities')
+    :param max_pending_bytes: the buffer of qualities of duplicates waiting to be merged (see 'QualityAggregator') -
+                              the memory used on top of the dictionary, except that the 'mean' strategy also keeps
+                              the phred sums of the duplicated sequences until the end
+    :return: A dictionary of the format: { 'string' : ('FastqRecord' object, 'int') }. With 'string' being
+             the base-pair seq, 'object' being the best 'FastQ' seq found (the record of its first occurrence, kept
+             as is - no object is built per record), and 'int' being that particular base-pair seq counter
     """
     seq_dict = {}
 
-    for lines in generator_file:
-        last_line = lines[3] if lines[3][-1:] != "\n" else lines[3][:-1]
-        seq = Fastq([lines[0][:-1], lines[1][:-1], lines[2][:-1], last_line])
-        try:
-            seq_dict[seq.strings[1]][1] += 1
-            # if qualityIsBetter(seq.strings[3], seq_dict[seq.strings[1]][0].strings[3]):
-            #    seq_dict[seq.strings[1]][0] = seq
-            curr_score = seq.strings[3]
-            dict_score = seq_dict[seq.strings[1]][0].strings[3]
-            seq_dict[seq.strings[1]][0].strings[3] = maximum_score(curr_score, dict_score)
-        except Exception as exception:  # This is the first occurrence of this sequence
-            if type(exception) == KeyError:
-                seq_dict[seq.strings[1]] = [seq, 1]
-            else:
-                print(exception)
-                sys.exit(-1)
+    def store_quality(sequence, quality):
+        seq_dict[sequence][0].quality = quality
+    # quality scores of duplicates are merged in large vectorized batches rather than one pair at a time, and the
+    # merges are written back into the records (so only the pending qualities are held on top of the dictionary)
+    quality_aggregator = QualityAggregator(merge_strategy, max_pending_bytes,
+                                           load_quality=lambda sequence: seq_dict[sequence][0].quality,
+                                           store_quality=store_quality)
+
+    for record in generator_file:
+        entry = seq_dict.get(record.sequence)
+        if entry is None:  # This is the first occurrence of this sequence
+            seq_dict[record.sequence] = [record, 1]
+        else:
+            entry[1] += 1
+            quality_aggregator.add(record.sequence, record.quality)
+
+    for sequence, quality in quality_aggregator.merged():
+        store_quality(sequence, quality)
 
     return seq_dict
 
 
-def generate_fastq_file_from_dict(fastq_dict, filename, generating_fastq_progress_bar, write_count_flag):
+def collapse_fastq_to_table(generator_file, merge_strategy=DEFAULT_MERGE_STRATEGY,
+                            max_pending_bytes=DEFAULT_MAX_PENDING_BYTES):
+    """
+    :param generator_file: A generator of validated 'FastqRecord' objects (see
+                           'fastq_reader.generate_fastq_records').
+    :param merge_strategy: how the quality scores of duplicates are merged (see 'quality_merge.merge_qualities')
+    :param max_pending_bytes: the buffer of qualities of duplicates waiting to be merged (see 'QualityAggregator')
+    :return: A 'CollapseTable' of the collapsed sequences - the same content as the dictionary of
+             'collapse_fastq_to_dict' in a fraction of its memory
+    """
+    collapse_table = CollapseTable(merge_strategy, max_pending_bytes)
+    for record in generator_file:
+        collapse_table.add(record.header, record.sequence, record.plus_line, record.quality)
+    collapse_table.merge_qualities()
+    return collapse_table
+
+
+def collapse_fastq(generator_file, merge_strategy=DEFAULT_MERGE_STRATEGY, compact=False,
+                   max_pending_bytes=DEFAULT_MAX_PENDING_BYTES):
+    """
+    :param generator_file: A generator of validated 'FastqRecord' objects (see
+                           'fastq_reader.generate_fastq_records').
+    :param merge_strategy: how the quality scores of duplicates are merged (see 'quality_merge.merge_qualities')
+    :param compact: collapse into a 'CollapseTable' instead of a dictionary
+    :param max_pending_bytes: the buffer of qualities of duplicates waiting to be merged (see 'QualityAggregator')
+    :return: the collapsed sequences - both kinds support 'len' and 'values' (see 'generate_fastq_file_from_dict')
+    """
+    metrics = current_metrics()
+    with metrics.stage("collapse") as stage:
+        generator_file = metrics.count_records(stage, generator_file)
+        if compact:
+            collapsed_fastq_dict = collapse_fastq_to_table(generator_file, merge_strategy, max_pending_bytes)
+        else:
+            collapsed_fastq_dict = collapse_fastq_to_dict(generator_file, merge_strategy, max_pending_bytes)
+    return collapsed_fastq_dict
+
+
+def record_collapse_metrics(num_sequences, num_reads):
+    """
+    :param num_sequences: number of (unique) sequences written to the collapsed output
+    :param num_reads: number of reads these sequences were collapsed from
+    """
+    metrics = current_metrics()
+    metrics.increment("unique_sequences", num_sequences)
+    metrics.increment("collapsed_reads", num_reads)
+
+
+def duplicate_ratio(metrics):
+    """
+    :param metrics: the metrics of a collapse
+    :return: the fraction of the reads that were duplicates of another read
+    """
+    collapsed_reads = metrics.values.get("collapsed_reads")
+    return 1 - metrics.values.get("unique_sequences", 0) / float(collapsed_reads) if collapsed_reads else 0.0
+
+
+def open_collapsed_output(filename, mode="a"):
+    """
+    :param filename: the output filename of a collapse (compressed by its extension)
+    :param mode: the mode to open it with - the partitions of a collapse are appended to the same output
+    :return: the open output - a compressed output is compressed by 'DEFAULT_COMPRESSION_THREADS' threads (temp
+             partitions are compressed with a fast level and a single thread instead, see 'partition_writers')
+    """
+    return open_file(filename, mode, threads=DEFAULT_COMPRESSION_THREADS)
+
+
+def generate_fastq_file_from_dict(fastq_dict, filename, generating_fastq_progress_bar, write_count_flag,
+                                  existing_records=None, new_fastq_file=None):
     """
     :param fastq_dict: The dictionary described above (See 'collapseFastqSeqListToDict.__doc__')
     :param filename: The requested filename (with relative path) of the new collapsed fastq file
     :param generating_fastq_progress_bar: A progress bar that will update while the new fastq file is being generated.
     :param write_count_flag: a flag indicating whether to write sequence counts to the output file
-    :return: The same filename entered at the input OR -1 if a file with the same name exits
-             in the designated directory.
+    :param existing_records: if given, the records of an existing collapsed file that the sequences of the dictionary
+                             are folded into (see 'fold_existing_records')
+    :param new_fastq_file: the output, if it is already open (e.g. once for all the partitions) - otherwise
+                           'filename' is opened for append (see 'open_collapsed_output')
+    :return: The same filename entered at the input
     """
-    if filename.split("/")[-1] in "".join(filename.split("/")[:-1]):
-        print("A file with that name already exits in the designated directory!")
-        return -1
-    new_fastq_file = open(filename, "a+")  # Read + Append, 'line buffering'
+    metrics = current_metrics()
+    entries = fastq_dict.values() if existing_records is None else fold_existing_records(existing_records, fastq_dict)
+    with ExitStack() as output:
+        if new_fastq_file is None:  # Append (compressed by the extension of the filename)
+            new_fastq_file = output.enter_context(open_collapsed_output(filename))
+        with metrics.stage("write") as stage:
+            num_sequences = num_reads = num_bytes = 0
+            for fastq_obj, count in entries:
+                if write_count_flag:
+                    fastq_obj.header = fastq_obj.header + "%s:%d" % ('_count', count)
+                record = "\n".join(fastq_obj) + "\n"
+                new_fastq_file.write(record)
+                generating_fastq_progress_bar.update(1)
+                num_sequences += 1
+                num_reads += count
+                num_bytes += len(record)
+            stage.add(records=num_sequences, bytes_written=num_bytes)
+        record_collapse_metrics(num_sequences, num_reads)
+    os.chmod(filename, 0o777)
+
+    return filename
+
 
-    for fastq_obj, count in fastq_dict.values():
+def generate_collapsed_chunks(fastq_dict, write_count_flag, chunk_size=WRITE_CHUNK_SIZE, existing_records=None):
+    """
+    :param fastq_dict: the collapsed sequences (see 'generate_fastq_file_from_dict')
+    :param write_count_flag: a flag indicating whether to write sequence counts to the output file
+    :param chunk_size: number of sequences in each chunk
+    :param existing_records: if given, the records of an existing collapsed file that the sequences are folded into
+                             (see 'fold_existing_records')
+    :return: yields the text of the collapsed sequences (as written by 'generate_fastq_file_from_dict'),
+             'chunk_size' sequences at a time
+    """
+    entries = fastq_dict.values() if existing_records is None else fold_existing_records(existing_records, fastq_dict)
+    chunk = []
+    num_sequences = num_reads = 0
+    for fastq_obj, count in entries:
         if write_count_flag:
-            fastq_obj.strings[0] = fastq_obj.strings[0] + "%s:%d" % ('_count', count)
-        new_fastq_file.write("\n".join(fastq_obj.strings) + "\n")
-        generating_fastq_progress_bar.update(1)
+            fastq_obj.header = fastq_obj.header + "%s:%d" % ('_count', count)
+        chunk.append("\n".join(fastq_obj) + "\n")
+        num_sequences += 1
+        num_reads += count
+        if len(chunk) >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+    record_collapse_metrics(num_sequences, num_reads)
 
-    os.chmod(filename, 0o777)
-    new_fastq_file.close()
 
-    return filename
+def parse_count_header(header):
+    """
+    :param header: the header of a collapsed record written with counts (see 'generate_fastq_file_from_dict'),
+                   e.g. '@ABC_count:2'
+    :return: (the header without its count suffix, the count)
+    """
+    base_header, separator, count = header.rpartition(COUNT_SUFFIX)
+    if not separator or not count.isdigit():
+        raise ValueError("A record of the existing collapsed file has no read count (it should be collapsed with "
+                         "--count): %s" % header)
+    return base_header, int(count)
+
+
+def fold_existing_records(existing_records, fastq_dict):
+    """
+    Folds newly collapsed sequences into the sequences of an existing collapsed file - the result is the collapse of
+    the reads of both (with the 'max' merge strategy): the header of an existing sequence is kept (its reads came
+    first), the counts are added and the qualities are merged by their per-position maximum.
+    Only the new sequences are held in memory - the existing records are streamed.
+    :param existing_records: validated records of an existing collapsed file, with counts in their headers
+    :param fastq_dict: the collapsed new reads (a dictionary or a 'CollapseTable', see 'collapse_fastq') - the
+                       sequences folded into existing ones are popped from it
+    :return: yields ['FastqRecord' object, 'int'] for every sequence - the existing ones, then the new ones
+    """
+    for record in existing_records:
+        record.header, count = parse_count_header(record.header)
+        entry = fastq_dict.pop(record.sequence, None)
+        if entry is not None:
+            count += entry[1]
+            record.quality = maximum_score(record.quality, entry[0].quality)
+        yield [record, count]
+    yield from fastq_dict.values()
+
+
+def existing_partition_filename(filename, new_filename):
+    """
+    :param filename: a partition filename of the new reads (see 'split_file_to_sub_files_by_prefix')
+    :param new_filename: the base filename of the partitions (see 'partitions_base_filename')
+    :return: the filename of the partition of an existing collapsed file with the same key
+    """
+    return new_filename + EXISTING_PARTITIONS_SUFFIX + filename[len(new_filename):]
+
+
+def split_existing_file(existing_filename, list_of_files, prefix, new_filename, buckets=None, writer_queue_size=0,
+                        compress_temp=False):
+    """
+    Splits an existing collapsed file by the same keys as the new reads (see 'split_file_to_sub_files_by_prefix')
+    :param existing_filename: the existing collapsed file
+    :param list_of_files: the partition filenames of the new reads
+    :param prefix: the prefix length the new reads were split by
+    :param new_filename: the base filename of the partitions (see 'partitions_base_filename')
+    :param buckets: the number of hash buckets the new reads were split into, if any
+    :param writer_queue_size: if positive, the partitions are written by a writer thread
+    :param compress_temp: whether the partitions are compressed
+    :return: (a dictionary of partition filename -> the existing partition of its key, a list of the existing
+              partitions with no new reads)
+    """
+    existing_files = split_file_to_sub_files_by_prefix(generate_fastq_records(existing_filename, validate=True),
+                                                       prefix, new_filename + EXISTING_PARTITIONS_SUFFIX,
+                                                       existing_filename, buckets=buckets,
+                                                       writer_queue_size=writer_queue_size,
+                                                       compress_temp=compress_temp)
+    existing_names = set(existing_files)
+    existing_partitions = {}
+    for filename in list_of_files:
+        existing_partition = existing_partition_filename(filename, new_filename)
+        if existing_partition in existing_names:
+            existing_partitions[filename] = existing_partition
+    matched = set(existing_partitions.values())
+    return existing_partitions, [filename for filename in existing_files if filename not in matched]
+
+
+def append_existing_partitions(existing_files, new_filename, write_count_flag, run_checkpoint=None,
+                               new_fastq_file=None):
+    """
+    Appends partitions of an existing collapsed file that no new read fell into to the output (and removes them)
+    :param existing_files: the partition filenames
+    :param new_filename: the output filename
+    :param write_count_flag: a flag indicating whether to write sequence counts to the output file
+    :param run_checkpoint: the 'Checkpoint' of the run, if any - each appended partition is recorded in it
+    :param new_fastq_file: the output, if it is already open - otherwise it is opened once for all the partitions
+    """
+    if not existing_files:
+        return
+    with ExitStack() as output:
+        if new_fastq_file is None:
+            new_fastq_file = output.enter_context(open_collapsed_output(new_filename))
+        for existing_filename in existing_files:
+            generate_fastq_file_from_dict({}, new_filename, progress_bar(disable=True), write_count_flag,
+                                          generate_fastq_records(existing_filename), new_fastq_file)
+            finish_partition(existing_filename, run_checkpoint=run_checkpoint, new_filename=new_filename,
+                             new_fastq_file=new_fastq_file)
+
+
+def finish_partition(filename, existing_filename=None, run_checkpoint=None, new_filename=None, new_fastq_file=None):
+    """
+    Removes a collapsed partition (and the existing partition folded into it) - after recording it as finished in
+    the checkpoint of the run, with the size of the output, so a resumed run neither collapses it again nor keeps a
+    partial append of it
+    :param filename: the partition filename
+    :param existing_filename: the existing partition folded into it, if any
+    :param run_checkpoint: the 'Checkpoint' of the run, if any
+    :param new_filename: the output filename (needed with a checkpoint)
+    :param new_fastq_file: the output, if it is open - flushed before its size is recorded
+    """
+    if run_checkpoint is not None:
+        if new_fastq_file is not None:
+            new_fastq_file.flush()
+        run_checkpoint.finish(filename, os.path.getsize(new_filename))
+    os.remove(filename)
+    if existing_filename is not None:
+        os.remove(existing_filename)
+
+
+def start_output(new_filename, fastq_filename=None):
+    """
+    Empties the output of an earlier run, if any - the collapse appends to its output, so a run over an existing
+    output would otherwise duplicate every read
+    :param new_filename: the output filename
+    :param fastq_filename: the input filename, if the records are read from it - it is opened first, so a run whose
+                           input can not be read (e.g. a typo in its name) fails before the output is emptied
+    """
+    if fastq_filename is not None and not is_stdio(fastq_filename):
+        open(fastq_filename, "rb").close()
+    if not is_stdio(new_filename) and os.path.exists(new_filename):
+        open(new_filename, "wb").close()
+
+
+def open_checkpoint(fastq_filename, new_filename, run):
+    """
+    :param fastq_filename: the input filename
+    :param new_filename: the output filename - the manifest is '<new_filename>.checkpoint'
+    :param run: a dictionary of the options of the run (a manifest of a run with other options is not resumed)
+    :return: a new 'Checkpoint' - the output of a new run starts empty (an existing output, e.g. of a finished run
+             whose manifest was removed, is truncated rather than appended to again), or the one of an interrupted
+             run - its output is then truncated to the size recorded after its last finished partition, and the
+             partitions of an unfinished split are removed with their directory (the split starts over)
+    """
+    run = dict(run, input=fastq_filename, input_size=None if is_stdio(fastq_filename) else
+               os.path.getsize(fastq_filename))
+    run_checkpoint = Checkpoint(new_filename + CHECKPOINT_SUFFIX, run)
+    if not run_checkpoint.resumed:
+        start_output(new_filename)
+        run_checkpoint.start(0)
+        return run_checkpoint
+    output_size = os.path.getsize(new_filename) if os.path.exists(new_filename) else 0
+    if output_size > run_checkpoint.output_size:
+        with open(new_filename, "r+b") as new_fastq_file:
+            new_fastq_file.truncate(run_checkpoint.output_size)
+    if not run_checkpoint.stage_done("split"):
+        remove_partitions_dir(new_filename)
+    return run_checkpoint
+
+
+def partitions_base_filename(new_filename):
+    """
+    :param new_filename: the output filename
+    :return: the base filename of the partitions of the run (see 'split_file_to_sub_files_by_prefix') - they are
+             kept in a directory of their own next to the output (created if needed), so a run never touches the
+             partitions of another run, even of an output whose name starts with the same characters
+    """
+    partitions_dir = new_filename + PARTITIONS_DIR_SUFFIX
+    os.makedirs(partitions_dir, exist_ok=True)
+    return os.path.join(partitions_dir, os.path.basename(new_filename))
+
+
+def remove_partitions_dir(new_filename):
+    """
+    Removes the directory of the partitions of the run (see 'partitions_base_filename') with anything left in it
+    :param new_filename: the output filename
+    """
+    shutil.rmtree(new_filename + PARTITIONS_DIR_SUFFIX, ignore_errors=True)
+
+
+def resume_partitions(run_checkpoint):
+    """
+    :param run_checkpoint: the 'Checkpoint' of an interrupted run whose split finished
+    :return: (the unfinished partition filenames, a dictionary of partition filename -> the existing partition folded
+              into it, the unfinished existing partitions with no new reads) - the files of finished partitions that
+              the interrupted run left behind are removed
+    """
+    split_values = run_checkpoint.stage_values("split")
+    existing_partitions = split_values["existing_partitions"]
+    unfinished_files = ([], [])
+    for files, unfinished in zip((split_values["partitions"], split_values["existing_only"]), unfinished_files):
+        for filename in files:
+            if not run_checkpoint.is_done(filename):
+                unfinished.append(filename)
+                continue
+            for done_filename in (filename, existing_partitions.get(filename)):
+                if done_filename is not None and os.path.exists(done_filename):
+                    os.remove(done_filename)
+    return unfinished_files[0], existing_partitions, unfinished_files[1]
+
+
+def write_collapsed(new_fastq_file, text):
+    """
+    :param new_fastq_file: the open output file
+    :param text: the text of collapsed (or singleton) sequences, or a function to call once everything before it is
+                 written (e.g. 'finish_partition')
+    """
+    if callable(text):
+        text()
+        return
+    with current_metrics().stage("write") as stage:
+        new_fastq_file.write(text)
+        stage.add(bytes_written=len(text))
+
+
+def partition_key(sequence_line, prefix, buckets=None):
+    """
+    :param sequence_line: the sequence line of a fastq record
+    :param prefix: A length for the prefix of nucleotides for the separation of the input fastq file into subfiles.
+    :param buckets: if given, the number of hash buckets to separate the input by (instead of the prefix)
+    :return: the key of the partition the record belongs to
+    """
+    if buckets:
+        return "h%d" % (zlib.crc32(sequence_line.encode()) % buckets)
+    return sequence_line[:prefix]
+
+
+def resplit_bucket(sequence_line, depth, fanout=RESPLIT_FANOUT):
+    """
+    :return: the sub-partition of a record when re-splitting at 'depth' - a hash independent of 'partition_key'
+             (and of the hashes of the other depths), so records that share a partition are spread between its
+             sub-partitions
+    """
+    digest = hashlib.blake2b(sequence_line.encode(), digest_size=4, salt=b"resplit%d" % depth).digest()
+    return int.from_bytes(digest, "little") % fanout
+
+
+def split_temp_suffix(filename):
+    """
+    :param filename: a partition filename
+    :return: (the filename without its suffix, the suffix - 'TEMP_SUFFIX' or 'COMPRESSED_TEMP_SUFFIX')
+    """
+    suffix = COMPRESSED_TEMP_SUFFIX if filename.endswith(COMPRESSED_TEMP_SUFFIX) else TEMP_SUFFIX
+    return filename[:-len(suffix)], suffix
 
 
-def split_file_to_sub_files_by_prefix(generator_file, prefix, fastq_filename, generated_filename):
+def split_file_to_sub_files_by_prefix(generator_file, prefix, fastq_filename, generated_filename,
+                                      flush_threshold=DEFAULT_FLUSH_THRESHOLD, buckets=None, writer_queue_size=0,
+                                      compress_temp=False):
     """
-    :param generator_file: A generator of 4 lines of the file of 'FastQ' elements
+    :param generator_file: A generator of 'FastqRecord' objects (see 'fastq_reader.generate_fastq_records')
     :param prefix: A length for the prefix of nucleotides for the separation of the input fastq file into subfiles.
     :param fastq_filename: The requested filename (with relative path) of the fastq file that will be collapsed.
-    :param generated_filename: The fastq filename for the generator and for tqdm usage.
+    :param generated_filename: The fastq filename for the generator and for progress bar usage (its size in bytes),
+                               or None if the records are not read from a file as is (the progress is then open-ended).
+    :param flush_threshold: number of bytes buffered for each subfile before it is written
+    :param buckets: if given, the input is separated into this number of hash buckets instead of by prefix
+    :param writer_queue_size: if positive, the subfiles are written by a writer thread (see 'PartitionWriterPool')
+    :param compress_temp: whether the subfiles are compressed (with a fast level)
     :return: a list of files names
     """
-    list_of_file_names = []
-    splitting_progress_bar = tqdm(total=calc_num_lines_in_file(generated_filename),
-                                  desc="Splitting files into subfiles by prefixes ", bar_format=BAR_DEFAULT_VIEW)
-    lines = generator_file.__next__()
-    splitting_progress_bar.update(4)
-    if not lines[0]:
-        open(fastq_filename, 'w').close()
-    # created a small (10000 lines from file for example) dictionary and push
-    # to the fitted files by the prefix
-    writing_progress_bar = tqdm(total=calc_num_lines_in_file(generated_filename),
-                                desc="Writing data into temp files ", bar_format=BAR_DEFAULT_VIEW)
-    writing_progress_bar.update(4)
-    while lines[0]:
-        try:
-            dict_of_file_names = {}  # also frees the space after each time
-            if not lines[0]:
-                break
-            first_letter_of_seq = lines[1][:prefix]
-            file_name_for_seq = fastq_filename + "_" + first_letter_of_seq + ".temp"
+    temp_suffix = COMPRESSED_TEMP_SUFFIX if compress_temp else TEMP_SUFFIX
+    # progress is measured in bytes of the input, so there is no pass over the input just to size the bar
+    splitting_progress_bar = progress_bar(total=input_size(generated_filename) if generated_filename else None,
+                                          desc="Splitting files into subfiles by prefixes ", unit="B", unit_scale=True)
+    # subfiles are kept open (up to the file-descriptor limit) and written in large buffered chunks
+    with current_metrics().stage("split") as stage, \
+            PartitionWriterPool(flush_threshold=flush_threshold, writer_queue_size=writer_queue_size) \
+            as partition_writers:
+        num_records = 0
+        for fastq_record in generator_file:
             # so we could run more than one collapse at a time
-            if file_name_for_seq not in list_of_file_names:
-                list_of_file_names.append(file_name_for_seq)
-            if file_name_for_seq not in dict_of_file_names:
-                dict_of_file_names[file_name_for_seq] = [lines]
-            else:
-                dict_of_file_names[file_name_for_seq].append(lines)
-            lines = generator_file.__next__()
-            splitting_progress_bar.update(4)
-
-        except StopIteration:
-            for name in dict_of_file_names.keys():
-                with open(name, 'a+') as file:
-                    full_data_for_file = ""
-                    for lines_chunk in dict_of_file_names[name]:
-                        original_chunk = "".join(lines_chunk)
-                        full_data_for_file = full_data_for_file + original_chunk
-                    file.write(full_data_for_file)
-            break
-
-        for name in dict_of_file_names.keys():
-            with open(name, 'a+') as file:
-                full_data_for_file = ""
-                for lines_chunk in dict_of_file_names[name]:
-                    original_chunk = "".join(lines_chunk)
-                    full_data_for_file = full_data_for_file + original_chunk
-                file.write(full_data_for_file)
-            writing_progress_bar.update(4)
-
-    return list_of_file_names
-
-
-def fastq_collapse(fastq_filename, new_filename, prefix=3, write_count_flag=True):
+            file_name_for_seq = fastq_filename + "_" + partition_key(fastq_record.sequence, prefix, buckets) + \
+                temp_suffix
+            record = "\n".join(fastq_record) + "\n"
+            partition_writers.write(file_name_for_seq, record)
+            splitting_progress_bar.update(len(record))
+            num_records += 1
+        stage.add(records=num_records)
+    splitting_progress_bar.close()
+
+    return partition_writers.names
+
+
+def resplit_partition(filename, depth):
+    """
+    :param filename: a partition filename
+    :param depth: the re-splitting depth (selects the hash the partition is split by)
+    :return: a list of the sub-partition filenames (the partition file itself is removed)
+    """
+    base_filename, temp_suffix = split_temp_suffix(filename)
+    with PartitionWriterPool() as partition_writers:
+        for record in generate_fastq_records(filename):
+            partition_writers.write(base_filename + "_%d%s" % (resplit_bucket(record.sequence, depth), temp_suffix),
+                                    "\n".join(record) + "\n")
+    os.remove(filename)
+    return partition_writers.names
+
+
+def split_large_partitions(list_of_files, max_partition_size):
+    """
+    Re-splits every partition larger than 'max_partition_size' into up to 'RESPLIT_FANOUT' sub-partitions (by a hash
+    of the sequence, see 'resplit_bucket'), and again every sub-partition that is still too large, so the dictionary
+    of each partition stays within a predictable memory envelope even on skewed libraries (e.g. poly-A reads).
+    A partition may still be larger than 'max_partition_size' - the re-splitting stops at a partition that is
+    'MAX_RESPLIT_DEPTH' re-splits deep, or whose re-split gives a single sub-partition (all of its records hashed
+    alike, e.g. they are all of a single sequence) - that sub-partition is kept instead of it.
+    :param list_of_files: the partition filenames
+    :param max_partition_size: the maximal (uncompressed) size in bytes of a partition
+    :return: the new list of partition filenames (in the same order - sub-partitions replace their partition)
+    """
+    new_list_of_files = []
+    files_to_check = [(filename, 0) for filename in reversed(list_of_files)]
+    while files_to_check:
+        filename, depth = files_to_check.pop()
+        if depth >= MAX_RESPLIT_DEPTH or uncompressed_size(filename) <= max_partition_size:
+            new_list_of_files.append(filename)
+            continue
+        sub_files = resplit_partition(filename, depth)
+        if len(sub_files) == 1:
+            new_list_of_files.append(sub_files[0])
+            continue
+        files_to_check.extend((sub_filename, depth + 1) for sub_filename in reversed(sub_files))
+    return new_list_of_files
+
+
+def record_partition_metrics(list_of_files):
+    """
+    Records the number and (uncompressed) sizes of the partitions in the current metrics
+    :param list_of_files: the partition filenames
+    """
+    metrics = current_metrics()
+    if not metrics.enabled:
+        return
+    sizes = [uncompressed_size(filename) for filename in list_of_files]
+    metrics.add("split", bytes_written=sum(sizes))
+    metrics.set("partitions", {"count": len(sizes), "total_bytes": sum(sizes), "max_bytes": max(sizes, default=0),
+                               "mean_bytes": sum(sizes) // len(sizes) if sizes else 0})
+
+
+def count_sequences_in_file(filename):
+    """
+    :param filename: a fastq filename
+    :return: a 'CountingBloomFilter' of the sequences of the file
+    """
+    sequences_filter = CountingBloomFilter(estimate_num_of_records(filename))
+    for record in generate_fastq_records(filename):
+        sequences_filter.add(record.sequence)
+    return sequences_filter
+
+
+def write_singletons(generator_file, sequences_filter, new_fastq_file, write_count_flag):
+    """
+    Writes the records whose sequence certainly appears once straight to the output, and yields all the others
+    (the candidate duplicates).
+    :param generator_file: A generator of 'FastqRecord' objects (see 'fastq_reader.generate_fastq_records')
+    :param sequences_filter: a 'CountingBloomFilter' of all the sequences of the file
+    :param new_fastq_file: the open output file
+    :param write_count_flag: a flag indicating whether to write sequence counts to the output file
+    """
+    batch = []
+    num_singletons = 0
+    for record in generator_file:
+        if sequences_filter.count(record.sequence) != 1:
+            yield record
+            continue
+        if write_count_flag:
+            record.header = record.header + "%s:%d" % ('_count', 1)
+        batch.append("\n".join(record) + "\n")
+        num_singletons += 1
+        if len(batch) >= SINGLETONS_BATCH_SIZE:
+            new_fastq_file.write("".join(batch))
+            batch = []
+    new_fastq_file.write("".join(batch))
+    record_collapse_metrics(num_singletons, num_singletons)
+
+
+def collapse_fastq_file(filename, new_filename, write_count_flag, generating_fastq_progress_bar=None,
+                        singleton_filter=False, validate=False, read_ahead=0, existing_filename=None,
+                        new_fastq_file=None, **collapse_kwargs):
+    """
+    Collapses a fastq file (a partition or a whole input) and appends the collapsed sequences to 'new_filename'.
+    :param filename: the fastq filename to collapse
+    :param new_filename: the filename the collapsed sequences are appended to
+    :param write_count_flag: a flag indicating whether to write sequence counts to the output file
+    :param generating_fastq_progress_bar: A progress bar that will update while the collapsed sequences are written
+    :param singleton_filter: if True, the file is read twice - the first pass counts the sequences in a
+                             'CountingBloomFilter', and in the second pass sequences that certainly appear once are
+                             written straight to the output, so only candidate duplicates take memory
+    :param validate: whether to validate the records - partitions were validated when the input was split, so only
+                     a raw input file needs it
+    :param read_ahead: number of blocks of the file read ahead in a reader thread (see 'fastq_reader.generate_blocks')
+    :param existing_filename: if given, an existing collapsed file (or a partition of it) that the collapsed
+                              sequences are folded into (see 'fold_existing_records')
+    :param new_fastq_file: the output, if it is already open (e.g. once for all the partitions) - otherwise
+                           'new_filename' is opened for append (see 'open_collapsed_output')
+    :param collapse_kwargs: keyword arguments to 'collapse_fastq'
+    """
+    if generating_fastq_progress_bar is None:
+        generating_fastq_progress_bar = progress_bar(disable=True)
+    with ExitStack() as output:
+        if new_fastq_file is None:
+            new_fastq_file = output.enter_context(open_collapsed_output(new_filename))
+        if singleton_filter:
+            sequences_filter = count_sequences_in_file(filename)
+            candidates = write_singletons(generate_fastq_records(filename, validate=validate, read_ahead=read_ahead),
+                                          sequences_filter, new_fastq_file, write_count_flag)
+            collapsed_fastq_dict = collapse_fastq(candidates, **collapse_kwargs)
+        else:
+            collapsed_fastq_dict = collapse_fastq(generate_fastq_records(filename, validate=validate,
+                                                                         read_ahead=read_ahead), **collapse_kwargs)
+        existing_records = None
+        if existing_filename is not None:
+            generating_fastq_progress_bar.reset(total=None)  # the number of existing sequences is not known
+            existing_records = generate_fastq_records(existing_filename)
+        else:
+            generating_fastq_progress_bar.reset(total=len(collapsed_fastq_dict))
+        return generate_fastq_file_from_dict(collapsed_fastq_dict, new_filename, generating_fastq_progress_bar,
+                                             write_count_flag, existing_records, new_fastq_file)
+
+
+def collapse_partition(partition_args):
+    """
+    Collapses a single prefix partition into its own part file (may run in a worker process).
+    :param partition_args: a tuple of (partition filename, part filename, write_count_flag, collapse_options) -
+                           'collapse_options' being a dictionary of keyword arguments to 'collapse_fastq_file'
+    :return: (the part filename, a report of the metrics of the partition - see 'metrics.Metrics.report') - the
+             partition is removed once its part is appended to the output (see 'finish_partition')
+    """
+    filename, part_filename, write_count_flag, collapse_options = partition_args
+    metrics = reset_worker_metrics()
+    # a part of an interrupted run is overwritten; the workers compress their parts concurrently, each in one thread
+    with open_file(part_filename, "w") as part_file:
+        collapse_fastq_file(filename, part_filename, write_count_flag, new_fastq_file=part_file, **collapse_options)
+    return part_filename, metrics.report() if metrics.enabled else None
+
+
+def collapse_partitions_in_parallel(list_of_files, new_filename, write_count_flag, workers, collapse_options,
+                                    existing_partitions=None, run_checkpoint=None):
+    """
+    Collapses the prefix partitions in a pool of processes. The partitions never share a sequence, so each one is
+    collapsed independently into a part file; the parts are appended to the output in the order of 'list_of_files'.
+    The parts of a compressed output are compressed by the workers and appended as they are (concatenated BGZF files
+    are BGZF).
+    At most 'workers' partitions (and so 'workers' dictionaries) are held in memory at the same time.
+    :param list_of_files: the partition filenames (see 'split_file_to_sub_files_by_prefix')
+    :param new_filename: The requested filename (with relative path) of the fastq file that will be created.
+    :param write_count_flag: a flag indicating whether to write sequence counts to the output file
+    :param workers: number of worker processes
+    :param collapse_options: a dictionary of keyword arguments to 'collapse_fastq_file'
+    :param existing_partitions: a dictionary of partition filename -> the partition of an existing collapsed file
+                                that it is folded into (incremental collapse)
+    :param run_checkpoint: the 'Checkpoint' of the run, if any - each partition is recorded in it once its part is
+                           appended to the output
+    """
+    existing_partitions = existing_partitions or {}
+    part_suffix = ".part.gz" if is_compressed(new_filename) else ".part"
+    partition_args = [(filename, split_temp_suffix(filename)[0] + part_suffix, write_count_flag,
+                       dict(collapse_options, existing_filename=existing_partitions.get(filename)))
+                      for filename in list_of_files]
+    collapsing_progress_bar = progress_bar(total=len(list_of_files), desc="Collapsing into relevant files ")
+    with Pool(workers) as pool, open(new_filename, "ab") as new_fastq_file:
+        # chunksize=1 - a worker takes a new partition only after it finished the previous one
+        for args, (_, partition_metrics) in zip(partition_args,
+                                                pool.imap(collapse_partition, partition_args, chunksize=1)):
+            current_metrics().merge(partition_metrics)
+            part_filename = args[1]
+            with open(part_filename, "rb") as part_file:
+                shutil.copyfileobj(part_file, new_fastq_file)
+            finish_partition(args[0], args[3]["existing_filename"], run_checkpoint, new_filename, new_fastq_file)
+            os.remove(part_filename)
+            collapsing_progress_bar.update(1)
+    os.chmod(new_filename, 0o777)
+    collapsing_progress_bar.close()
+
+
+def collapse_partitions_pipelined(list_of_files, new_filename, write_count_flag, collapse_options,
+                                  queue_size=DEFAULT_QUEUE_SIZE, existing_partitions=None, run_checkpoint=None):
+    """
+    Collapses the partitions one after the other with overlapped I/O - each partition is read ahead in a reader thread
+    while it is collapsed, and the collapsed sequences are written by a writer thread while the next partition is
+    read and collapsed. The output is opened once for all the partitions.
+    :param list_of_files: the partition filenames (see 'split_file_to_sub_files_by_prefix')
+    :param new_filename: The requested filename (with relative path) of the fastq file that will be created.
+    :param write_count_flag: a flag indicating whether to write sequence counts to the output file
+    :param collapse_options: a dictionary of keyword arguments to 'collapse_fastq_file'
+    :param queue_size: number of blocks read ahead, and of chunks of collapsed sequences waiting to be written
+    :param existing_partitions: a dictionary of partition filename -> the partition of an existing collapsed file
+                                that it is folded into (incremental collapse)
+    :param run_checkpoint: the 'Checkpoint' of the run, if any - each partition is recorded in it (by the writer
+                           thread) once all of its sequences are written
+    """
+    existing_partitions = existing_partitions or {}
+    with open_collapsed_output(new_filename) as new_fastq_file, \
+            WriterThread(partial(write_collapsed, new_fastq_file), queue_size) as writer:
+        for filename in progress_bar(list_of_files, desc="Collapsing into relevant files "):
+            records = generate_fastq_records(filename, read_ahead=queue_size)
+            if collapse_options["singleton_filter"]:
+                records = write_singletons(records, count_sequences_in_file(filename), writer, write_count_flag)
+            collapsed_fastq_dict = collapse_fastq(records, collapse_options["merge_strategy"],
+                                                  collapse_options["compact"], collapse_options["max_pending_bytes"])
+            existing_filename = existing_partitions.get(filename)
+            existing_records = None if existing_filename is None else generate_fastq_records(existing_filename)
+            for chunk in generate_collapsed_chunks(collapsed_fastq_dict, write_count_flag,
+                                                   existing_records=existing_records):
+                writer.write(chunk)
+            del collapsed_fastq_dict  # before the next partition is collapsed - one dictionary at a time
+            # the partition is removed only after its sequences are written
+            writer.write(partial(finish_partition, filename, existing_filename, run_checkpoint, new_filename,
+                                 new_fastq_file))
+    os.chmod(new_filename, 0o777)
+
+
+def collapse_in_memory(fastq_filename, new_filename, write_count_flag, collapse_options, generator_file=None):
+    """
+    Collapses the whole input in a single dictionary - one pass over the input (two with the singleton filter) and
+    no temp files.
+    :param fastq_filename: The requested filename (with relative path) of the fastq file that will be collapsed.
+    :param new_filename: The requested filename (with relative path) of the fastq file that will be created.
+    :param write_count_flag: a flag indicating whether to write sequence counts to the output file
+    :param collapse_options: a dictionary of keyword arguments to 'collapse_fastq_file'
+    :param generator_file: if given, a generator of validated records collapsed instead of the records of
+                           'fastq_filename' (the singleton filter, which reads its input twice, does not apply to it)
+    """
+    generating_fastq_progress_bar = progress_bar(desc="Generating Fastq file from newly created dictionary ")
+    if generator_file is None:
+        collapse_fastq_file(fastq_filename, new_filename, write_count_flag, generating_fastq_progress_bar,
+                            validate=True, **collapse_options)
+    else:
+        collapsed_fastq_dict = collapse_fastq(generator_file, collapse_options["merge_strategy"],
+                                              collapse_options["compact"], collapse_options["max_pending_bytes"])
+        existing_filename = collapse_options.get("existing_filename")
+        generating_fastq_progress_bar.reset(total=None if existing_filename else len(collapsed_fastq_dict))
+        generate_fastq_file_from_dict(collapsed_fastq_dict, new_filename, generating_fastq_progress_bar,
+                                      write_count_flag,
+                                      generate_fastq_records(existing_filename, validate=True)
+                                      if existing_filename else None)
+    generating_fastq_progress_bar.close()
+
+
+def merge_window_qualities(window, quality_aggregator):
+    """
+    :param window: a dictionary of the format: { 'string' : ['FastQ' object, 'int'] } (see 'collapse_fastq_to_dict')
+    :param quality_aggregator: the 'QualityAggregator' the duplicates of the window were added to
+    :return: the entries of the window, with the merged quality scores
+    """
+    for sequence, quality in quality_aggregator.merged():
+        window[sequence][0].quality = quality
+    return window.values()
+
+
+def collapse_sorted_records(sorted_records, merge_strategy=DEFAULT_MERGE_STRATEGY, window_size=SORT_WINDOW_SIZE):
+    """
+    :param sorted_records: validated 'FastQ' records sorted by sequence - duplicates in their order in the input
+    :param merge_strategy: how the quality scores of duplicates are merged (see 'quality_merge.merge_qualities')
+    :param window_size: number of collapsed sequences held in memory between quality merges
+    :return: yields ['FastQ' object, 'int'] for every sequence, in sorted order - the first occurrence of the
+             sequence with the merged quality score, and the sequence counter (as the values of
+             'collapse_fastq_to_dict')
+    """
+    quality_aggregator = QualityAggregator(merge_strategy)
+    window = {}
+    for sequence, records in groupby(sorted_records, key=attrgetter("sequence")):
+        seq = next(records)
+        count = 1
+        for record in records:
+            count += 1
+            quality_aggregator.add(sequence, record.quality, seq.quality)
+        window[sequence] = [seq, count]
+        if len(window) >= window_size:
+            yield from merge_window_qualities(window, quality_aggregator)
+            window = {}
+    yield from merge_window_qualities(window, quality_aggregator)
+
+
+def collapse_by_sort(generator_file, new_filename, write_count_flag, merge_strategy=DEFAULT_MERGE_STRATEGY,
+                     run_size=SORT_RUN_SIZE):
+    """
+    Collapses by an external sort of the records by sequence - runs of 'run_size' records are sorted in memory and
+    spilled next to the output, and the merged runs are collapsed in a single streaming pass. Memory is bounded by
+    'run_size' whatever the number of unique sequences.
+    :param generator_file: A generator of validated 'FastqRecord' objects (see 'fastq_reader.generate_fastq_records')
+    :param new_filename: The requested filename (with relative path) of the fastq file that will be created.
+    :param write_count_flag: a flag indicating whether to write sequence counts to the output file
+    :param merge_strategy: how the quality scores of duplicates are merged (see 'quality_merge.merge_qualities')
+    :param run_size: number of records sorted in memory at a time
+    """
+    sorted_records = external_sort(generator_file, key=attrgetter("sequence"),
+                                   run_size=run_size, temp_dir=os.path.dirname(os.path.abspath(new_filename)))
+    generating_fastq_progress_bar = progress_bar(desc="Generating Fastq file from sorted sequences ")
+    num_sequences = num_reads = 0
+    num_bytes = 0
+    with open_collapsed_output(new_filename) as new_fastq_file, current_metrics().stage("write") as stage:
+        for fastq_obj, count in collapse_sorted_records(sorted_records, merge_strategy):
+            if write_count_flag:
+                fastq_obj.header = fastq_obj.header + "%s:%d" % ('_count', count)
+            record = "\n".join(fastq_obj) + "\n"
+            new_fastq_file.write(record)
+            generating_fastq_progress_bar.update(1)
+            num_sequences += 1
+            num_reads += count
+            num_bytes += len(record)
+        stage.add(records=num_sequences, bytes_written=num_bytes)
+    record_collapse_metrics(num_sequences, num_reads)
+    os.chmod(new_filename, 0o777)
+    generating_fastq_progress_bar.close()
+
+
+def fastq_collapse(fastq_filename, new_filename, prefix=3, write_count_flag=True, workers=1,
+                   merge_strategy=DEFAULT_MERGE_STRATEGY, mem_budget=None, buckets=None, max_partition_size=None,
+                   compact=False, singleton_filter=False, method=DEFAULT_COLLAPSE_METHOD, run_size=SORT_RUN_SIZE,
+                   generator_file=None, pipelined=False, queue_size=DEFAULT_QUEUE_SIZE, compress_temp=False,
+                   existing_filename=None, checkpoint=False, checkpoint_values=None, memory_estimate=None):
     """
     :param fastq_filename: The requested filename (with relative path) of the fastq file that will be collapsed.
     :param new_filename: The requested filename (with relative path) of the fastq file that will be created.
     :param prefix: A length for the prefix of nucleotides for the separation of the input fastq file into subfiles.
     :param write_count_flag: a flag indicating whether to write sequence counts to the output file
+    :param workers: number of partitions to collapse concurrently (each in a separate process)
+    :param merge_strategy: how the quality scores of duplicates are merged - 'max', 'mean' or 'sum'
+    :param mem_budget: memory budget in bytes - if the input is estimated to fit in it, it is collapsed in memory
+                       in a single pass; otherwise (or if None) the input is split into prefix partitions
+    :param buckets: if given, the input is split into this number of hash buckets instead of by prefix
+    :param max_partition_size: partitions larger than this (in bytes) are re-split; by default it is derived from
+                               'mem_budget' so that 'workers' partition dictionaries fit in it together
+    :param compact: collapse into compact tables (see 'collapse_table.CollapseTable') instead of dictionaries
+    :param singleton_filter: read each partition twice, so that sequences that certainly appear once are written
+                             straight to the output instead of taking memory (see 'collapse_fastq_file')
+    :param method: 'partition' - collapse prefix partitions in memory, or 'sort' - collapse by an external sort
+                   (see 'collapse_by_sort'; the partitioning options do not apply to it)
+    :param run_size: number of records sorted in memory at a time by the 'sort' method
+    :param generator_file: if given, a generator of validated records (e.g. trimmed records, see 'fastq_pipeline')
+                           that is collapsed instead of the records of 'fastq_filename' - the file is then used only
+                           to estimate the memory needed
+    :param pipelined: overlap reading, collapsing and writing - the input and the partitions are read ahead in
+                      reader threads, and the partitions and the output are written by writer threads
+    :param queue_size: number of blocks (or chunks) waiting in each queue between the threads of 'pipelined'
+    :param compress_temp: whether the temp partitions are compressed (with a fast level)
+    :param existing_filename: incremental collapse - an existing collapsed file (written with counts and the 'max'
+                              merge strategy) that the new reads are folded into (see 'fold_existing_records'); it is
+                              split into partitions by the same keys as the new reads (and is never re-split), so
+                              only the new reads of a partition are held in memory
+    :param checkpoint: keep a manifest of the finished stages and partitions next to the output (see 'Checkpoint'),
+                       and resume the run it records if it was interrupted
+    :param checkpoint_values: a dictionary of additional options identifying the run in the manifest (e.g. the
+                              trimming range of 'fastq_pipeline')
+    :param memory_estimate: the estimated number of bytes needed to collapse the input at once, compared with
+                            'mem_budget' (by default it is estimated from 'fastq_filename', see
+                            'estimate_collapse_memory')
     :return: a list of files names
         """
-    with open(fastq_filename, "r") as fastq_file:  # Read + Write, 'line buffering'
+    if method not in COLLAPSE_METHODS:
+        raise ValueError("Unknown collapse method '%s' - should be one of: %s" % (method, ", ".join(COLLAPSE_METHODS)))
+    if existing_filename is not None:
+        check_incremental_collapse(existing_filename, new_filename, merge_strategy, method, singleton_filter)
+    if checkpoint and method != "partition":
+        raise ValueError("A checkpoint is supported by the 'partition' method only")
+    if not is_stdio(fastq_filename) and os.path.abspath(fastq_filename) == os.path.abspath(new_filename):
+        raise ValueError("The output file can not be the input file")
+    records_from_file = generator_file is None
+    if not checkpoint:  # a checkpointed run empties its output when it starts (see 'open_checkpoint')
+        start_output(new_filename, fastq_filename if records_from_file else None)
+    read_ahead = queue_size if pipelined else 0
+    if records_from_file:
         # creates a generator for the file
-        generator_file = generatesKLines(fastq_file, num_lines=4)
+        generator_file = generate_fastq_records(fastq_filename, validate=True, read_ahead=read_ahead)
+    if method == "sort":
+        collapse_by_sort(generator_file, new_filename, write_count_flag, merge_strategy, run_size)
+        return
+    # the buffer of pending qualities of each partition is its share of the budget (the default without a budget)
+    collapse_options = {"merge_strategy": merge_strategy, "compact": compact, "singleton_filter": singleton_filter,
+                        "read_ahead": read_ahead,
+                        "max_pending_bytes": max_pending_bytes_for_budget(mem_budget, workers)}
+    run_checkpoint = None
+    if checkpoint:
+        # the options that decide the partitions and the output (not how they are computed, e.g. the workers)
+        run_checkpoint = open_checkpoint(fastq_filename, new_filename,
+                                         dict(checkpoint_values or {}, prefix=prefix, count=write_count_flag,
+                                              merge_strategy=merge_strategy, mem_budget=mem_budget, buckets=buckets,
+                                              max_partition_size=max_partition_size, compact=compact,
+                                              singleton_filter=singleton_filter, compress_temp=compress_temp,
+                                              existing=existing_filename))
+    if memory_estimate is None and mem_budget is not None:
+        memory_estimate = estimate_collapse_memory(fastq_filename, compact, max_pending_bytes_for_budget(mem_budget))
+    if mem_budget is not None and memory_estimate <= mem_budget and \
+            (records_from_file or not singleton_filter):
+        collapse_in_memory(fastq_filename, new_filename, write_count_flag,
+                           dict(collapse_options, existing_filename=existing_filename,
+                                max_pending_bytes=max_pending_bytes_for_budget(mem_budget)),
+                           None if records_from_file else generator_file)
+        if run_checkpoint is not None:
+            run_checkpoint.remove()
+        return
+    if run_checkpoint is not None and run_checkpoint.stage_done("split"):
+        list_of_files, existing_partitions, existing_files = resume_partitions(run_checkpoint)
+    else:
         # splitting the fastqs to files by their seq prefix
-        list_of_files = split_file_to_sub_files_by_prefix(generator_file, prefix, new_filename, fastq_filename)
+        partitions_base = partitions_base_filename(new_filename)
+        list_of_files = split_file_to_sub_files_by_prefix(generator_file, prefix, partitions_base,
+                                                          fastq_filename if records_from_file else None,
+                                                          buckets=buckets, writer_queue_size=read_ahead,
+                                                          compress_temp=compress_temp)
+        if not list_of_files:
+            open_collapsed_output(new_filename, 'w').close()
+        existing_partitions, existing_files = {}, []
+        if existing_filename is not None:
+            # the partitions are not re-split - the existing partition of a key must match the partition of its
+            # new reads
+            existing_partitions, existing_files = split_existing_file(existing_filename, list_of_files, prefix,
+                                                                      partitions_base, buckets, read_ahead,
+                                                                      compress_temp)
+        else:
+            if max_partition_size is None and mem_budget is not None:
+                max_partition_size = max_partition_size_for_budget(mem_budget, workers, compact)
+            if max_partition_size is not None:
+                list_of_files = split_large_partitions(list_of_files, max_partition_size)
+        if run_checkpoint is not None:
+            run_checkpoint.finish_stage("split", partitions=list_of_files, existing_partitions=existing_partitions,
+                                        existing_only=existing_files)
+    record_partition_metrics(list_of_files)
+    if workers > 1:
+        collapse_partitions_in_parallel(list_of_files, new_filename, write_count_flag, workers, collapse_options,
+                                        existing_partitions, run_checkpoint)
+        append_existing_partitions(existing_files, new_filename, write_count_flag, run_checkpoint)
+    elif pipelined:
+        collapse_partitions_pipelined(list_of_files, new_filename, write_count_flag, collapse_options, queue_size,
+                                      existing_partitions, run_checkpoint)
+        append_existing_partitions(existing_files, new_filename, write_count_flag, run_checkpoint)
+    else:
         # collapsing each file
-        generating_fastq_progress_bar = tqdm(desc="Generating Fastq file from newly created dictionary ",
-                                             bar_format=BAR_DEFAULT_VIEW)
-        for filename in tqdm(list_of_files,
-                             desc="Collapsing into relevant files ", bar_format=BAR_DEFAULT_VIEW):
-            # creating generator for file
-            with open(filename, "r") as file:
-                generator_file = generatesKLines(file, num_lines=4)
-                # collapse each file
-                collapsed_fastq_dict = collapse_fastq_to_dict(generator_file)  # "collapsing" it (to a dict)
-                generating_fastq_progress_bar.reset(total=len(collapsed_fastq_dict))
-                # sending all the collapsing to the same file
-                new_filename = generate_fastq_file_from_dict(collapsed_fastq_dict, new_filename,
-                                                             generating_fastq_progress_bar, write_count_flag)
-                # generating the new "collapsed" file
-            os.remove(filename)
+        generating_fastq_progress_bar = progress_bar(desc="Generating Fastq file from newly created dictionary ")
+        # the output is opened once - sending all the collapsing to the same file
+        with open_collapsed_output(new_filename) as new_fastq_file:
+            for filename in progress_bar(list_of_files, desc="Collapsing into relevant files "):
+                collapse_fastq_file(filename, new_filename, write_count_flag, generating_fastq_progress_bar,
+                                    existing_filename=existing_partitions.get(filename),
+                                    new_fastq_file=new_fastq_file, **collapse_options)
+                finish_partition(filename, existing_partitions.get(filename), run_checkpoint, new_filename,
+                                 new_fastq_file)
+            append_existing_partitions(existing_files, new_filename, write_count_flag, run_checkpoint,
+                                       new_fastq_file)
+    if run_checkpoint is not None:
+        run_checkpoint.remove()
+    remove_partitions_dir(new_filename)
+
+
+def join_pair(record_1, record_2):
+    """
+    :param record_1: a 'FastqRecord' of R1
+    :param record_2: the record of its mate (R2)
+    :return: a single 'FastqRecord' of the pair, collapsed as any record - its sequence is the sequences of both
+             mates (so pairs are duplicates only if both of their mates are), and its partition is chosen by the R1
+             prefix; the headers and the plus lines of both mates are kept, to be split back (see 'split_pairs_file')
+    """
+    # plain '+' lines stay a single '+' (so a compact table does not keep a plus line for every pair)
+    plus_line = record_1.plus_line if record_1.plus_line == record_2.plus_line == "+" else \
+        record_1.plus_line + PAIR_SEPARATOR + record_2.plus_line
+    return FastqRecord(record_1.header + PAIR_SEPARATOR + record_2.header,
+                       record_1.sequence + PAIR_SEPARATOR + record_2.sequence, plus_line,
+                       record_1.quality + PAIR_QUALITY_SEPARATOR + record_2.quality)
+
+
+def split_pairs_file(pairs_filename, new_filename, paired_new_filename, write_count_flag):
+    """
+    Splits a collapsed file of joined pairs (see 'join_pair') into the collapsed R1 and R2 files - the records of
+    both are in the same order, and each mate gets the count of its pair
+    :param pairs_filename: the collapsed file of joined pairs
+    :param new_filename: the R1 output filename
+    :param paired_new_filename: the R2 output filename
+    :param write_count_flag: whether the records of the pairs file have counts
+    """
+    with open_collapsed_output(new_filename, "w") as new_fastq_file, \
+            open_collapsed_output(paired_new_filename, "w") as paired_fastq_file:
+        for records in generate_fastq_record_batches(pairs_filename):
+            chunk_1, chunk_2 = [], []
+            for header, sequence, plus_line, quality in records:
+                header_1, header_2 = header.split(PAIR_SEPARATOR, 1)
+                plus_lines = plus_line.split(PAIR_SEPARATOR, 1)
+                plus_line_1, plus_line_2 = plus_lines if len(plus_lines) == 2 else plus_lines * 2  # plain '+' lines
+                if write_count_flag:
+                    header_2, _, count = header_2.rpartition(COUNT_SUFFIX)
+                    header_1 += COUNT_SUFFIX + count
+                    header_2 += COUNT_SUFFIX + count
+                sequence_1, sequence_2 = sequence.split(PAIR_SEPARATOR, 1)
+                chunk_1.append("\n".join((header_1, sequence_1, plus_line_1, quality[:len(sequence_1)])))
+                chunk_2.append("\n".join((header_2, sequence_2, plus_line_2, quality[len(sequence_1) + 1:])))
+            new_fastq_file.write("\n".join(chunk_1) + "\n")
+            paired_fastq_file.write("\n".join(chunk_2) + "\n")
+    for filename in (new_filename, paired_new_filename):
+        os.chmod(filename, 0o777)
+
+
+def fastq_collapse_paired(fastq_filename, paired_filename, new_filename, paired_new_filename, prefix=DEFAULT_PREFIX,
+                          write_count_flag=True, pairs=None, **collapse_kwargs):
+    """
+    Collapses paired-end reads - pairs are duplicates if both of their mates are. The mates are read in lockstep
+    and joined into single records (see 'join_pair'), collapsed as in 'fastq_collapse' (with any of its options),
+    and the collapsed pairs are split into synchronized R1 and R2 outputs.
+    :param fastq_filename: the R1 fastq file
+    :param paired_filename: the R2 fastq file, its records in the same order
+    :param new_filename: the collapsed R1 file that will be created
+    :param paired_new_filename: the collapsed R2 file that will be created
+    :param prefix: A length for the prefix of nucleotides (of R1) for the separation of the pairs into subfiles.
+    :param write_count_flag: a flag indicating whether to write the counts of the pairs to the output files
+    :param pairs: if given, a generator of validated pairs of records (e.g. trimmed pairs, see 'fastq_pipeline')
+                  that are collapsed instead of the pairs of the files - the files are then used only to estimate
+                  the memory needed
+    :param collapse_kwargs: keyword arguments to 'fastq_collapse'
+    """
+    if paired_new_filename is None:
+        raise ValueError("A paired-end collapse needs the filename of the collapsed R2 file")
+    if collapse_kwargs.get("existing_filename") is not None:
+        raise ValueError("An incremental collapse of paired-end reads is not supported")
+    if os.path.abspath(new_filename) == os.path.abspath(paired_new_filename):
+        raise ValueError("The paired-end outputs should be different files")
+    pairs_filename = new_filename + PAIRS_SUFFIX + (".gz" if collapse_kwargs.get("compress_temp") else "")
+    if pairs is None:
+        pairs = generate_paired_records(fastq_filename, paired_filename, validate=True,
+                                        read_ahead=collapse_kwargs.get("queue_size", DEFAULT_QUEUE_SIZE)
+                                        if collapse_kwargs.get("pipelined") else 0)
+    if collapse_kwargs.get("mem_budget") is not None:
+        collapse_kwargs["memory_estimate"] = sum(estimate_collapse_memory(filename, collapse_kwargs.get("compact"), 0)
+                                                 for filename in (fastq_filename, paired_filename)) + \
+            max_pending_bytes_for_budget(collapse_kwargs["mem_budget"])
+    collapse_kwargs["checkpoint_values"] = dict(collapse_kwargs.get("checkpoint_values") or {},
+                                                paired=paired_filename)
+    fastq_collapse(fastq_filename, pairs_filename, prefix, write_count_flag,
+                   generator_file=(join_pair(record_1, record_2) for record_1, record_2 in pairs), **collapse_kwargs)
+    split_pairs_file(pairs_filename, new_filename, paired_new_filename, write_count_flag)
+    os.remove(pairs_filename)
+
+
+def check_incremental_collapse(existing_filename, new_filename, merge_strategy, method, singleton_filter):
+    """
+    Raises a ValueError if an incremental collapse (see 'fold_existing_records') is not possible with the options
+    """
+    if os.path.abspath(existing_filename) == os.path.abspath(new_filename):
+        raise ValueError("The existing collapsed file can not be the output file (the output is appended to)")
+    if merge_strategy != "max":
+        raise ValueError("An incremental collapse needs the 'max' merge strategy - the merged qualities of the other "
+                         "strategies can not be merged again")
+    if method != "partition":
+        raise ValueError("An incremental collapse is supported by the 'partition' method only")
+    if singleton_filter:
+        raise ValueError("An incremental collapse can not use the singleton filter - a new singleton may be a "
+                         "duplicate of an existing sequence")
+    first_record = next(generate_fastq_records(existing_filename), None)
+    if first_record is not None:  # fails early, before any partition is written
+        parse_count_header(first_record.header)
+
+
+def write_metrics_report(filename):
+    """
+    Writes the metrics of the collapse (with its duplicate ratio) as a JSON report
+    :param filename: the report filename
+    """
+    metrics = current_metrics()
+    metrics.set("duplicate_ratio", round(duplicate_ratio(metrics), 6))
+    metrics.write_report(filename)
 
 
 def param_description():
@@ -197,7 +1146,26 @@ def param_description():
           "new_filename: the name of the new file that would be created\n"
           "numLinesIter: size of chunks to read to memory \n"
           "prefix: size of prefix we split the files by while processing \n"
-          "count: optional flag, indicating whether the collapsed file should include counts of each sequence"
+          "count: optional flag, indicating whether the collapsed file should include counts of each sequence\n"
+          "workers: optional, number of prefix partitions collapsed concurrently (default 1)\n"
+          "merge: optional, how quality scores of duplicates are merged - max (default), mean or sum\n"
+          "mem: optional, memory budget (e.g. 8G) - inputs estimated to fit are collapsed without temp files\n"
+          "buckets: optional, split into this number of hash buckets instead of by prefix\n"
+          "max-partition-size: optional, partitions larger than this (e.g. 1G) are re-split by a second hash\n"
+          "compact: optional flag, collapse into compact tables (2-bit packed sequences) - about half the memory\n"
+          "singleton-filter: optional flag, stream reads that appear once straight to the output (two passes)\n"
+          "method: optional, partition (default) or sort - external sort by sequence with bounded memory\n"
+          "run-size: optional, number of records sorted in memory at a time by the sort method\n"
+          "metrics: optional, a JSON file for a report of the metrics of each stage of the run\n"
+          "profile: optional, a file for cProfile stats of the run\n"
+          "no-progress: optional flag, do not show progress bars\n"
+          "pipelined: optional flag, overlap reading, collapsing and writing in reader and writer threads\n"
+          "queue-size: optional, number of blocks waiting in each queue of pipelined (default 4)\n"
+          "compress-temp: optional flag, compress the temp partitions with a fast level\n"
+          "existing: optional, an existing collapsed file (with counts) to fold the new reads into\n"
+          "checkpoint: optional flag, keep a manifest of the finished partitions, so an interrupted run is resumed\n"
+          "paired: optional, the R2 file of paired-end reads - pairs are collapsed if both mates are duplicates\n"
+          "paired-out: the collapsed R2 file (needed with paired)\n"
           "Output: \"collapsed\" fastq format file")
 
 
@@ -248,8 +1216,30 @@ if __name__ == "__main__":
         if not arguments["--count"]:
             write_count_flag = False
         if arguments["<prefix>"]:
-            prefix = arguments["<prefix>"]
-        fastq_collapse(fastq_filename, new_filename, prefix, write_count_flag)
+            prefix = int(arguments["<prefix>"])
+        mem_budget = parse_memory_size(arguments["--mem"]) if arguments["--mem"] else None
+        buckets = int(arguments["--buckets"]) if arguments["--buckets"] else None
+        max_partition_size = parse_memory_size(arguments["--max-partition-size"]) \
+            if arguments["--max-partition-size"] else None
+        if arguments["--no-progress"]:
+            set_progress_bars(False)
+        if arguments["--metrics"]:
+            enable_metrics()
+        collapse_kwargs = {"workers": int(arguments["--workers"]), "merge_strategy": arguments["--merge"],
+                           "mem_budget": mem_budget, "buckets": buckets, "max_partition_size": max_partition_size,
+                           "compact": arguments["--compact"], "singleton_filter": arguments["--singleton-filter"],
+                           "method": arguments["--method"], "run_size": int(arguments["--run-size"]),
+                           "pipelined": arguments["--pipelined"], "queue_size": int(arguments["--queue-size"]),
+                           "compress_temp": arguments["--compress-temp"], "existing_filename": arguments["--existing"],
+                           "checkpoint": arguments["--checkpoint"]}
+        if arguments["--paired"]:
+            run_profiled(arguments["--profile"], fastq_collapse_paired, fastq_filename, arguments["--paired"],
+                         new_filename, arguments["--paired-out"], prefix, write_count_flag, **collapse_kwargs)
+        else:
+            run_profiled(arguments["--profile"], fastq_collapse, fastq_filename, new_filename, prefix,
+                         write_count_flag, **collapse_kwargs)
+        if arguments["--metrics"]:
+            write_metrics_report(arguments["--metrics"])
 
     except Exception as exp:
         print(exp)
@@ -0,0 +1,203 @@
+"""Fastq Pipeline
+
+    Usage:
+        fastq_pipeline <fastq_filename> <new_filename> <range_start> <range_end> [ <prefix>] [--count]
+                       [--workers=<n>] [--merge=<strategy>] [--mem=<size>] [--buckets=<n>]
+                       [--max-partition-size=<size>] [--compact] [--singleton-filter] [--method=<method>]
+                       [--run-size=<n>] [--metrics=<json>] [--profile=<file>] [--no-progress] [--pipelined]
+                       [--queue-size=<n>] [--compress-temp] [--existing=<fastq>]
+                       [--checkpoint] [--paired=<fastq> --paired-out=<fastq>]
+        fastq_pipeline param
+        fastq_pipeline example
+        fastq_pipeline -h | --help
+
+    Options:
+        -h --help           Show this screen
+        --count             include a count of each gene in the collapsed file
+        --workers=<n>       number of prefix partitions collapsed concurrently, each in its own process [default: 1]
+        --merge=<strategy>  how quality scores of duplicates are merged - max, mean (phred) or sum (capped phred)
+                            [default: max]
+        --mem=<size>        memory budget, e.g. 8G - an input estimated to fit is collapsed in a single pass,
+                            without prefix temp files
+        --buckets=<n>       split into <n> hash buckets of the sequence instead of by its prefix
+        --max-partition-size=<size>  re-split (recursively, by a second hash) any partition larger than this
+        --compact           collapse into a compact table (2-bit packed sequences, array counts) - about half the
+                            memory per sequence (see fastq_collapse)
+        --singleton-filter  count sequences in a first pass over each partition, so reads that certainly appear
+                            once are written straight to the output
+        --method=<method>   partition or sort (see fastq_collapse) [default: partition]
+        --run-size=<n>      number of records sorted in memory at a time by the sort method [default: 500000]
+        --metrics=<json>    write a JSON report of the metrics of each stage (read, parse, trim, split, collapse,
+                            quality_merge, write...) - time, records, bytes, process peak memory, partitions,
+                            duplicate ratio
+        --profile=<file>    profile the run with cProfile and dump the stats to <file> (the main process only)
+        --no-progress       do not show progress bars
+        --pipelined         overlap reading, trimming and collapsing, and writing in reader and writer threads (see
+                            fastq_collapse)
+        --queue-size=<n>    number of blocks waiting in each queue of --pipelined [default: 4]
+        --compress-temp     compress the temp partitions (with a fast level)
+        --existing=<fastq>  fold the trimmed reads into an existing collapsed file (see fastq_collapse)
+        --checkpoint        keep a manifest of the finished stages and partitions, and resume an interrupted run (see
+                            fastq_collapse)
+        --paired=<fastq>    paired-end - the R2 file of <fastq_filename>: both mates are trimmed, and the pairs are
+                            collapsed (see fastq_collapse)
+        --paired-out=<fastq>  the collapsed R2 file of --paired
+
+    Use '-' as <fastq_filename> to read from stdin. Files ending with .gz (or .bgz) are read and written compressed.
+"""
+
+########################################################################################################################
+# Main goal:            The script takes a path to a fastq input file and a name or path (chosen by the user)
+#                       for an output file, trims the fastq sequences from the positions given by the user
+#                       (zero-based, as 'fastq_trimming') and collapses the trimmed sequences (as 'fastq_collapse').
+#                       The trimmed sequences are streamed straight into the collapse, so the input is read once and
+#                       no trimmed file is written and read back.
+########################################################################################################################
+
+import sys
+from docopt import docopt
+from Processing.fastq_collapse import fastq_collapse, fastq_collapse_paired, write_metrics_report, DEFAULT_PREFIX
+from Utility.fastq_reader import generate_fastq_batches, generate_paired_batches, DEFAULT_BLOCK_SIZE
+from Utility.memory_utilities import parse_memory_size
+from Utility.generators_utilities import set_progress_bars
+from Utility.metrics import current_metrics, enable_metrics, run_profiled
+from Utility.pipelined_io import DEFAULT_QUEUE_SIZE
+
+
+def generate_trimmed_records(fastq_filename, start, end, block_size=DEFAULT_BLOCK_SIZE, read_ahead=0):
+    """
+    :param fastq_filename: the input fastq file, or '-' to read from stdin
+    :param start: start of trimming (zero-based)
+    :param end: end of trimming (exclusive)
+    :param block_size: approximate number of bytes trimmed at a time
+    :param read_ahead: number of blocks read ahead in a reader thread (see 'fastq_reader.generate_blocks')
+    :return: yields the trimmed records - 'Fastq_class.FastqRecord' objects, validated (as the records of
+             'fastq_reader.generate_fastq_records(..., validate=True)')
+    """
+    metrics = current_metrics()
+    for batch in generate_fastq_batches(fastq_filename, block_size, read_ahead=read_ahead):
+        with metrics.stage("trim") as stage:
+            stage.add(records=len(batch), bytes_read=len(batch.buffer))
+            records = batch.validate().cut_seq(start, end).to_records()
+        yield from records
+
+
+def generate_trimmed_pairs(fastq_filename, paired_filename, start, end, block_size=DEFAULT_BLOCK_SIZE, read_ahead=0):
+    """
+    :param fastq_filename: the R1 fastq file
+    :param paired_filename: the R2 fastq file, its records in the same order
+    :param start, end, block_size, read_ahead: as in 'generate_trimmed_records'
+    :return: yields the pairs of trimmed records - (R1 record, R2 record), validated
+    """
+    metrics = current_metrics()
+    for batch_1, batch_2 in generate_paired_batches(fastq_filename, paired_filename, block_size, read_ahead):
+        with metrics.stage("trim") as stage:
+            stage.add(records=len(batch_1) + len(batch_2), bytes_read=len(batch_1.buffer) + len(batch_2.buffer))
+            pairs = list(zip(batch_1.validate().cut_seq(start, end).to_records(),
+                             batch_2.validate().cut_seq(start, end).to_records()))
+        yield from pairs
+
+
+def fastq_pipeline(fastq_filename, new_filename, range_start, range_end, prefix=DEFAULT_PREFIX, write_count_flag=True,
+                   paired_filename=None, paired_new_filename=None, **collapse_kwargs):
+    """
+    :param fastq_filename: The requested filename (with relative path) of the fastq file that will be processed.
+    :param new_filename: The requested filename (with relative path) of the collapsed fastq file that will be created.
+    :param range_start: start of trimming (zero-based)
+    :param range_end: end of trimming (exclusive)
+    :param prefix: A length for the prefix of nucleotides for the separation of the trimmed sequences into subfiles.
+    :param write_count_flag: a flag indicating whether to write sequence counts to the output file
+    :param paired_filename: if given, the R2 file of paired-end reads - both mates are trimmed and the pairs are
+                            collapsed (see 'fastq_collapse.fastq_collapse_paired')
+    :param paired_new_filename: the collapsed R2 file that will be created (needed with 'paired_filename')
+    :param collapse_kwargs: keyword arguments to 'fastq_collapse.fastq_collapse'
+    """
+    read_ahead = collapse_kwargs.get("queue_size", DEFAULT_QUEUE_SIZE) if collapse_kwargs.get("pipelined") else 0
+    if paired_filename is not None:
+        trimmed_pairs = generate_trimmed_pairs(fastq_filename, paired_filename, int(range_start), int(range_end),
+                                               read_ahead=read_ahead)
+        fastq_collapse_paired(fastq_filename, paired_filename, new_filename, paired_new_filename, prefix,
+                              write_count_flag, pairs=trimmed_pairs,
+                              checkpoint_values={"range": [int(range_start), int(range_end)]}, **collapse_kwargs)
+        return
+    trimmed_records = generate_trimmed_records(fastq_filename, int(range_start), int(range_end),
+                                               read_ahead=read_ahead)
+    fastq_collapse(fastq_filename, new_filename, prefix, write_count_flag, generator_file=trimmed_records,
+                   checkpoint_values={"range": [int(range_start), int(range_end)]}, **collapse_kwargs)
+
+
+def param_description():
+    """
+    Description for the script
+    """
+    print("The parameters are\n" +
+          "fastq_filename: the name of the input fastq file ('-' for stdin)\n" +
+          "new_filename: the name of the new (collapsed) file that would be created\n" +
+          "range_start: start of trimming\n" +
+          "range_end: end of trimming\n" +
+          "prefix: size of prefix we split the trimmed sequences by while collapsing\n" +
+          "count: optional flag, indicating whether the collapsed file should include counts of each sequence\n" +
+          "workers, merge, mem, buckets, max-partition-size, compact, singleton-filter, method, run-size, metrics, "
+          "profile, no-progress, pipelined, queue-size, compress-temp, existing, "
+          "checkpoint, paired, paired-out: optional, as in fastq_collapse\n" +
+          "Output: \"collapsed\" fastq format file of the trimmed sequences")
+
+
+def example_description():
+    """
+    Usage example for the script
+    """
+    print("Fastq file input:\n" +
+          "@ABC\nTTGATCA\n+\n!!!#!!!\n" +
+          "@BCD\nAAGATCT\n+\n!!\"\"\"\"!\n" +
+          "@GHJ\nCCTCGAC\n+\n!!####!\n\n" +
+          "Calling the script with count flag:\n" +
+          "python fastq_pipeline.py fastq_input fastq_output 2 6 --count\n\n"
+          "Output file:\n" +
+          "@ABC_count:2\nGATC\n+\n\"#\"\"\n" +
+          "@GHJ_count:1\nTCGA\n+\n####\n")
+
+
+if __name__ == "__main__":
+
+    arguments = docopt(__doc__)
+
+    if arguments["param"]:
+        param_description()
+        sys.exit()
+
+    if arguments["example"]:
+        example_description()
+        sys.exit()
+
+    try:
+        if arguments["--no-progress"]:
+            set_progress_bars(False)
+        if arguments["--metrics"]:
+            enable_metrics()
+        run_profiled(arguments["--profile"], fastq_pipeline,
+                     arguments["<fastq_filename>"], arguments["<new_filename>"], arguments["<range_start>"],
+                     arguments["<range_end>"],
+                     int(arguments["<prefix>"]) if arguments["<prefix>"] else DEFAULT_PREFIX,
+                     bool(arguments["--count"]),
+                     arguments["--paired"], arguments["--paired-out"],
+                     workers=int(arguments["--workers"]),
+                     merge_strategy=arguments["--merge"],
+                     mem_budget=parse_memory_size(arguments["--mem"]) if arguments["--mem"] else None,
+                     buckets=int(arguments["--buckets"]) if arguments["--buckets"] else None,
+                     max_partition_size=parse_memory_size(arguments["--max-partition-size"])
+                     if arguments["--max-partition-size"] else None,
+                     compact=arguments["--compact"],
+                     singleton_filter=arguments["--singleton-filter"],
+                     method=arguments["--method"],
+                     run_size=int(arguments["--run-size"]),
+                     pipelined=arguments["--pipelined"],
+                     queue_size=int(arguments["--queue-size"]),
+                     compress_temp=arguments["--compress-temp"],
+                     existing_filename=arguments["--existing"],
+                     checkpoint=arguments["--checkpoint"])
+        if arguments["--metrics"]:
+            write_metrics_report(arguments["--metrics"])
+    except Exception as exp:
+        print(exp)
+        sys.exit(2)
@@ -1,13 +1,47 @@
 """Fastq Trimming
 
     Usage:
-        fastq_trimming <fastq_filename> <new_filename> <range_start> <range_end>
+        fastq_trimming <fastq_filename> <new_filename> <range_start> <range_end> [--workers=<n>] [--metrics=<json>]
+                       [--profile=<file>] [--no-progress] [--pipelined] [--worker-type=<type>] [--queue-size=<n>]
+                       [--paired=<fastq> --paired-out=<fastq>]
+        fastq_trimming <fastq_filename> --range=<spec>... [--workers=<n>] [--metrics=<json>] [--profile=<file>]
+                       [--no-progress] [--worker-type=<type>] [--queue-size=<n>]
+        fastq_trimming <fastq_filename> <new_filename> [--quality-5=<phred>] [--quality-3=<phred>]
+                       [--window=<spec>] [--min-length=<n>] [--workers=<n>] [--metrics=<json>] [--profile=<file>]
+                       [--no-progress] [--worker-type=<type>] [--queue-size=<n>] [--paired=<fastq> --paired-out=<fastq>]
         fastq_trimming param
         fastq_trimming example
         fastq_trimming -h | --help
 
     Options:
-        -h --help   Show this screen
+        -h --help       Show this screen
+        --workers=<n>   number of processes to trim with (the input is split into shards), or the number of compute
+                        workers of --pipelined (which a compressed input is trimmed with) [default: 1]
+        --metrics=<json>  write a JSON report of the metrics of each stage (read, parse, trim, write) - time,
+                        records, bytes and process peak memory
+        --profile=<file>  profile the run with cProfile and dump the stats to <file> (the main process only)
+        --no-progress   do not show progress bars
+        --pipelined     overlap reading, trimming and writing - a reader thread, <n> compute workers and a writer
+                        thread, connected by bounded queues (works with stdin and stdout as well)
+        --worker-type=<type>  thread or process - the compute workers of --pipelined [default: thread]
+        --queue-size=<n>  number of batches waiting in each queue of --pipelined (bounds its memory) [default: 4]
+        --range=<spec>  a range to trim into its own output, as <new_filename>:<range_start>:<range_end> (e.g.
+                        umi.fastq:8:20) - given several times, the input is read once and every range is written to
+                        its own output, each by its own writer thread (as --pipelined)
+        --quality-5=<phred>  instead of a range, trim the low-quality 5' end of each read - BWA-style, with this
+                        phred threshold
+        --quality-3=<phred>  instead of a range, trim the low-quality 3' end of each read - BWA-style, with this
+                        phred threshold
+        --window=<spec>  instead of a range, sliding-window trimming, as <size>:<phred> - each read is cut at the
+                        first window (after its trimmed 5' end) whose mean quality is below <phred>
+        --min-length=<n>  drop reads shorter than <n> after quality trimming (with --paired - drop the pairs with a
+                        read shorter than <n>)
+        --paired=<fastq>  paired-end reads - the mates (R2) of the reads of <fastq_filename> (R1), in the same order;
+                        both are read in lockstep in a single pass and trimmed alike (as --pipelined)
+        --paired-out=<fastq>  the output of the trimmed mates - in sync with <new_filename>
+
+    Use '-' as <fastq_filename> to read from stdin, or as <new_filename> to write to stdout.
+    Files ending with .gz (or .bgz) are read and written compressed - the output in BGZF blocks compressed in parallel.
 """
 
 ########################################################################################################################
@@ -19,49 +53,381 @@
 #                       the following sequence: 'GGC'.
 ########################################################################################################################
 
+import os
 import sys
+import shutil
+import tempfile
+from functools import partial
+from contextlib import ExitStack
+from multiprocessing import Pool
 from docopt import docopt
-from Utility.Fastq_class import Fastq
-from Utility.generators_utilities import generatesKLines
-from tqdm import tqdm
-from Utility.generators_utilities import BAR_DEFAULT_VIEW
-from Utility.generators_utilities import num_of_lines_in_file
-
-
-def trimmByRange(fastq_filename, out_filename, start, end):
-    fastq_file = open(fastq_filename, "r")
-    lines = generatesKLines(fastq_file, num_lines=4)
-    reading_progress_bar = tqdm(total=num_of_lines_in_file(fastq_filename), desc='Reading Input ',
-                                bar_format=BAR_DEFAULT_VIEW)
-    list_to_print = []
-    last_line = ""
-    for chunk in lines:
-        if not chunk[0] or chunk is None:
-            break
-        last_line = chunk[3] if chunk[3][-1:] != "\n" else chunk[3][:-1]
-        seq = Fastq([chunk[0][:-1], chunk[1][:-1], chunk[2][:-1], last_line])
-        new_seq = seq.cut_seq(start, end)
-        list_of_lines = new_seq.strings
-        chunk_of_lines = ""
-        for line in list_of_lines:
-            if line[-1:] != "\n":
-                chunk_of_lines = chunk_of_lines + line + "\n"
-            else:
-                chunk_of_lines = chunk_of_lines + line
-        list_to_print.append(chunk_of_lines)
-        reading_progress_bar.update(4)
-    with open(out_filename, "w") as out_fp:
-        for string in tqdm(list_to_print, desc='Writing To File ', bar_format=BAR_DEFAULT_VIEW):
-            out_fp.write(string)
-    fastq_file.close()
-
-
-def fastq_trimming(fastq_filename, new_filename, range_start, range_end):
+from Utility.generators_utilities import progress_bar, set_progress_bars
+from Utility.metrics import current_metrics, enable_metrics, reset_worker_metrics, run_profiled
+from Utility.file_utilities import open_output, is_stdio, input_size
+from Utility.compressed_io import open_file, is_compressed
+from Utility.fastq_shards import split_to_shards
+from Utility.fastq_reader import generate_fastq_batches, generate_paired_batches, DEFAULT_BLOCK_SIZE
+from Utility.pipelined_io import ordered_map, WriterThread, DEFAULT_QUEUE_SIZE, DEFAULT_WORKER_TYPE
+from Utility.quality_trimming import quality_trim_batch, quality_trim_pair, parse_window
+
+SHARDS_PER_WORKER = 4  # more shards than workers, so a slow shard does not hold up the whole pool
+
+
+def trim_fastq_batch(batch, start, end):
+    """
+    :param batch: a 'FastqBatch' of fastq sequences
+    :param start: start of trimming (zero-based)
+    :param end: end of trimming (exclusive)
+    :return: the bytes of the trimmed fastq sequences (validated and cut for the whole batch at once)
+    """
+    with current_metrics().stage("trim") as stage:
+        stage.add(records=len(batch), bytes_read=len(batch.buffer))
+        return batch.validate().cut_seq(start, end).tobytes()
+
+
+def write_trimmed(out_fp, trimmed):
+    """
+    :param out_fp: the open (binary) output file
+    :param trimmed: the bytes of trimmed fastq sequences
+    """
+    with current_metrics().stage("write") as stage:
+        out_fp.write(trimmed)
+        stage.add(bytes_written=len(trimmed))
+
+
+def trimmByRange(fastq_filename, out_filename, start, end, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Trims the fastq file in a streaming manner - a block of about 'block_size' bytes is held in memory at a time,
+    so memory stays flat whatever the size of the input.
+    :param fastq_filename: the input fastq file, or '-' to read from stdin
+    :param out_filename: the output fastq file, or '-' to write to stdout
+    :param start: start of trimming (zero-based)
+    :param end: end of trimming (exclusive)
+    :param block_size: approximate number of bytes trimmed at a time
+    """
+    # progress is measured in bytes of the input, so there is no pass over the input just to size the bar
+    reading_progress_bar = progress_bar(total=input_size(fastq_filename), desc='Trimming ', unit="B", unit_scale=True)
+    with open_output(out_filename, "wb") as out_fp:
+        for batch in generate_fastq_batches(fastq_filename, block_size):
+            write_trimmed(out_fp, trim_fastq_batch(batch, start, end))
+            reading_progress_bar.update(len(batch.buffer))
+    reading_progress_bar.close()
+
+
+def trim_block(batch, start, end):
+    """
+    :return: (the size of the batch in bytes of the input, the bytes of the trimmed batch - see 'trim_fastq_batch')
+    """
+    return len(batch.buffer), trim_fastq_batch(batch, start, end)
+
+
+def trimmByRangePipelined(fastq_filename, out_filename, start, end, workers=1, worker_type=DEFAULT_WORKER_TYPE,
+                          queue_size=DEFAULT_QUEUE_SIZE, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Trims with overlapped I/O - a reader thread reads the blocks of the input ahead, 'workers' compute workers trim
+    the batches and a writer thread writes the trimmed batches in the order of the input. Each queue between them
+    holds at most 'queue_size' batches, so memory stays flat and a slow stage holds the others back.
+    :param fastq_filename: the input fastq file, or '-' to read from stdin
+    :param out_filename: the output fastq file, or '-' to write to stdout
+    :param start: start of trimming (zero-based)
+    :param end: end of trimming (exclusive)
+    :param workers: number of compute workers
+    :param worker_type: 'thread' or 'process' (see 'pipelined_io.ordered_map') - the trimming of a batch is vectorized,
+                        so threads do most of it without the GIL; the 'trim' stage of process workers is not counted
+                        in the metrics
+    :param queue_size: number of batches waiting in each queue
+    :param block_size: approximate number of bytes trimmed at a time
+    """
+    trim_batches_pipelined(fastq_filename, out_filename, partial(trim_block, start=start, end=end), workers,
+                           worker_type, queue_size, block_size)
+
+
+def trim_batches_pipelined(fastq_filename, out_filename, trim, workers=1, worker_type=DEFAULT_WORKER_TYPE,
+                           queue_size=DEFAULT_QUEUE_SIZE, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    The reader thread, compute workers and writer thread of 'trimmByRangePipelined', for any trimming of a batch
+    :param trim: a function of a 'FastqBatch', returning (the size of the batch in bytes of the input, the bytes of
+                 the trimmed batch) - e.g. 'trim_block' (picklable, for process workers)
+    """
+    reading_progress_bar = progress_bar(total=input_size(fastq_filename), desc='Trimming ', unit="B", unit_scale=True)
+    batches = generate_fastq_batches(fastq_filename, block_size, read_ahead=queue_size)
+    with open_output(out_filename, "wb") as out_fp, \
+            WriterThread(partial(write_trimmed, out_fp), queue_size) as writer:
+        for batch_size, trimmed in ordered_map(trim, batches, workers, worker_type, queue_size):
+            writer.write(trimmed)
+            reading_progress_bar.update(batch_size)
+    reading_progress_bar.close()
+
+
+def trim_block_quality(batch, quality_trimming):
+    """
+    :param batch: a 'FastqBatch' of fastq sequences
+    :param quality_trimming: a dictionary of keyword arguments to 'quality_trimming.quality_trim_batch'
+    :return: (the size of the batch in bytes of the input, the bytes of the batch trimmed by quality)
+    """
+    with current_metrics().stage("trim") as stage:
+        stage.add(records=len(batch), bytes_read=len(batch.buffer))
+        trimmed = quality_trim_batch(batch.validate(), **quality_trimming)
+    current_metrics().increment("short_reads_dropped", len(batch) - len(trimmed))
+    return len(batch.buffer), trimmed.tobytes()
+
+
+def check_quality_trimming(quality_trimming):
+    """
+    Raises a ValueError if no quality trimming is given (see 'trimmByQuality')
+    """
+    if not any(value is not None for value in quality_trimming.values()):
+        raise ValueError("No trimming was given - a range, or at least one of quality-5, quality-3, window and "
+                         "min-length")
+
+
+def trimmByQuality(fastq_filename, out_filename, quality_trimming, workers=1, worker_type=DEFAULT_WORKER_TYPE,
+                   queue_size=DEFAULT_QUEUE_SIZE, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Trims the low-quality edges of the reads (and drops the reads left too short) in a single pass - the cut points
+    of a whole batch are computed at once on numpy arrays of its quality scores (see 'quality_trimming'), with the
+    reader thread, compute workers and writer thread of 'trimmByRangePipelined'.
+    :param fastq_filename: the input fastq file, or '-' to read from stdin
+    :param out_filename: the output fastq file, or '-' to write to stdout
+    :param quality_trimming: a dictionary of keyword arguments to 'quality_trimming.quality_trim_batch' - threshold_5,
+                             threshold_3, window and min_length
+    :param workers: number of compute workers
+    :param worker_type: 'thread' or 'process' (see 'pipelined_io.ordered_map')
+    :param queue_size: number of batches waiting in each queue
+    :param block_size: approximate number of bytes trimmed at a time
+    """
+    check_quality_trimming(quality_trimming)
+    trim_batches_pipelined(fastq_filename, out_filename,
+                           partial(trim_block_quality, quality_trimming=quality_trimming), workers, worker_type,
+                           queue_size, block_size)
+
+
+def parse_range(range_spec):
+    """
+    :param range_spec: '<new_filename>:<range_start>:<range_end>', e.g. 'umi.fastq:8:20'
+    :return: (new_filename, range_start, range_end)
+    """
+    try:
+        new_filename, range_start, range_end = range_spec.rsplit(":", 2)
+        return new_filename, int(range_start), int(range_end)
+    except ValueError:
+        raise ValueError("Incorrect range '%s' - should be <new_filename>:<range_start>:<range_end>" % range_spec)
+
+
+def check_range(new_filename, range_start, range_end):
+    """
+    Raises a ValueError if a range can not be trimmed (see 'FastqBatch.cut_seq')
+    """
+    if not isinstance(range_start, int) or not isinstance(range_end, int) or range_end <= range_start:
+        raise ValueError("Incorrect range '%s:%s:%s' - the end of the range should be after its start"
+                         % (new_filename, range_start, range_end))
+
+
+def trim_block_ranges(batch, ranges):
+    """
+    :param batch: a 'FastqBatch' of fastq sequences
+    :param ranges: a list of (start, end) pairs
+    :return: (the size of the batch in bytes of the input, a list of the bytes of the batch trimmed by each range) -
+             the batch is validated once for all the ranges
+    """
+    with current_metrics().stage("trim") as stage:
+        stage.add(records=len(batch), bytes_read=len(batch.buffer))
+        batch = batch.validate()
+        return len(batch.buffer), [batch.cut_seq(start, end).tobytes() for start, end in ranges]
+
+
+def trimmByRanges(fastq_filename, ranges, workers=1, worker_type=DEFAULT_WORKER_TYPE, queue_size=DEFAULT_QUEUE_SIZE,
+                  block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Trims several ranges of the sequences (e.g. barcode, UMI and insert) in a single pass over the input - each batch
+    is read and validated once and cut by every range, and each range is streamed to its own output by its own
+    writer thread, so the outputs are written concurrently. As in 'trimmByRangePipelined', a reader thread reads
+    ahead and 'workers' compute workers trim the batches, with at most 'queue_size' batches in each queue.
+    :param fastq_filename: the input fastq file, or '-' to read from stdin
+    :param ranges: a list of (new_filename, start, end) - an output file (or '-' for stdout, for one range at most)
+                   and the range trimmed into it (zero-based, end exclusive)
+    :param workers: number of compute workers
+    :param worker_type: 'thread' or 'process' (see 'pipelined_io.ordered_map')
+    :param queue_size: number of batches waiting in each queue
+    :param block_size: approximate number of bytes trimmed at a time
+    """
+    # every range is checked before any output is opened, so a bad range leaves no empty or partial outputs behind
+    for new_filename, start, end in ranges:
+        check_range(new_filename, start, end)
+    filenames = [new_filename for new_filename, _, _ in ranges]
+    if len(set(filenames)) < len(filenames):
+        raise ValueError("Each range should be trimmed into a different output")
+    if sum(map(is_stdio, filenames)) > 1:
+        raise ValueError("Only one range can be written to stdout")
+    reading_progress_bar = progress_bar(total=input_size(fastq_filename), desc='Trimming ', unit="B", unit_scale=True)
+    batches = generate_fastq_batches(fastq_filename, block_size, read_ahead=queue_size)
+    trim = partial(trim_block_ranges, ranges=[(start, end) for _, start, end in ranges])
+    with ExitStack() as outputs:
+        # each writer is closed (its queue written) before its file
+        writers = [outputs.enter_context(WriterThread(partial(write_trimmed,
+                                                              outputs.enter_context(open_output(new_filename, "wb"))),
+                                                      queue_size))
+                   for new_filename in filenames]
+        for batch_size, trimmed_ranges in ordered_map(trim, batches, workers, worker_type, queue_size):
+            for writer, trimmed in zip(writers, trimmed_ranges):
+                writer.write(trimmed)
+            reading_progress_bar.update(batch_size)
+    reading_progress_bar.close()
+
+
+def trim_pair_block(pair, start, end):
+    """
+    :param pair: (a 'FastqBatch' of R1 reads, a 'FastqBatch' of their mates) - see
+                 'fastq_reader.generate_paired_batches'
+    :param start: start of trimming (zero-based)
+    :param end: end of trimming (exclusive)
+    :return: (the size of the pair of batches in bytes of the input, the bytes of the trimmed R1 batch, the bytes of
+              the trimmed R2 batch)
+    """
+    batch_1, batch_2 = pair
+    return (len(batch_1.buffer) + len(batch_2.buffer), trim_fastq_batch(batch_1, start, end),
+            trim_fastq_batch(batch_2, start, end))
+
+
+def trim_pair_block_quality(pair, quality_trimming):
+    """
+    :param pair: (a 'FastqBatch' of R1 reads, a 'FastqBatch' of their mates)
+    :param quality_trimming: a dictionary of keyword arguments to 'quality_trimming.quality_trim_pair'
+    :return: (the size of the pair of batches in bytes of the input, the bytes of the trimmed R1 batch, the bytes of
+              the trimmed R2 batch)
+    """
+    batch_1, batch_2 = pair
+    with current_metrics().stage("trim") as stage:
+        stage.add(records=len(batch_1) + len(batch_2), bytes_read=len(batch_1.buffer) + len(batch_2.buffer))
+        trimmed_1, trimmed_2 = quality_trim_pair(batch_1.validate(), batch_2.validate(), **quality_trimming)
+    current_metrics().increment("short_pairs_dropped", len(batch_1) - len(trimmed_1))
+    return len(batch_1.buffer) + len(batch_2.buffer), trimmed_1.tobytes(), trimmed_2.tobytes()
+
+
+def trimmPairsPipelined(fastq_filename, paired_filename, out_filename, paired_out_filename, trim, workers=1,
+                        worker_type=DEFAULT_WORKER_TYPE, queue_size=DEFAULT_QUEUE_SIZE, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Trims paired-end reads in a single pass - the 2 files are read in lockstep, in batches of the same records (see
+    'fastq_reader.generate_paired_batches'), each pair of batches is trimmed together, and the trimmed batches are
+    written to the 2 outputs by their own writer threads, so the outputs stay in sync. Memory is bounded as in
+    'trimmByRangePipelined' (twice its blocks).
+    :param fastq_filename: the R1 input fastq file, or '-' to read from stdin
+    :param paired_filename: the R2 input fastq file - the mates of the reads of 'fastq_filename', in the same order
+    :param out_filename: the R1 output fastq file, or '-' to write to stdout
+    :param paired_out_filename: the R2 output fastq file
+    :param trim: a function of a pair of batches - 'trim_pair_block' or 'trim_pair_block_quality' (picklable, for
+                 process workers)
+    :param workers: number of compute workers
+    :param worker_type: 'thread' or 'process' (see 'pipelined_io.ordered_map')
+    :param queue_size: number of pairs of batches waiting in each queue
+    :param block_size: approximate number of bytes of each file trimmed at a time
+    """
+    if is_stdio(out_filename) and is_stdio(paired_out_filename):
+        raise ValueError("Only one of the paired outputs can be written to stdout")
+    input_sizes = [input_size(fastq_filename), input_size(paired_filename)]
+    reading_progress_bar = progress_bar(total=None if None in input_sizes else sum(input_sizes), desc='Trimming pairs ',
+                                        unit="B", unit_scale=True)
+    pairs = generate_paired_batches(fastq_filename, paired_filename, block_size, read_ahead=queue_size)
+    with open_output(out_filename, "wb") as out_fp, open_output(paired_out_filename, "wb") as paired_out_fp, \
+            WriterThread(partial(write_trimmed, out_fp), queue_size) as writer, \
+            WriterThread(partial(write_trimmed, paired_out_fp), queue_size) as paired_writer:
+        for pair_size, trimmed, paired_trimmed in ordered_map(trim, pairs, workers, worker_type, queue_size):
+            writer.write(trimmed)
+            paired_writer.write(paired_trimmed)
+            reading_progress_bar.update(pair_size)
+    reading_progress_bar.close()
+
+
+def trim_shard(shard_args):
+    """
+    Trims a single shard of the input into its own part file (runs in a worker process).
+    :param shard_args: a tuple of (fastq_filename, shard_start, shard_end, start, end, part_filename)
+    :return: (the number of lines trimmed in the shard, a report of the metrics of the shard - see
+             'metrics.Metrics.report')
+    """
+    fastq_filename, shard_start, shard_end, start, end, part_filename = shard_args
+    metrics = reset_worker_metrics()
+    num_lines = 0
+    with open_file(part_filename, "wb") as part_fp:
+        for batch in generate_fastq_batches(fastq_filename, start=shard_start, end=shard_end):
+            write_trimmed(part_fp, trim_fastq_batch(batch, start, end))
+            num_lines += 4 * len(batch)
+    return num_lines, metrics.report() if metrics.enabled else None
+
+
+def trimmByRangeParallel(fastq_filename, out_filename, start, end, workers):
+    """
+    Splits the input into shards aligned to record boundaries, trims them in a pool of 'workers' processes and joins
+    the trimmed shards into the output in the original record order.
+    A compressed output is compressed by the workers - each part is BGZF, and the parts are joined as they are.
+    :param fastq_filename: the input fastq file (must be an uncompressed regular file - stdin and compressed files
+                           can not be sharded)
+    :param out_filename: the output fastq file, or '-' to write to stdout
+    :param start: start of trimming (zero-based)
+    :param end: end of trimming (exclusive)
+    :param workers: number of worker processes
+    """
+    shards = split_to_shards(fastq_filename, workers * SHARDS_PER_WORKER)
+    temp_dir = tempfile.mkdtemp(prefix="fastq_trimming_",
+                                dir=None if is_stdio(out_filename) else os.path.dirname(os.path.abspath(out_filename)))
+    part_suffix = ".part.gz" if is_compressed(out_filename) else ".part"
+    shard_args = [(fastq_filename, shard_start, shard_end, start, end,
+                   os.path.join(temp_dir, "%d%s" % (index, part_suffix))) for index, (shard_start, shard_end) in
+                  enumerate(shards)]
+    reading_progress_bar = progress_bar(total=input_size(fastq_filename), desc='Trimming shards ', unit="B",
+                                        unit_scale=True)
+    try:
+        # concatenated BGZF parts are a BGZF file - so a compressed output is opened as a plain file
+        with Pool(workers) as pool, \
+                (open(out_filename, "wb") if is_compressed(out_filename) else open_output(out_filename, "wb")) \
+                as out_fp:
+            # imap keeps the order of the shards, so parts are joined as soon as all the preceding parts are done
+            for args, (_, shard_metrics) in zip(shard_args, pool.imap(trim_shard, shard_args)):
+                current_metrics().merge(shard_metrics)
+                part_filename = args[-1]
+                with open(part_filename, "rb") as part_fp, current_metrics().stage("join"):
+                    shutil.copyfileobj(part_fp, out_fp)
+                os.remove(part_filename)
+                reading_progress_bar.update(args[2] - args[1])
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        reading_progress_bar.close()
+
+
+def fastq_trimming(fastq_filename, new_filename, range_start, range_end, workers=1, pipelined=False,
+                   worker_type=DEFAULT_WORKER_TYPE, queue_size=DEFAULT_QUEUE_SIZE, ranges=None, quality_trimming=None,
+                   paired_filename=None, paired_out_filename=None):
+    if ranges:  # several ranges, each into its own output (new_filename and the range are not used)
+        trimmByRanges(fastq_filename, ranges, int(workers), worker_type, int(queue_size))
+        return
+
+    if paired_filename is not None or paired_out_filename is not None:  # paired-end reads, trimmed in lockstep
+        if paired_filename is None or paired_out_filename is None:
+            raise ValueError("Paired-end trimming needs both --paired and --paired-out")
+        if quality_trimming is not None:
+            check_quality_trimming(quality_trimming)
+            trim = partial(trim_pair_block_quality, quality_trimming=quality_trimming)
+        else:
+            trim = partial(trim_pair_block, start=int(range_start), end=int(range_end))
+        trimmPairsPipelined(fastq_filename, paired_filename, new_filename, paired_out_filename, trim, int(workers),
+                           worker_type, int(queue_size))
+        return
+
+    if quality_trimming is not None:  # trimming by quality instead of a range
+        trimmByQuality(fastq_filename, new_filename, quality_trimming, int(workers), worker_type, int(queue_size))
+        return
+
     if type(int(range_start)) != int or type(int(range_end)) != int:
         print("Incorrect entered start and end of the range - should be numbers")
         sys.exit(2)
 
-    trimmByRange(fastq_filename, new_filename, int(range_start), int(range_end))
+    if pipelined or (int(workers) > 1 and is_compressed(fastq_filename)):
+        trimmByRangePipelined(fastq_filename, new_filename, int(range_start), int(range_end), int(workers),
+                              worker_type, int(queue_size))
+    elif int(workers) > 1 and not is_stdio(fastq_filename):
+        trimmByRangeParallel(fastq_filename, new_filename, int(range_start), int(range_end), int(workers))
+    else:
+        trimmByRange(fastq_filename, new_filename, int(range_start), int(range_end))
 
 
 def param_description():
@@ -69,10 +435,24 @@ def param_description():
     Description for the script
     """
     print("The parameters are\n" +
-          "fastq_filename: the name of the input fastq file\n" +
-          "new_filename: the name of the new file that would be created\n" +
+          "fastq_filename: the name of the input fastq file ('-' for stdin)\n" +
+          "new_filename: the name of the new file that would be created ('-' for stdout)\n" +
           "range_start: start of trimming\n" +
           "end_start: end of trimming\n" +
+          "workers: optional, number of processes to trim with (default 1)\n" +
+          "metrics: optional, a JSON file for a report of the metrics of each stage of the run\n" +
+          "profile: optional, a file for cProfile stats of the run\n" +
+          "no-progress: optional flag, do not show progress bars\n" +
+          "pipelined: optional flag, overlap reading, trimming (by <workers> workers) and writing in threads\n" +
+          "worker-type: optional, thread (default) or process - the compute workers of pipelined\n" +
+          "queue-size: optional, number of batches waiting in each queue of pipelined (default 4)\n" +
+          "range: instead of new_filename, range_start and range_end - <new_filename>:<range_start>:<range_end>, "
+          "given once for each range to trim into its own output (the input is read once)\n" +
+          "quality-5, quality-3: optional, instead of a range - phred thresholds of BWA-style trimming of each end\n" +
+          "window: optional, instead of a range - <size>:<phred> of sliding-window quality trimming\n" +
+          "min-length: optional, drop reads shorter than this after quality trimming\n" +
+          "paired, paired-out: optional, the mates (R2) of paired-end reads and their output - trimmed in lockstep "
+          "with fastq_filename into new_filename\n" +
           "Output: trimmed fastq format file")
 
 
@@ -89,6 +469,16 @@ def example_description():
           "Output file:\n" +
           "@ABC\nTCA\n+\n!!$\n" +
           "@BCD\nTCT\n+\n\"\"!\n" +
+          "@GHJ\nGAG\n+\n##!\n\n" +
+          "Calling the script with 2 ranges:\n" +
+          "python fastq_trimming fastq_input --range=barcode:0:2 --range=insert:2:5\n\n" +
+          "Output file barcode:\n" +
+          "@ABC\nGA\n+\n!#\n" +
+          "@BCD\nGA\n+\n\"\"\n" +
+          "@GHJ\nTC\n+\n##\n" +
+          "Output file insert:\n" +
+          "@ABC\nTCA\n+\n!!$\n" +
+          "@BCD\nTCT\n+\n\"\"!\n" +
           "@GHJ\nGAG\n+\n##!")
 
 
@@ -112,11 +502,33 @@ if __name__ == "__main__":
     new_filename = arguments["<new_filename>"]
     range_start = arguments["<range_start>"]
     range_end = arguments["<range_end>"]
+    workers = arguments["--workers"]
 
     try:
-        if fastq_filename and new_filename and range_start and range_end:
-            fastq_trimming(fastq_filename, new_filename,
-                           range_start, range_end)
+        if arguments["--no-progress"]:
+            set_progress_bars(False)
+        if arguments["--metrics"]:
+            enable_metrics()
+        if arguments["--range"]:
+            run_profiled(arguments["--profile"], fastq_trimming, fastq_filename, None, None, None, workers,
+                         worker_type=arguments["--worker-type"], queue_size=arguments["--queue-size"],
+                         ranges=[parse_range(range_spec) for range_spec in arguments["--range"]])
+        elif fastq_filename and new_filename and not range_start:
+            run_profiled(arguments["--profile"], fastq_trimming, fastq_filename, new_filename, None, None, workers,
+                         worker_type=arguments["--worker-type"], queue_size=arguments["--queue-size"],
+                         quality_trimming={
+                             "threshold_5": int(arguments["--quality-5"]) if arguments["--quality-5"] else None,
+                             "threshold_3": int(arguments["--quality-3"]) if arguments["--quality-3"] else None,
+                             "window": parse_window(arguments["--window"]) if arguments["--window"] else None,
+                             "min_length": int(arguments["--min-length"]) if arguments["--min-length"] else None},
+                         paired_filename=arguments["--paired"], paired_out_filename=arguments["--paired-out"])
+        elif fastq_filename and new_filename and range_start and range_end:
+            run_profiled(arguments["--profile"], fastq_trimming, fastq_filename, new_filename,
+                         range_start, range_end, workers, arguments["--pipelined"], arguments["--worker-type"],
+                         arguments["--queue-size"], paired_filename=arguments["--paired"],
+                         paired_out_filename=arguments["--paired-out"])
+        if arguments["--metrics"]:
+            current_metrics().write_report(arguments["--metrics"])
     except Exception as exp:
         print(exp)
         sys.exit(2)
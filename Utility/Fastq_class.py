@@ -1,3 +1,9 @@
+from itertools import starmap
+import numpy as np
+
+NEWLINE = ord("\n")
+
+
 # Exceptions: Fastq class
 class MyException(Exception):
     def __init__(self):
@@ -6,6 +12,9 @@ class MyException(Exception):
     def __repr__(self):
         return self.message
 
+    def __str__(self):
+        return self.message
+
 
 class InValidFastQFile(MyException):
     def __init__(self):
@@ -19,6 +28,13 @@ class NumOfLinesNotDivisibleBy4(InValidFastQFile):
         return self
 
 
+class PairedFilesNotSynchronized(InValidFastQFile):
+    def set_message(self, num_of_sequences):
+        self.message = 'The paired FastQ files have different numbers of sequences - one of them ends after ' + str(
+            num_of_sequences) + ' sequences'
+        return self
+
+
 class InValidSequence(InValidFastQFile):
     def set_message(self, approx_line):
         self.message = 'Invalid Sequence of FastQ File: Approximate line = ' + str(approx_line)
@@ -53,6 +69,31 @@ class InValidCuttingIndices(WrongUsage_FastQClass):
         self.message = 'Invalid Filtering Indices'
 
 
+def validate_fastq_lines(strings, line=None):
+    """
+    :param strings: The 4 lines which composes a fastq sequence
+    :param line: the line number of the first line in the file (for the error message), if known
+    :raise: 'InValidSequence' if the lines are not a valid fastq sequence
+    """
+    if strings[0][:1] not in ("@", b"@"):
+        raise FirstLineNotStartWithAt if line is None else FirstLineNotStartWithAt().set_message(line)
+    if strings[2][:1] not in ("+", b"+"):
+        raise ThirdLineNotStartWithPlus if line is None else ThirdLineNotStartWithPlus().set_message(line + 2)
+    if len(strings[1]) != len(strings[3]):
+        raise SecondAndForthLineNotSameSize if line is None else SecondAndForthLineNotSameSize().set_message(line)
+
+
+def validate_fastq_records(records, first_line=1):
+    """
+    :param records: a list of 'FastqRecord'
+    :param first_line: the line number of the first line of the first record in the file
+    :raise: 'InValidSequence' (with the line number) on the first invalid record
+    """
+    for index, record in enumerate(records):
+        if record.header[:1] != "@" or record.plus_line[:1] != "+" or len(record.sequence) != len(record.quality):
+            validate_fastq_lines(record, first_line + 4 * index)
+
+
 class Fastq:
     """
     first string - identifier
@@ -60,17 +101,15 @@ class Fastq:
     third string - identifier (may be different than first line)
     forth line - confidence (of each nucleotide in the sequence)
     """
+    __slots__ = ("strings",)
 
-    def __init__(self, strings):
+    def __init__(self, strings, validate=True):
         """
         :param strings: The 4 lines (as a list of strings) which composes each fastq sequence
+        :param validate: whether to validate the lines - may be skipped for trusted (already validated) lines
         """
-        if strings[0][0] != "@":
-            raise FirstLineNotStartWithAt
-        if strings[2][0] != "+":
-            raise ThirdLineNotStartWithPlus
-        if len(strings[1]) != len(strings[3]):
-            raise SecondAndForthLineNotSameSize
+        if validate:
+            validate_fastq_lines(strings)
 
         self.strings = strings
 
@@ -83,10 +122,11 @@ class Fastq:
         """
         if not isinstance(start_index, int) or not isinstance(end_index, int) or end_index <= start_index:
             raise InValidCuttingIndices
+        # a cut of a valid sequence is valid - the sequence and the quality score are cut the same way
         temp = Fastq([self.strings[0],
                       self.strings[1][start_index:end_index],
                       self.strings[2],
-                      self.strings[3][start_index:end_index]])
+                      self.strings[3][start_index:end_index]], validate=False)
         return temp
 
     def get_seq(self):
@@ -107,3 +147,267 @@ class Fastq:
         :return: Length of nucleutide sequence
         """
         return len(self.strings[1])
+
+
+FASTQ_FIELDS = ("header", "sequence", "plus_line", "quality")  # the fields of a record, in the order of its lines
+
+
+class FastqRecord:
+    """
+    A fastq sequence as 4 fields (strings or bytes) instead of a list of its lines - validated only on request.
+    It still reads as its lines: record[1] is the sequence and iterating it yields the 4 lines, while a slice
+    (record[start:end]) is a cut of the sequence and the quality score (see 'cut_seq').
+    """
+    __slots__ = FASTQ_FIELDS
+
+    def __init__(self, header, sequence, plus_line, quality, validate=False):
+        self.header = header
+        self.sequence = sequence
+        self.plus_line = plus_line
+        self.quality = quality
+        if validate:
+            self.validate()
+
+    @classmethod
+    def from_lines(cls, strings, validate=False):
+        return cls(strings[0], strings[1], strings[2], strings[3], validate)
+
+    def validate(self, line=None):
+        validate_fastq_lines(self.strings, line)
+        return self
+
+    @property
+    def strings(self):
+        return [self.header, self.sequence, self.plus_line, self.quality]
+
+    def cut_seq(self, start_index, end_index):
+        """
+        :return: a 'FastqRecordView' of the sequence and the quality score cut according to the indices - nothing is
+                 copied until its sequence or quality is read
+        """
+        if not isinstance(start_index, int) or not isinstance(end_index, int) or end_index <= start_index:
+            raise InValidCuttingIndices
+        return FastqRecordView(self, *slice(start_index, end_index).indices(len(self.sequence))[:2])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.cut_seq(index.start, index.stop)
+        return getattr(self, FASTQ_FIELDS[index])
+
+    def __iter__(self):
+        return iter((self.header, self.sequence, self.plus_line, self.quality))
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __reduce__(self):
+        return FastqRecord, (self.header, self.sequence, self.plus_line, self.quality)
+
+    def __repr__(self):
+        return "\n".join(self.strings) + "\n"
+
+
+class FastqRecordView:
+    """
+    A cut of a 'FastqRecord' - keeps the record and the indices, and slices the sequence and the quality only when
+    they are read.
+    """
+    __slots__ = ("record", "start", "end")
+
+    def __init__(self, record, start, end):
+        self.record = record
+        self.start = start
+        self.end = max(start, end)
+
+    @property
+    def header(self):
+        return self.record.header
+
+    @property
+    def plus_line(self):
+        return self.record.plus_line
+
+    @property
+    def sequence(self):
+        return self.record.sequence[self.start:self.end]
+
+    @property
+    def quality(self):
+        return self.record.quality[self.start:self.end]
+
+    @property
+    def strings(self):
+        return [self.header, self.sequence, self.plus_line, self.quality]
+
+    def materialize(self):
+        """
+        :return: a 'FastqRecord' of the cut
+        """
+        return FastqRecord(self.header, self.sequence, self.plus_line, self.quality)
+
+    def cut_seq(self, start_index, end_index):
+        if not isinstance(start_index, int) or not isinstance(end_index, int) or end_index <= start_index:
+            raise InValidCuttingIndices
+        start, end = slice(start_index, end_index).indices(len(self))[:2]
+        return FastqRecordView(self.record, self.start + start, self.start + max(start, end))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.cut_seq(index.start, index.stop)
+        return getattr(self, FASTQ_FIELDS[index])
+
+    def __iter__(self):
+        return iter(self.strings)
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __reduce__(self):
+        return FastqRecord, (self.header, self.sequence, self.plus_line, self.quality)
+
+    def __repr__(self):
+        return "\n".join(self.strings) + "\n"
+
+
+def _slice_bounds(lengths, index):
+    """
+    :return: 'index' as a slice bound of sequences of the given lengths (negative from the end, clipped to the
+             sequence) - the same as Python slicing does, for a whole array of lengths at once
+    """
+    bounds = np.full(lengths.shape, index, dtype=np.int64)
+    if index < 0:
+        bounds += lengths
+    return np.clip(bounds, 0, lengths)
+
+
+class FastqBatch:
+    """
+    Many fastq sequences in a single buffer - the raw bytes of the records and 2 parallel arrays of the start and end
+    offsets of each line (4 lines per record), instead of an object per record.
+    """
+    __slots__ = ("buffer", "line_starts", "line_ends", "first_line")
+
+    def __init__(self, buffer, line_starts, line_ends, first_line=1):
+        """
+        :param buffer: the bytes of the records, each line ending with a newline
+        :param line_starts: array of the offset of the beginning of each line
+        :param line_ends: array of the offset of the newline of each line
+        :param first_line: the line number of the first line in the file (for error messages)
+        """
+        self.buffer = buffer
+        self.line_starts = line_starts
+        self.line_ends = line_ends
+        self.first_line = first_line
+
+    @classmethod
+    def from_block(cls, block, first_line=1):
+        """
+        :param block: bytes of whole lines
+        :param first_line: the line number of the first line in the file
+        :return: (a 'FastqBatch' of the whole records of the block, the bytes of the lines after them)
+        """
+        if block and block[-1] != NEWLINE:
+            block += b"\n"
+        line_ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == NEWLINE)
+        num_lines = len(line_ends) - len(line_ends) % 4
+        batch_size = int(line_ends[num_lines - 1]) + 1 if num_lines else 0
+        line_ends = line_ends[:num_lines]
+        line_starts = np.empty_like(line_ends)
+        line_starts[:1] = 0
+        line_starts[1:] = line_ends[:-1] + 1
+        return cls(block[:batch_size], line_starts, line_ends, first_line), block[batch_size:]
+
+    def __len__(self):
+        return len(self.line_starts) // 4
+
+    def line(self, index):
+        return self.buffer[self.line_starts[index]:self.line_ends[index]]
+
+    def split(self, num_records):
+        """
+        :param num_records: number of records (at most the length of the batch)
+        :return: (a 'FastqBatch' of the first 'num_records' records, a 'FastqBatch' of the rest)
+        """
+        num_lines = 4 * num_records
+        split_offset = int(self.line_ends[num_lines - 1]) + 1 if num_lines else 0
+        buffer = self.buffer
+        return (FastqBatch(buffer[:split_offset], self.line_starts[:num_lines], self.line_ends[:num_lines],
+                           self.first_line),
+                FastqBatch(buffer[split_offset:], self.line_starts[num_lines:] - split_offset,
+                           self.line_ends[num_lines:] - split_offset, self.first_line + num_lines))
+
+    def line_lengths(self, line_in_record):
+        """
+        :param line_in_record: 0 - headers, 1 - sequences, 2 - plus lines, 3 - qualities
+        :return: an array of the lengths of that line of every record
+        """
+        return self.line_ends[line_in_record::4] - self.line_starts[line_in_record::4]
+
+    def validate(self):
+        """
+        Validates all the records at once
+        :raise: 'InValidSequence' (with the line number) on the first invalid record
+        """
+        data = np.frombuffer(self.buffer, dtype=np.uint8)
+        first_chars = data[self.line_starts]  # an empty line 'starts' with its newline
+        invalid = (first_chars[0::4] != ord("@")) | (first_chars[2::4] != ord("+")) | \
+                  (self.line_lengths(1) != self.line_lengths(3))
+        if invalid.any():
+            index = int(np.argmax(invalid))
+            validate_fastq_lines([self.line(4 * index + i) for i in range(4)], self.first_line + 4 * index)
+        return self
+
+    def cut_seq(self, start_index, end_index):
+        """
+        :return: a new 'FastqBatch' of all the sequences and quality scores cut according to the indices
+                 (the same cut as 'Fastq.cut_seq' of each record), built with no per-record work in Python
+        """
+        if not isinstance(start_index, int) or not isinstance(end_index, int) or end_index <= start_index:
+            raise InValidCuttingIndices
+        lengths = self.line_lengths(1)
+        cut_starts = _slice_bounds(lengths, start_index)
+        cut_ends = np.maximum(cut_starts, _slice_bounds(lengths, end_index))
+        return self.cut_records(cut_starts, cut_ends)
+
+    def cut_records(self, cut_starts, cut_ends, keep=None):
+        """
+        :param cut_starts: an array of the start of the cut of each record (within its sequence and quality)
+        :param cut_ends: an array of the end of the cut of each record (not before its start)
+        :param keep: if given, a boolean array of the records to keep - the others are dropped
+        :return: a new 'FastqBatch' of the records with their sequences and quality scores cut, each by its own
+                 range (e.g. by its quality, see 'quality_trimming')
+        """
+        # the byte ranges to keep, in the order of the buffer: whole header and plus lines, the cut of the sequence
+        # and quality lines, and the newlines of all the lines
+        keep_starts = np.stack([self.line_starts[0::4], self.line_starts[1::4] + cut_starts, self.line_ends[1::4],
+                                self.line_starts[2::4], self.line_starts[3::4] + cut_starts, self.line_ends[3::4]],
+                               axis=1)
+        keep_ends = np.stack([self.line_ends[0::4] + 1, self.line_starts[1::4] + cut_ends, self.line_ends[1::4] + 1,
+                              self.line_ends[2::4] + 1, self.line_starts[3::4] + cut_ends, self.line_ends[3::4] + 1],
+                             axis=1)
+        if keep is not None:
+            keep_starts, keep_ends = keep_starts[keep], keep_ends[keep]
+        keep_starts, keep_ends = keep_starts.ravel(), keep_ends.ravel()
+        non_empty = keep_ends > keep_starts
+        keep_starts, keep_ends = keep_starts[non_empty], keep_ends[non_empty]
+        # mark +1 at each range start and -1 at each range end - the running sum is 1 exactly on the kept bytes
+        # (the non-empty ranges are disjoint, so no index repeats within the starts or within the ends)
+        boundaries = np.zeros(len(self.buffer) + 1, dtype=np.int8)
+        boundaries[keep_starts] = 1
+        boundaries[keep_ends] -= 1
+        keep = np.cumsum(boundaries[:-1], dtype=np.int8).view(np.bool_)
+        cut_buffer = np.frombuffer(self.buffer, dtype=np.uint8)[keep].tobytes()
+        return FastqBatch.from_block(cut_buffer, self.first_line)[0]
+
+    def to_records(self, decode=True):
+        """
+        :param decode: if True the lines are strings, otherwise bytes
+        :return: a list of the records of the batch - a 'FastqRecord' of each, its lines without their newlines (as
+                 the records of 'fastq_reader.generate_fastq_records')
+        """
+        lines = self.buffer.decode().split("\n") if decode else bytes(self.buffer).split(b"\n")
+        lines_iterator = iter(lines[:-1])  # the buffer ends with a newline
+        return list(starmap(FastqRecord, zip(lines_iterator, lines_iterator, lines_iterator, lines_iterator)))
+
+    def tobytes(self):
+        return bytes(self.buffer)
@@ -0,0 +1,93 @@
+import os
+import json
+
+CHECKPOINT_SUFFIX = ".checkpoint"  # the manifest of a run is kept next to its output, as <output><suffix>
+CHECKPOINT_VERSION = 1
+
+
+class Checkpoint:
+    """
+    A manifest of the progress of a long run - the stages that finished (with the values they produced, e.g. the
+    partition filenames of a split), the items that finished (e.g. collapsed partitions) and the size of the output
+    after each of them. The manifest is a JSON file, replaced atomically on every update, so an interrupted run
+    leaves a consistent manifest behind: running it again resumes after the last finished item, and truncating the
+    output to the recorded size drops anything a killed item had already appended.
+    """
+
+    def __init__(self, filename, run):
+        """
+        Loads the manifest of an interrupted run, or starts a new one
+        :param filename: the manifest filename
+        :param run: a JSON serializable dictionary identifying the run (its input and options) - a manifest of a
+                    different run is not resumed
+        """
+        self.filename = filename
+        self.state = {"version": CHECKPOINT_VERSION, "run": run, "stages": {}, "done": [], "output_size": None}
+        self.resumed = os.path.exists(filename)
+        if self.resumed:
+            with open(filename) as checkpoint_file:
+                state = json.load(checkpoint_file)
+            if state.get("version") != CHECKPOINT_VERSION or state.get("run") != json.loads(json.dumps(run)):
+                raise ValueError("The checkpoint %s is of a different run (input or options) - remove it to start "
+                                 "over" % filename)
+            self.state = state
+        self._done = set(self.state["done"])
+
+    @property
+    def output_size(self):
+        """
+        :return: the size of the output after the last finished item (or when the run started), None if not recorded
+        """
+        return self.state["output_size"]
+
+    def start(self, output_size):
+        """
+        Records the size of the output when a new run starts (the output may be appended to)
+        """
+        self.state["output_size"] = output_size
+        self.save()
+
+    def stage_done(self, name):
+        return name in self.state["stages"]
+
+    def stage_values(self, name):
+        """
+        :return: the values recorded by a finished stage (see 'finish_stage')
+        """
+        return self.state["stages"][name]
+
+    def finish_stage(self, name, **values):
+        """
+        :param name: the name of the stage (e.g. 'split')
+        :param values: JSON serializable values the following stages need on resume
+        """
+        self.state["stages"][name] = values
+        self.save()
+
+    def is_done(self, item):
+        return item in self._done
+
+    def finish(self, item, output_size):
+        """
+        :param item: the name of a finished item (e.g. a partition filename)
+        :param output_size: the size of the output with the item written
+        """
+        self._done.add(item)
+        self.state["done"].append(item)
+        self.state["output_size"] = output_size
+        self.save()
+
+    def save(self):
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w") as checkpoint_file:
+            json.dump(self.state, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_filename, self.filename)
+
+    def remove(self):
+        """
+        Removes the manifest - the run finished
+        """
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
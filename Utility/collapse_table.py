@@ -0,0 +1,135 @@
+from array import array
+from Utility.Fastq_class import FastqRecord
+from Utility.quality_merge import QualityAggregator, DEFAULT_MERGE_STRATEGY, DEFAULT_MAX_PENDING_BYTES
+
+# A, C, G, T are packed as the base-4 digits 0-3; characters int() would otherwise accept in a base-4 number
+# (the digits themselves, underscores and whitespace) are mapped to an invalid digit, so any sequence with them
+# takes the escape path
+PACK_TABLE = str.maketrans({"A": "0", "C": "1", "G": "2", "T": "3",
+                            "0": "x", "1": "x", "2": "x", "3": "x",
+                            "_": "x", " ": "x", "\t": "x", "\r": "x", "\n": "x", "\x0b": "x", "\x0c": "x"})
+BITS_TO_BASE = {"00": "A", "01": "C", "10": "G", "11": "T"}
+MATE_SEPARATOR = "\x1f"  # joins the sequences of the mates of a paired-end read (it is in no fastq line)
+
+
+def pack_sequence(sequence):
+    """
+    :param sequence: a nucleotide sequence, or the sequences of the mates of a pair joined by 'MATE_SEPARATOR'
+    :return: the sequence packed 2 bits per base into an int (with a leading 1 digit, so the length is kept),
+             or the sequence itself if it has any base other than A, C, G, T (e.g. N); a tuple of the packed mates
+             of a pair
+    """
+    if MATE_SEPARATOR in sequence:
+        return tuple(map(_pack_bases, sequence.split(MATE_SEPARATOR)))
+    return _pack_bases(sequence)
+
+
+def _pack_bases(sequence):
+    if not sequence.isascii():  # int() accepts the digits of any script
+        return sequence
+    try:
+        return int("1" + sequence.translate(PACK_TABLE), 4)
+    except ValueError:
+        return sequence
+
+
+def unpack_sequence(key):
+    """
+    :param key: a key returned by 'pack_sequence'
+    :return: the nucleotide sequence
+    """
+    if isinstance(key, str):
+        return key
+    if isinstance(key, tuple):
+        return MATE_SEPARATOR.join(map(unpack_sequence, key))
+    bits = bin(key)[3:]  # drop '0b' and the leading 1 digit
+    return "".join([BITS_TO_BASE[bits[i:i + 2]] for i in range(0, len(bits), 2)])
+
+
+class CollapseTable:
+    """
+    A compact alternative to the dictionary of 'collapse_fastq_to_dict'.
+    Sequences are kept as 2-bit packed int keys (a pair of them for paired-end reads, see 'pack_sequence'), mapped
+    to an index into parallel arrays: the counts are in an unsigned int array, and the header and best quality of
+    each sequence are kept in a single bytearray (addressed by offset and lengths) instead of a 'FastqRecord' object.
+    Like the dictionary, it supports 'len', 'values' (yielding [FastqRecord object, count]) and 'pop'.
+    """
+
+    def __init__(self, merge_strategy=DEFAULT_MERGE_STRATEGY, max_pending_bytes=DEFAULT_MAX_PENDING_BYTES):
+        self._index = {}  # packed sequence -> index
+        self.counts = array("I")
+        self._data = bytearray()  # header followed by quality, for each index
+        self._offsets = array("Q")
+        self._header_lengths = array("I")
+        self._quality_lengths = array("I")
+        self._plus_lines = {}  # index -> third line, only for the (rare) lines that are not just '+'
+        # merged qualities are written back into '_data' on every merge, so none of them are kept on the side
+        self._quality_aggregator = QualityAggregator(merge_strategy, max_pending_bytes,
+                                                     load_quality=self.get_quality, store_quality=self.set_quality)
+
+    def add(self, header, sequence, plus_line, quality):
+        """
+        :param header: the first line of the fastq record (without its newline)
+        :param sequence: the second line of the fastq record
+        :param plus_line: the third line of the fastq record
+        :param quality: the forth line of the fastq record
+        """
+        key = pack_sequence(sequence)
+        index = self._index.get(key)
+        if index is None:  # This is the first occurrence of this sequence
+            index = self._index[key] = len(self.counts)
+            self.counts.append(1)
+            self._offsets.append(len(self._data))
+            encoded_header = header.encode()
+            self._header_lengths.append(len(encoded_header))
+            self._quality_lengths.append(len(quality))
+            self._data += encoded_header
+            self._data += quality.encode("ascii")
+            if plus_line != "+":
+                self._plus_lines[index] = plus_line
+        else:
+            self.counts[index] += 1
+            self._quality_aggregator.add(index, quality)
+
+    def get_quality(self, index):
+        start = self._offsets[index] + self._header_lengths[index]
+        return self._data[start:start + self._quality_lengths[index]].decode("ascii")
+
+    def set_quality(self, index, quality):
+        start = self._offsets[index] + self._header_lengths[index]
+        self._data[start:start + self._quality_lengths[index]] = quality.encode("ascii")
+
+    def get_header(self, index):
+        start = self._offsets[index]
+        return self._data[start:start + self._header_lengths[index]].decode()
+
+    def merge_qualities(self):
+        """
+        Merges the pending quality scores of the duplicates into the best quality of each sequence
+        """
+        for index, quality in self._quality_aggregator.merged():
+            self.set_quality(index, quality)
+
+    def pop(self, sequence, default=None):
+        """
+        Removes a sequence from the table (its merged quality should be final - see 'merge_qualities')
+        :param sequence: a nucleotide sequence
+        :return: [FastqRecord object, count] of the sequence, or 'default' if it is not in the table
+        """
+        index = self._index.pop(pack_sequence(sequence), None)
+        if index is None:
+            return default
+        return [FastqRecord(self.get_header(index), sequence, self._plus_lines.get(index, "+"),
+                            self.get_quality(index)), self.counts[index]]
+
+    def __len__(self):
+        return len(self._index)
+
+    def values(self):
+        """
+        :return: yields [FastqRecord object, count] for each sequence, in order of first occurrence
+        """
+        self.merge_qualities()
+        for key, index in self._index.items():
+            yield [FastqRecord(self.get_header(index), unpack_sequence(key), self._plus_lines.get(index, "+"),
+                               self.get_quality(index)), self.counts[index]]
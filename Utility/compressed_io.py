@@ -0,0 +1,209 @@
+import io
+import os
+import gzip
+import zlib
+import struct
+from collections import deque
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+
+COMPRESSED_EXTENSIONS = (".gz", ".bgz", ".bgzf")  # files with these extensions are read and written compressed
+DEFAULT_COMPRESSION_LEVEL = 6
+TEMP_COMPRESSION_LEVEL = 1  # temp files are written once and read once - a fast level cuts most of their I/O
+DEFAULT_COMPRESSION_THREADS = min(4, os.cpu_count() or 1)
+BGZF_BLOCK_SIZE = 0xff00  # maximal uncompressed bytes of a BGZF block (so a compressed block fits in 64KB)
+ESTIMATED_COMPRESSION_RATIO = 4  # fastq text is about 4 times the size of its gzip (for estimates only)
+BLOCKS_PER_TASK = 16  # BGZF blocks compressed together by a compression thread
+GZIP_WBITS = zlib.MAX_WBITS | 16  # a zlib stream with a gzip header and trailer
+# ID1 ID2 CM FLG MTIME XFL OS XLEN, and the 'BC' extra subfield: SI1 SI2 SLEN BSIZE (the block size - 1)
+BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+BGZF_TRAILER = struct.Struct("<2I")  # CRC32 and ISIZE (the uncompressed size) of the block
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")  # an empty block ending a file
+
+
+def is_compressed(filename):
+    """
+    :param filename: a filename (or '-' for stdin/stdout)
+    :return: whether the file is compressed - chosen by its extension (see 'COMPRESSED_EXTENSIONS')
+    """
+    return isinstance(filename, str) and filename.lower().endswith(COMPRESSED_EXTENSIONS)
+
+
+def compress_bgzf_block(data, level=DEFAULT_COMPRESSION_LEVEL):
+    """
+    :param data: at most 'BGZF_BLOCK_SIZE' bytes
+    :param level: the zlib compression level
+    :return: a BGZF block of the data - a gzip member with the size of the block in its header, so a file of
+             concatenated blocks is a valid gzip file whose blocks can be compressed (and located) independently
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, BGZF_HEADER.size + len(deflated) +
+                              BGZF_TRAILER.size - 1)
+    return header + deflated + BGZF_TRAILER.pack(zlib.crc32(data), len(data))
+
+
+def compress_bgzf_blocks(data, level=DEFAULT_COMPRESSION_LEVEL):
+    """
+    :return: the BGZF blocks of the data (see 'compress_bgzf_block'), concatenated
+    """
+    return b"".join(compress_bgzf_block(data[start:start + BGZF_BLOCK_SIZE], level)
+                    for start in range(0, len(data), BGZF_BLOCK_SIZE))
+
+
+class BgzfWriter(io.BufferedIOBase):
+    """
+    A binary file writing BGZF blocks. With more than one thread, the blocks are compressed in a pool of threads
+    (zlib releases the GIL) while the caller goes on writing, and are written in order; at most 2 tasks of
+    'BLOCKS_PER_TASK' blocks per thread are in flight, so memory stays bounded. Closing the file writes the BGZF
+    end-of-file block.
+    """
+
+    def __init__(self, raw, level=DEFAULT_COMPRESSION_LEVEL, threads=1):
+        """
+        :param raw: the underlying binary file (closed with the writer)
+        :param level: the zlib compression level
+        :param threads: number of compression threads (1 - the blocks are compressed by the writing thread)
+        """
+        super().__init__()
+        self._raw = raw
+        self.level = level
+        self._buffer = bytearray()
+        self._executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        self._max_in_flight = 2 * threads
+        self._in_flight = deque()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        self._buffer += data
+        # without threads every full block is compressed at once, so a writer buffers less than a block (many
+        # writers may be open at once, e.g. the partitions of a collapse)
+        task_size = BGZF_BLOCK_SIZE * (BLOCKS_PER_TASK if self._executor is not None else 1)
+        if len(self._buffer) >= task_size:
+            num_bytes = len(self._buffer) - len(self._buffer) % task_size
+            for start in range(0, num_bytes, task_size):
+                self._compress(bytes(self._buffer[start:start + task_size]))
+            del self._buffer[:num_bytes]
+        return len(data)
+
+    def _compress(self, data):
+        if self._executor is None:
+            self._raw.write(compress_bgzf_blocks(data, self.level))
+            return
+        self._in_flight.append(self._executor.submit(compress_bgzf_blocks, data, self.level))
+        if len(self._in_flight) >= self._max_in_flight:
+            self._raw.write(self._in_flight.popleft().result())
+
+    def flush(self):
+        """
+        Compresses and writes all the written data (the last block may be short)
+        """
+        if self._buffer:
+            self._compress(bytes(self._buffer))
+            self._buffer.clear()
+        while self._in_flight:
+            self._raw.write(self._in_flight.popleft().result())
+        self._raw.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+            self._raw.write(BGZF_EOF)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            super().close()
+            self._raw.close()
+
+
+def generate_decompressed_chunks(fp, read_size):
+    """
+    :param fp: a gzip file (of one or more members, e.g. BGZF) opened in binary mode
+    :param read_size: number of compressed bytes decompressed at a time
+    :return: yields the decompressed bytes, in chunks - the whole chunk is decompressed by zlib at once (without the
+             GIL), with no per-line work in Python. Zero padding after a member (e.g. after the BGZF end-of-file block
+             of a file padded to a block size) is skipped, as 'gzip' does.
+    """
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    member_started = False
+    for data in iter(lambda: fp.read(read_size), b""):
+        while data:
+            if not member_started:
+                data = data.lstrip(b"\0")  # a member starts with the gzip magic bytes, never with a zero byte
+                if not data:
+                    break
+                member_started = True
+            chunk = decompressor.decompress(data)
+            if chunk:
+                yield chunk
+            if not decompressor.eof:
+                break
+            data = decompressor.unused_data  # the next member
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+            member_started = False
+    if member_started:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+
+def bgzf_uncompressed_size(filename):
+    """
+    :param filename: path of a compressed file
+    :return: the uncompressed size of a BGZF file - the sum of the sizes in the trailers of its blocks, which are
+             located through the block sizes in their headers (nothing is decompressed); None if the file is not BGZF
+             (zero padding after the last block is allowed, see 'generate_decompressed_chunks')
+    """
+    uncompressed_size = 0
+    with open(filename, "rb") as fp:
+        while True:
+            header = fp.read(BGZF_HEADER.size)
+            if not header:
+                return uncompressed_size
+            if header[:1] == b"\0":
+                padding_chunks = chain([header], iter(lambda: fp.read(BGZF_BLOCK_SIZE), b""))
+                return None if any(chunk.strip(b"\0") for chunk in padding_chunks) else uncompressed_size
+            if len(header) < BGZF_HEADER.size:
+                return None
+            id1, id2, _, flags, _, _, _, extra_length, si1, si2, _, block_size = BGZF_HEADER.unpack(header)
+            if (id1, id2, flags, extra_length, si1, si2) != (31, 139, 4, 6, 66, 67):
+                return None
+            fp.seek(block_size + 1 - BGZF_HEADER.size - BGZF_TRAILER.size, os.SEEK_CUR)
+            trailer = fp.read(BGZF_TRAILER.size)
+            if len(trailer) < BGZF_TRAILER.size:
+                return None
+            uncompressed_size += BGZF_TRAILER.unpack(trailer)[1]
+
+
+def uncompressed_size(filename):
+    """
+    :param filename: path of a regular file
+    :return: the size of the content of the file - the file size of an uncompressed file, the uncompressed size of
+             a BGZF file, or None if it is not known without decompressing the file (other gzip files)
+    """
+    if not is_compressed(filename):
+        return os.path.getsize(filename)
+    return bgzf_uncompressed_size(filename)
+
+
+def open_file(filename, mode="r", level=DEFAULT_COMPRESSION_LEVEL, threads=1):
+    """
+    Opens a file, compressed or not according to its extension (see 'is_compressed'). A compressed file is read as
+    gzip (of any number of members) and written as BGZF - appending to it adds BGZF blocks, so the file stays valid.
+    :param filename: path of the file
+    :param mode: as in 'open' ('+' is ignored for a compressed file, which can not be both read and written)
+    :param level: the compression level of a compressed file opened for writing
+    :param threads: number of compression threads of a compressed file opened for writing (see 'BgzfWriter')
+    :return: an open file object
+    """
+    if not is_compressed(filename):
+        return open(filename, mode)
+    binary = "b" in mode
+    if mode[0] == "r":
+        return gzip.open(filename, "rb" if binary else "rt")
+    writer = BgzfWriter(open(filename, mode[0] + "b"), level, threads)
+    return writer if binary else io.TextIOWrapper(writer)
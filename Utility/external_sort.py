@@ -0,0 +1,94 @@
+import os
+import heapq
+import pickle
+import tempfile
+from itertools import islice
+from Utility.metrics import current_metrics
+
+DEFAULT_RUN_SIZE = 100000  # number of items sorted in memory at a time
+MAX_MERGE_FANIN = 64  # maximum number of runs merged (and so open) at once
+PICKLE_CHUNK_SIZE = 1024  # number of items pickled together in a run file
+
+
+def write_run(items, temp_dir=None):
+    """
+    :param items: an iterable of (already sorted) items
+    :param temp_dir: the directory of the run file (the default temp directory if None)
+    :return: the filename of a new run file holding the items (pickled in chunks)
+    """
+    fd, run_filename = tempfile.mkstemp(prefix="external_sort_", suffix=".run", dir=temp_dir)
+    items = iter(items)
+    with os.fdopen(fd, "wb") as run_file:
+        chunk = list(islice(items, PICKLE_CHUNK_SIZE))
+        while chunk:
+            pickle.dump(chunk, run_file, pickle.HIGHEST_PROTOCOL)
+            chunk = list(islice(items, PICKLE_CHUNK_SIZE))
+    return run_filename
+
+
+def read_run(run_filename):
+    """
+    :param run_filename: a run file (see 'write_run')
+    :return: yields the items of the run, in order
+    """
+    with open(run_filename, "rb") as run_file:
+        while True:
+            try:
+                chunk = pickle.load(run_file)
+            except EOFError:
+                return
+            yield from chunk
+
+
+def merge_runs(run_filenames, key=None, temp_dir=None):
+    """
+    Merges runs into a single run, 'MAX_MERGE_FANIN' runs at a time, so the number of open files stays bounded.
+    :param run_filenames: the run files, in input order (the merge is stable)
+    :param key: the sorting key
+    :param temp_dir: the directory of the merged run files
+    :return: a list of at most 'MAX_MERGE_FANIN' run files (the merged runs are removed)
+    """
+    while len(run_filenames) > MAX_MERGE_FANIN:
+        merged_filenames = []
+        for index in range(0, len(run_filenames), MAX_MERGE_FANIN):
+            group = run_filenames[index:index + MAX_MERGE_FANIN]
+            merged_filenames.append(write_run(heapq.merge(*map(read_run, group), key=key), temp_dir))
+            for run_filename in group:
+                os.remove(run_filename)
+        run_filenames = merged_filenames
+    return run_filenames
+
+
+def external_sort(iterable, key=None, run_size=DEFAULT_RUN_SIZE, temp_dir=None):
+    """
+    Sorts an iterable of any size with bounded memory: runs of 'run_size' items are sorted in memory and spilled to
+    temp files, and the runs are streamed back through a heap-based k-way merge. An input that fits in a single run
+    is sorted in memory with no temp files. The sort is stable, like 'sorted'.
+    :param iterable: the items to sort (spilled items must be picklable)
+    :param key: the sorting key (as in 'sorted')
+    :param run_size: the number of items sorted in memory at a time
+    :param temp_dir: the directory of the run files (the default temp directory if None)
+    :return: yields the items in sorted order
+    """
+    metrics = current_metrics()
+    iterator = iter(iterable)
+    with metrics.stage("sort") as stage:
+        run = sorted(islice(iterator, run_size), key=key)
+        stage.add(records=len(run))
+    if len(run) < run_size:
+        yield from run
+        return
+    run_filenames = []
+    try:
+        while run:
+            with metrics.stage("sort") as stage:
+                run_filenames.append(write_run(run, temp_dir))
+                run = sorted(islice(iterator, run_size), key=key)
+                stage.add(records=len(run))
+        with metrics.stage("sort"):
+            run_filenames = merge_runs(run_filenames, key, temp_dir)
+        yield from heapq.merge(*map(read_run, run_filenames), key=key)
+    finally:
+        for run_filename in run_filenames:
+            if os.path.exists(run_filename):
+                os.remove(run_filename)
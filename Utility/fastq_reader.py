@@ -0,0 +1,245 @@
+import io
+import os
+import sys
+import mmap
+from itertools import starmap
+from Utility.Fastq_class import NumOfLinesNotDivisibleBy4, PairedFilesNotSynchronized, FastqBatch, FastqRecord, \
+    validate_fastq_records
+from Utility.file_utilities import is_stdio
+from Utility.compressed_io import is_compressed, generate_decompressed_chunks, ESTIMATED_COMPRESSION_RATIO
+from Utility.metrics import current_metrics
+from Utility.pipelined_io import threaded_generator
+
+DEFAULT_BLOCK_SIZE = 8 << 20  # bytes of the file parsed at a time
+
+
+def _mapped_blocks(fp, block_size, start, end):
+    """
+    :return: yields blocks of bytes of a memory-mapped file between 'start' and 'end', each ending at a newline
+             (except, possibly, the last one)
+    """
+    file_size = os.fstat(fp.fileno()).st_size
+    end = file_size if end is None else min(end, file_size)
+    if start >= end:
+        return
+    with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+        position = start
+        while position < end:
+            block_end = min(position + block_size, end)
+            if block_end < end:
+                newline = mapped_file.rfind(b"\n", position, block_end)
+                if newline == -1:  # a line longer than the block
+                    newline = mapped_file.find(b"\n", block_end, end)
+                block_end = end if newline == -1 else newline + 1
+            yield mapped_file[position:block_end]
+            position = block_end
+
+
+def _stream_blocks(stream, block_size):
+    """
+    :return: yields blocks of bytes read from a (non-seekable) binary stream, each ending at a newline (except,
+             possibly, the last one)
+    """
+    return _line_blocks(iter(lambda: stream.read(block_size), b""))
+
+
+def _line_blocks(chunks):
+    """
+    :param chunks: an iterable of bytes
+    :return: yields the bytes of the chunks, in blocks each ending at a newline (except, possibly, the last one)
+    """
+    leftover = b""
+    for block in chunks:
+        newline = block.rfind(b"\n")
+        if newline == -1:
+            leftover += block
+            continue
+        yield leftover + block[:newline + 1]
+        leftover = block[newline + 1:]
+    if leftover:
+        yield leftover
+
+
+def _generate_blocks(source, block_size, start, end, mapped=True):
+    if is_stdio(source):
+        source = sys.stdin
+    if is_compressed(source):
+        if start or end is not None:
+            raise ValueError("A compressed file can not be read from a byte offset: %s" % source)
+        with open(source, "rb") as fp:
+            yield from _line_blocks(generate_decompressed_chunks(fp, max(1, block_size //
+                                                                          ESTIMATED_COMPRESSION_RATIO)))
+        return
+    if isinstance(source, str):
+        with open(source, "rb") as fp:
+            if mapped or start or end is not None:
+                yield from _mapped_blocks(fp, block_size, start, end)
+            else:
+                yield from _stream_blocks(fp, block_size)
+        return
+    stream = source.buffer if isinstance(source, io.TextIOBase) else source
+    try:
+        stream.fileno()
+        seekable = stream.seekable() and os.fstat(stream.fileno()).st_size > 0
+    except (AttributeError, io.UnsupportedOperation, OSError):
+        seekable = False
+    if seekable:
+        yield from _mapped_blocks(stream, block_size, start, end)
+    else:
+        yield from _stream_blocks(stream, block_size)
+
+
+def _timed_blocks(blocks):
+    metrics = current_metrics()
+    while True:
+        with metrics.stage("read") as stage:
+            block = next(blocks, None)
+            if block is not None:
+                stage.add(bytes_read=len(block))
+        if block is None:
+            return
+        yield block
+
+
+def generate_blocks(source, block_size=DEFAULT_BLOCK_SIZE, start=0, end=None, read_ahead=0):
+    """
+    :param source: a filename, '-' for stdin, or an open file (text or binary) - a compressed file (by its
+                   extension, see 'compressed_io.is_compressed') is decompressed on the fly
+    :param block_size: approximate size of each block
+    :param start: byte offset to start from (regular files only)
+    :param end: byte offset to stop at (regular files only)
+    :param read_ahead: if positive, the blocks are read in a reader thread up to this number of blocks ahead of the
+                       consumer, so reading overlaps the processing of the blocks (see 'pipelined_io')
+    :return: yields blocks of bytes, each ending at a newline (except, possibly, the last one). Regular files are
+             memory-mapped, so a block is a single copy out of the page cache with no per-line work in Python -
+             unless they are read ahead, in which case they are read with plain reads, which release the GIL while
+             waiting on the storage (a page fault of a mapped file does not).
+             The time and bytes of reading are counted in the 'read' stage of the current metrics.
+    """
+    blocks = _timed_blocks(_generate_blocks(source, block_size, start, end, mapped=not read_ahead))
+    return threaded_generator(blocks, read_ahead) if read_ahead else blocks
+
+
+def generate_fastq_record_batches(source, decode=True, block_size=DEFAULT_BLOCK_SIZE, start=0, end=None,
+                                  validate=False, read_ahead=0):
+    """
+    :param source: a filename, '-' for stdin, or an open file (see 'generate_blocks')
+    :param decode: if True the lines are strings, otherwise bytes
+    :param block_size: approximate number of bytes parsed at a time
+    :param start: byte offset of the first record (regular files only, see 'fastq_shards.find_record_start')
+    :param end: byte offset to stop at (regular files only)
+    :param validate: whether to validate the records (see 'Fastq_class.validate_fastq_records') - records read
+                     with validation may be trusted later on (e.g. collapsed without validating them again)
+    :param read_ahead: number of blocks read ahead in a reader thread (see 'generate_blocks')
+    :return: yields lists of records - a 'Fastq_class.FastqRecord' of each, its lines without their newlines.
+             A whole block is decoded and split into lines at once, so there is no per-line parsing in Python.
+    """
+    metrics = current_metrics()
+    carried_lines = []  # lines of a record cut by the end of the previous block
+    num_lines = 0
+    for block in generate_blocks(source, block_size, start, end, read_ahead):
+        with metrics.stage("parse") as stage:
+            if decode:
+                block = block.decode()
+            lines = block.split("\n" if decode else b"\n")
+            if not lines[-1]:
+                lines.pop()  # the block ends with a newline
+            if carried_lines:
+                lines = carried_lines + lines
+            num_complete_lines = len(lines) - len(lines) % 4
+            carried_lines = lines[num_complete_lines:]
+            num_lines += num_complete_lines
+            lines_iterator = iter(lines[:num_complete_lines])
+            records = list(starmap(FastqRecord, zip(lines_iterator, lines_iterator, lines_iterator, lines_iterator)))
+            if validate:
+                validate_fastq_records(records, num_lines - num_complete_lines + 1)
+            stage.add(records=len(records))
+        yield records
+    while carried_lines and not carried_lines[-1]:
+        carried_lines.pop()  # empty lines at the end of the file
+    if carried_lines:
+        raise NumOfLinesNotDivisibleBy4().set_message(num_lines + len(carried_lines))
+
+
+def generate_fastq_records(source, decode=True, block_size=DEFAULT_BLOCK_SIZE, start=0, end=None, validate=False,
+                           read_ahead=0):
+    """
+    :return: yields fastq records one at a time - a 'Fastq_class.FastqRecord' of each, its lines without their
+             newlines (see 'generate_fastq_record_batches')
+    """
+    for batch in generate_fastq_record_batches(source, decode, block_size, start, end, validate, read_ahead):
+        yield from batch
+
+
+def generate_fastq_batches(source, block_size=DEFAULT_BLOCK_SIZE, start=0, end=None, read_ahead=0):
+    """
+    :param source: a filename, '-' for stdin, or an open file (see 'generate_blocks')
+    :param block_size: approximate number of bytes in each batch
+    :param start: byte offset of the first record (regular files only)
+    :param end: byte offset to stop at (regular files only)
+    :param read_ahead: number of blocks read ahead in a reader thread (see 'generate_blocks')
+    :return: yields a 'Fastq_class.FastqBatch' for each block - the records stay in the block's bytes, with no
+             object per record
+    """
+    metrics = current_metrics()
+    carried = b""  # lines of a record cut by the end of the previous block
+    num_lines = 0
+    for block in generate_blocks(source, block_size, start, end, read_ahead):
+        with metrics.stage("parse") as stage:
+            batch, carried = FastqBatch.from_block(carried + block if carried else block, num_lines + 1)
+            stage.add(records=len(batch))
+        num_lines += 4 * len(batch)
+        if len(batch):
+            yield batch
+    if carried.strip():
+        raise NumOfLinesNotDivisibleBy4().set_message(num_lines + carried.strip().count(b"\n") + 1)
+
+
+def generate_paired_records(source_1, source_2, decode=True, block_size=DEFAULT_BLOCK_SIZE, validate=False,
+                            read_ahead=0):
+    """
+    :param source_1: the first file of paired-end reads (R1) - a filename, '-' for stdin, or an open file
+    :param source_2: the second file (R2), its records in the same order
+    :return: yields the pairs of records of the files, in lockstep - (R1 record, R2 record), each as the records of
+             'generate_fastq_records' (a block of each file is held in memory at a time)
+    :raise: 'PairedFilesNotSynchronized' if one file has more records than the other
+    """
+    records_1 = generate_fastq_records(source_1, decode, block_size, validate=validate, read_ahead=read_ahead)
+    records_2 = generate_fastq_records(source_2, decode, block_size, validate=validate, read_ahead=read_ahead)
+    num_pairs = 0
+    for record_1 in records_1:
+        record_2 = next(records_2, None)
+        if record_2 is None:
+            raise PairedFilesNotSynchronized().set_message(num_pairs)
+        num_pairs += 1
+        yield record_1, record_2
+    if next(records_2, None) is not None:
+        raise PairedFilesNotSynchronized().set_message(num_pairs)
+
+
+def generate_paired_batches(source_1, source_2, block_size=DEFAULT_BLOCK_SIZE, read_ahead=0):
+    """
+    :param source_1: the first file of paired-end reads (R1) - a filename, '-' for stdin, or an open file
+    :param source_2: the second file (R2), its records in the same order
+    :return: yields pairs of 'Fastq_class.FastqBatch' of the same number of records - the mates of the records of
+             the first batch are in the second (the longer of 2 blocks is split, and its rest is paired next)
+    :raise: 'PairedFilesNotSynchronized' if one file has more records than the other
+    """
+    batches_1 = generate_fastq_batches(source_1, block_size, read_ahead=read_ahead)
+    batches_2 = generate_fastq_batches(source_2, block_size, read_ahead=read_ahead)
+    batch_1 = batch_2 = None
+    num_pairs = 0
+    while True:
+        if not batch_1:
+            batch_1 = next(batches_1, None)
+        if not batch_2:
+            batch_2 = next(batches_2, None)
+        if batch_1 is None or batch_2 is None:
+            if batch_1 is not None or batch_2 is not None:
+                raise PairedFilesNotSynchronized().set_message(num_pairs)
+            return
+        num_records = min(len(batch_1), len(batch_2))
+        paired_1, batch_1 = batch_1.split(num_records)
+        paired_2, batch_2 = batch_2.split(num_records)
+        num_pairs += num_records
+        yield paired_1, paired_2
@@ -0,0 +1,70 @@
+import os
+from Utility.compressed_io import open_file, uncompressed_size, ESTIMATED_COMPRESSION_RATIO
+
+RECORD_SYNC_LINES = 8  # lines to look ahead when re-synchronizing on a record boundary
+
+
+def find_record_start(fp, offset):
+    """
+    Finds the first fastq record that starts at or after a byte offset.
+    A line is a record start if it begins with '@' and the line 2 lines after it begins with '+' - a quality line
+    may begin with '@', but then 2 lines after it is a sequence line which can never begin with '+'.
+    :param fp: a fastq file opened in binary mode
+    :param offset: a byte offset in the file
+    :return: the byte offset of the record start, or the size of the file if there is no record after 'offset'
+    """
+    file_size = os.fstat(fp.fileno()).st_size
+    if offset <= 0:
+        return 0
+    if offset >= file_size:
+        return file_size
+    fp.seek(offset - 1)
+    fp.readline()  # skip the rest of the (possibly partial) line 'offset' falls in
+    positions = []
+    lines = []
+    for _ in range(RECORD_SYNC_LINES):
+        positions.append(fp.tell())
+        line = fp.readline()
+        if not line:
+            break
+        lines.append(line)
+    for i in range(len(lines) - 2):
+        if lines[i][:1] == b"@" and lines[i + 2][:1] == b"+":
+            return positions[i]
+    return file_size
+
+
+def split_to_shards(filename, num_shards):
+    """
+    :param filename: path of a fastq file
+    :param num_shards: the requested number of shards
+    :return: a list of (start, end) byte ranges, aligned to record boundaries, which together cover the file
+    """
+    file_size = os.path.getsize(filename)
+    shard_size = max(1, file_size // max(1, num_shards))
+    with open(filename, "rb") as fp:
+        boundaries = sorted(set(find_record_start(fp, offset) for offset in range(0, file_size, shard_size)))
+    boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if start < end]
+
+
+def estimate_num_of_records(filename, sample_records=1000):
+    """
+    :param filename: path of a fastq file (compressed or not)
+    :param sample_records: number of records at the beginning of the file to average the record size over
+    :return: the estimated number of records in the file (uncompressed file size / average record size)
+    """
+    sample_bytes = 0
+    num_lines = 0
+    with open_file(filename, "rb") as fp:
+        for line in fp:
+            sample_bytes += len(line)
+            num_lines += 1
+            if num_lines == 4 * sample_records:
+                break
+    if not sample_bytes:
+        return 0
+    file_size = uncompressed_size(filename)
+    if file_size is None:
+        file_size = os.path.getsize(filename) * ESTIMATED_COMPRESSION_RATIO
+    return int(file_size * max(1, num_lines / 4) / sample_bytes) + 1
@@ -0,0 +1,44 @@
+import os
+import sys
+import stat
+from contextlib import contextmanager
+from Utility.compressed_io import open_file, is_compressed, uncompressed_size, DEFAULT_COMPRESSION_THREADS
+
+STDIO_FILENAME = "-"  # a filename of '-' stands for stdin (input) or stdout (output)
+
+
+def is_stdio(filename):
+    return filename == STDIO_FILENAME
+
+
+def input_size(filename):
+    """
+    :param filename: path of the input file, or '-' for stdin
+    :return: the size of the input in bytes (for byte-based progress bars) - uncompressed for a compressed file, or
+             None if it is not known in advance (stdin, pipes, gzip files which are not BGZF)
+    """
+    if is_stdio(filename):
+        return None
+    file_stat = os.stat(filename)
+    if not stat.S_ISREG(file_stat.st_mode):
+        return None
+    return uncompressed_size(filename) if is_compressed(filename) else file_stat.st_size
+
+
+@contextmanager
+def open_output(filename, mode="w"):
+    """
+    :param filename: path of the output file (compressed by its extension, in BGZF blocks compressed by
+                     'DEFAULT_COMPRESSION_THREADS' threads - see 'compressed_io'), or '-' for stdout
+    :param mode: the mode to open the file with (for stdout only text or binary ('b') matters)
+    :return: a context manager yielding an open file; stdout is flushed but never closed
+    """
+    if is_stdio(filename):
+        stdout = sys.stdout.buffer if "b" in mode else sys.stdout
+        try:
+            yield stdout
+        finally:
+            stdout.flush()
+    else:
+        with open_file(filename, mode, threads=DEFAULT_COMPRESSION_THREADS) as fp:
+            yield fp
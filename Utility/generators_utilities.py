@@ -1,18 +1,48 @@
-from Utility.temp_files import new_temp_file
-from Utility.strip_last_newline import strip_last_NL
-import os
-import re
-from itertools import islice
+import bisect
+from itertools import islice, groupby, chain
 from colorama import Fore
+from tqdm import tqdm
+from Utility.external_sort import external_sort, DEFAULT_RUN_SIZE
+from Utility.sam_reader import is_header_or_unmapped
 
 BAR_DEFAULT_VIEW = "{l_bar}%s{bar}%s{r_bar}" % (Fore.GREEN, Fore.RESET)
+COUNT_BLOCK_SIZE = 1 << 20  # bytes read at a time when counting lines
+WINDOW_BATCH_SIZE = 4096  # number of middle items (and their keys) extracted at a time by 'window_generator'
+_progress_bars_enabled = True
+
+
+def set_progress_bars(enabled):
+    """
+    :param enabled: whether 'progress_bar' shows progress bars - disabled bars cost nothing (e.g. for batch jobs)
+    """
+    global _progress_bars_enabled
+    _progress_bars_enabled = enabled
+
+
+def progress_bar(iterable=None, **kwargs):
+    """
+    :return: a tqdm progress bar in the default view ('BAR_DEFAULT_VIEW'), disabled if 'set_progress_bars(False)'
+             was called
+    """
+    kwargs.setdefault("bar_format", BAR_DEFAULT_VIEW)
+    disable = kwargs.pop("disable", False) or not _progress_bars_enabled
+    return tqdm(iterable, disable=disable, **kwargs)
 
 
 def num_of_lines_in_file(path):
+    """
+    :param path: path of a text file
+    :return: the number of lines in the file (a last line without a newline counts as well), counted over binary
+             blocks - no line is decoded or split
+    """
     num_of_lines = 0
-    with open(path, 'r') as f:
-        for line in f:
-            num_of_lines += 1
+    last_block = b""
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COUNT_BLOCK_SIZE), b""):
+            num_of_lines += block.count(b"\n")
+            last_block = block
+    if last_block and not last_block.endswith(b"\n"):
+        num_of_lines += 1
     return num_of_lines
 
 
@@ -76,41 +106,35 @@ def getLineFromChunkSkipHeaderAndNoRange(file, size=1024, skip=True):
     :param skip: if we want to skip the header and the not good read lines
     :return: get one line each time , when we read from the files in chunks - if skip - skippes the header lines and not good read lines.
     """
-    gen = generatesKLines(file, size)
-    try:
-        chunk = next(gen)
-        while (chunk is not None) and len(chunk) > 0:
-            for line1 in chunk:
-                if skip and line1 != "" and (
-                        (line1[0] == '@') or re.split("\t|\n", line1)[2] == "*"):  # skipping the headers
-                    continue
-                yield line1
-            chunk = next(gen)
-    except StopIteration:
-        return
-
-
-def key_sorted_gen(key, file=None, gen=None, *args, **kwargs):
+    for chunk in generatesKLines(file, size):
+        if skip:  # skipping the headers and the unmapped reads - only the first 3 columns of a line are split
+            chunk = [line1 for line1 in chunk if line1 == "" or not is_header_or_unmapped(line1)]
+        yield from chunk
+
+
+def key_sorted_gen(key, file=None, gen=None, *args, run_size=DEFAULT_RUN_SIZE, temp_dir=None, **kwargs):
+    """
+    :param key: the sorting key
+    :param file: an open file - its lines are sorted (if 'gen' is not given)
+    :param gen: a generator of objects to sort - they are written as lines of str(obj)
+    :param run_size: the number of lines (or objects) sorted in memory at a time - larger inputs are sorted in runs
+                     spilled to temp files and merged back (see 'external_sort.external_sort')
+    :param temp_dir: the directory of the temp files (the default temp directory if None)
+    :return: yields the sorted lines; the last one without its newline
+    """
     is_gen = True  # incdicate wheather gen param was received
     if not gen:
         is_gen = False
         gen = getLineFromChunk(file, *args, **kwargs)
 
-    sorted_file = new_temp_file(prefix='key_sorted_', delete=False)
-    with open(sorted_file.name, "w+") as fp:
-        for obj in sorted(gen, key=key):
-            if not is_gen:
-                fp.write(str(obj))
-            else:
-                fp.write(str(obj) + '\n')
+    previous_line = None
+    for obj in external_sort(gen, key=key, run_size=run_size, temp_dir=temp_dir):
+        if previous_line is not None:
+            yield previous_line
+        previous_line = str(obj) if not is_gen else str(obj) + '\n'
 
-    strip_last_NL(sorted_file.name)
-
-    with open(sorted_file.name, "r") as sorted_fp:
-        for line in getLineFromChunk(sorted_fp):
-            yield line
-
-    os.remove(sorted_file.name)
+    if previous_line is not None:
+        yield previous_line[:-1] if previous_line.endswith('\n') else previous_line
 
 
 def skip_broken_lines_factory(class_name):
@@ -150,8 +174,22 @@ def generatesKLines(file, num_lines):
         yield next_k_lines
 
 
+def keyed_batches(gen, functor, batch_size=WINDOW_BATCH_SIZE):
+    """
+    :param gen: a generator of items
+    :param functor: gets an item and returns its key
+    :param batch_size: number of items in each batch
+    :return: yields (keys, items) - a list of up to 'batch_size' items and a parallel list of their keys
+    """
+    gen = iter(gen)
+    items = list(islice(gen, batch_size))
+    while items:
+        yield list(map(functor, items)), items
+        items = list(islice(gen, batch_size))
+
+
 def window_generator(gate_gen1, gen2, functor_gen1, functor_gen2, closed_interval_first_side=False,
-                     closed_interval_second_side=False):
+                     closed_interval_second_side=False, batch_size=WINDOW_BATCH_SIZE):
     """
     @param gate_gen1: a generator of gate items (for example primaries)- we look at the items of that gen as a
     border items that we find gen2 items between them
@@ -163,79 +201,40 @@ def window_generator(gate_gen1, gen2, functor_gen1, functor_gen2, closed_interva
     - by default it is not allowed
     @param closed_interval_second_side: True if we allow the between gen2 items an equality to the second gate side
     - by default it is not allowed
+    @param batch_size: number of gen2 items whose keys are extracted at a time
     @return: (gate_item1, middle_list, gate_item2) - where the middle list are the items from gen2 there are located
-    between the two borders according to the booleans equality allowed by sides
-    """
-
-    gate_gen1 = gate1_generator(gate_gen1, functor_gen1)  # run over the received gen with a gen that returns a list
-    gate_item1 = list()
-    try:
-        gate_item2 = next(gate_gen1)
-    except StopIteration:
-        gate_item2 = None
-    try:
-        middle_item = next(gen2)
-    except StopIteration:
-        middle_item = None
-
-    middle_list = list()
-    not_finished = True
-
-    gt = operator.ge if closed_interval_first_side else operator.gt  # ">=" if closed_interval_first_side else ">"
-    lt = operator.le if closed_interval_second_side else operator.lt  # "<=" if closed_interval_second_side else "<"
-
-    while not_finished:
-        if middle_item is None:
-            not_finished = False  # exit the loop
-            # yield the list we have this far - in between the two curr gate items
-            gate_item1, gate_item2, middle_list = yield from yield_window_and_promote(gate_gen1, gate_item1, gate_item2,
-                                                                                      middle_list)
-            continue
-
-        if gate_item1 is not None and len(gate_item1) != 0:
-            if gt(functor_gen2(middle_item), functor_gen1(gate_item1[0])):
-                if (len(gate_item2) != 0 and lt(functor_gen2(middle_item), functor_gen1(gate_item2[0]))) \
-                        or (len(gate_item2) == 0):
-                    # it is in between the two gates or no second border
-                    middle_item = add_to_window_and_promote_middle(gen2, middle_item, middle_list)
-
-                elif (len(gate_item2) != 0) and not (lt(functor_gen2(middle_item), functor_gen1(gate_item2[0]))):
-                    # when the middle is bigger then the second gate
-                    gate_item1, gate_item2, middle_list = yield from yield_window_and_promote(gate_gen1, gate_item1,
-                                                                                              gate_item2, middle_list)
-
-            else:  # when the middle is smaller then the first gate
-                gate_item1, gate_item2, middle_list = yield from yield_window_and_promote(gate_gen1, gate_item1,
-                                                                                          gate_item2, middle_list)
-
-        else:  # when we are at the beginning and have no first boarder
-            if gate_item2 is not None:
-                if len(gate_item2) != 0 and lt(functor_gen2(middle_item), functor_gen1(gate_item2[0])):
-                    middle_item = add_to_window_and_promote_middle(gen2, middle_item, middle_list)
-                elif len(gate_item2) != 0:
-                    gate_item1, gate_item2, middle_list = yield from yield_window_and_promote(gate_gen1, gate_item1,
-                                                                                              gate_item2, middle_list)
-            else:  # both gates are None
-                return
-
-    # handle the case where there are no more middle, but there are gates
-
-    while gate_item1 is not None and len(gate_item1) != 0:
-        yield (gate_item1, middle_list, gate_item2)
-        if len(gate_item2) != 0:
-            gate_item1, gate_item2, middle_list = promote_window(gate_gen1, gate_item2)
-        else:
+    between the two borders according to the booleans equality allowed by sides. gate items are lists of the
+    consecutive gen1 items with the same key; the first window has no first gate and the last window has no second
+    gate ([]). Both generators should be sorted by their keys; a gen2 item which is in no window is skipped, and an
+    item that fits 2 windows (both sides closed) is in the first of them only.
+    """
+    # the keys are extracted once per item, and the window borders are found in each batch of keys by a binary search
+    first_side = bisect.bisect_left if closed_interval_first_side else bisect.bisect_right  # first item past gate 1
+    second_side = bisect.bisect_right if closed_interval_second_side else bisect.bisect_left  # first item past gate 2
+    middle_batches = keyed_batches(gen2, functor_gen2, batch_size)
+    keys, items, position = [], [], 0
+
+    gate_key1, gate_item1 = None, []
+    gates = ((key, list(group)) for key, group in groupby(gate_gen1, key=functor_gen1))
+    for gate_key2, gate_item2 in chain(gates, [(None, [])]):
+        if not gate_item1 and not gate_item2:  # no gates at all
             return
-
-
-def yield_window_and_promote(gate_gen1, gate_item1, gate_item2, middle_list):
-    """
-    yields for the calling func , checks validity of window promoting and promotes the window
-    """
-    yield (gate_item1, middle_list, gate_item2)
-    if len(gate_item2) != 0:
-        gate_item1, gate_item2, middle_list = promote_window(gate_gen1, gate_item2)
-    return gate_item1, gate_item2, middle_list
+        middle_list = []
+        while True:
+            if position == len(keys):
+                batch = next(middle_batches, None)
+                if batch is None:
+                    break
+                keys, items = batch
+                position = 0
+            start = first_side(keys, gate_key1, position) if gate_item1 else position
+            end = second_side(keys, gate_key2, start) if gate_item2 else len(keys)
+            middle_list.extend(items[start:end])
+            position = end
+            if end < len(keys):  # the rest of the batch is past the window
+                break
+        yield (gate_item1, middle_list, gate_item2)
+        gate_key1, gate_item1 = gate_key2, gate_item2
 
 
 def gate1_generator(generator, functor_gen1):
@@ -245,58 +244,5 @@ def gate1_generator(generator, functor_gen1):
     :return: yield a list of lines - if there were dup lines - all dup will appear in the list, if no dup -
     one line in the yielded list
     """
-    new_item = next(generator)
-    r_list = list()
-    while new_item:
-        r_list.append(new_item)
-        try:
-            next_item = next(generator)
-        except StopIteration:
-            yield r_list
-            raise
-        while operator.eq(functor_gen1(next_item), functor_gen1(new_item)):
-            r_list.append(next_item)
-            temp = next_item
-            try:
-                next_item = next(generator)
-            except StopIteration:
-                yield r_list
-                raise
-            new_item = temp
-
-        yield r_list
-        r_list = list()
-        new_item = next_item
-
-
-def promote_window(gate_gen1, gate_item2):
-    """
-    :param gate_gen1: the generator of the gates objects
-    :param gate_item2: the current gate 2 object
-    :return: promoted gate 1 , new middle list , promoted gate 2
-    """
-    try:
-        temp_gate = next(gate_gen1)
-    except RuntimeError:
-        return gate_item2, [], []
-
-    gate_item1 = gate_item2  # runs over the list
-    gate_item2 = temp_gate
-
-    middle_list = list()
-    return gate_item1, gate_item2, middle_list
-
-
-def add_to_window_and_promote_middle(gen2, middle_item, middle_list):
-    """
-    :param gen2: generator for middle objects
-    :param middle_item: the middle item we want to add to the curr window
-    :param middle_list: the list we want to add the middle item to
-    :return: the updated middle list
-    """
-    middle_list.append(middle_item)
-    try:
-        middle_item = next(gen2)
-    except StopIteration:
-        return None
-    return middle_item
\ No newline at end of file
+    for _, group in groupby(generator, key=functor_gen1):
+        yield list(group)
@@ -0,0 +1,80 @@
+import os
+import re
+from Utility.file_utilities import input_size, is_stdio
+from Utility.compressed_io import is_compressed, ESTIMATED_COMPRESSION_RATIO
+from Utility.quality_merge import DEFAULT_MAX_PENDING_BYTES, MIN_MAX_PENDING_BYTES
+
+MEMORY_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+# estimated bytes of a collapse dictionary ('collapse_fastq_to_dict') per byte of fastq input - each record costs a
+# 'FastqRecord' object and a dictionary entry on top of the raw text
+COLLAPSE_MEMORY_FACTOR = 4
+# the same for a compact collapse table ('collapse_table.CollapseTable') - a packed key, a dictionary entry and the
+# raw header and quality bytes
+COMPACT_COLLAPSE_MEMORY_FACTOR = 1.5
+# the pending qualities of duplicates (see 'quality_merge.QualityAggregator') take at most 1/<share> of the budget of a
+# collapse
+PENDING_QUALITIES_BUDGET_SHARE = 8
+
+
+def parse_memory_size(size):
+    """
+    :param size: a memory size such as '8G', '512M', '100k' or '1024' (bytes); a trailing 'B' is allowed
+    :return: the size in bytes
+    """
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$", str(size), re.IGNORECASE)
+    if not match:
+        raise ValueError("Invalid memory size '%s' - should be a number with an optional K/M/G/T unit" % size)
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2).upper()])
+
+
+def collapse_memory_factor(compact=False):
+    """
+    :param compact: whether the collapse is into a compact table rather than a dictionary
+    :return: the estimated bytes of memory per byte of fastq input
+    """
+    return COMPACT_COLLAPSE_MEMORY_FACTOR if compact else COLLAPSE_MEMORY_FACTOR
+
+
+def max_pending_bytes_for_budget(mem_budget=None, workers=1):
+    """
+    :param mem_budget: memory budget in bytes, or None
+    :param workers: number of collapses sharing the budget
+    :return: the bytes of pending qualities that trigger a merge in each collapse (see
+             'quality_merge.QualityAggregator') - the default buffer, or a smaller one (down to
+             'MIN_MAX_PENDING_BYTES') if the budget is tight
+    """
+    if mem_budget is None:
+        return DEFAULT_MAX_PENDING_BYTES
+    share = mem_budget / workers / PENDING_QUALITIES_BUDGET_SHARE
+    return int(min(max(share, MIN_MAX_PENDING_BYTES), DEFAULT_MAX_PENDING_BYTES))
+
+
+def estimate_collapse_memory(fastq_filename, compact=False, max_pending_bytes=DEFAULT_MAX_PENDING_BYTES):
+    """
+    :param fastq_filename: path of a fastq file, or '-' for stdin
+    :param compact: whether the collapse is into a compact table rather than a dictionary
+    :param max_pending_bytes: the buffer of the pending qualities of the collapse (see 'max_pending_bytes_for_budget')
+    :return: the estimated number of bytes needed to collapse the whole file at once - the collapsed sequences and
+             the buffer of the pending qualities of duplicates (see 'quality_merge.QualityAggregator'); infinite if
+             the size of the input is not known in advance (stdin, pipes) - the size of a gzip file which is not
+             BGZF is estimated from its compressed size
+    """
+    file_size = input_size(fastq_filename)
+    if file_size is None and not is_stdio(fastq_filename) and is_compressed(fastq_filename) and \
+            os.path.isfile(fastq_filename):
+        file_size = os.path.getsize(fastq_filename) * ESTIMATED_COMPRESSION_RATIO
+    if file_size is None:
+        return float("inf")
+    return file_size * collapse_memory_factor(compact) + max_pending_bytes
+
+
+def max_partition_size_for_budget(mem_budget, workers=1, compact=False):
+    """
+    :param mem_budget: memory budget in bytes
+    :param workers: number of partitions collapsed at once
+    :param compact: whether the collapse is into a compact table rather than a dictionary
+    :return: the largest partition (in bytes) whose collapse fits in its share of the budget (as estimated by
+             'estimate_collapse_memory')
+    """
+    max_pending_bytes = max_pending_bytes_for_budget(mem_budget, workers)
+    return max(int((mem_budget / workers - max_pending_bytes) // collapse_memory_factor(compact)), 1)
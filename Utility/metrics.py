@@ -0,0 +1,253 @@
+import sys
+import json
+import time
+import cProfile
+import threading
+import resource
+
+PEAK_RSS_UNIT = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in bytes on macOS and in KB on Linux
+PROCESS_PEAK_RSS_NOTE = "the peak memory of the whole process (with its finished sub-processes) so far, at the end " \
+    "of the run or of the last run of a stage - cumulative, not the memory of the stage alone"
+_counters_lock = threading.Lock()  # stages may run in several threads at once (see 'pipelined_io')
+
+
+def peak_rss():
+    """
+    :return: the peak memory (max RSS, bytes) of this process and of its finished sub-processes
+    """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * PEAK_RSS_UNIT
+
+
+class StageMetrics:
+    """
+    The counters of a single stage (e.g. 'read', 'parse', 'split', 'collapse', 'quality_merge', 'write')
+    """
+    __slots__ = ("seconds", "records", "bytes_read", "bytes_written", "process_peak_rss")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.records = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.process_peak_rss = 0  # the peak memory of the whole process when the stage last stopped (see 'peak_rss')
+
+    def add(self, records=0, bytes_read=0, bytes_written=0):
+        with _counters_lock:
+            self.records += records
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+
+    def report(self):
+        return {"seconds": round(self.seconds, 6), "records": self.records, "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+                "records_per_second": round(self.records / self.seconds, 1) if self.seconds else None,
+                "process_peak_rss_mb": round(self.process_peak_rss / float(1 << 20), 1)}
+
+
+class _NullStage:
+    """
+    The stage of disabled metrics - does nothing
+    """
+    def add(self, records=0, bytes_read=0, bytes_written=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class _StageContext:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        return self.metrics.start_stage(self.name)
+
+    def __exit__(self, *exc_info):
+        self.metrics.stop_stage()
+        return False
+
+
+class Metrics:
+    """
+    Per-stage metrics of a run - wall time, records, bytes read and written of each stage, the peak memory of the
+    process when it stopped, and named values (e.g. partition sizes).
+    The peak memory is not of a stage alone (see 'PROCESS_PEAK_RSS_NOTE') - 'ru_maxrss' can not be reset, and stages
+    are nested, repeated and run by several threads at once.
+    Stages may be nested (a stage consuming a generator whose stages run inside it) - the time of a stage excludes
+    the time of the stages nested in it, so no time is counted in 2 stages. Each thread has its own stack of running
+    stages, and the time of a stage run by several threads at once is their total time.
+    Disabled metrics cost nothing but a function call per stage.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}  # stage name -> 'StageMetrics', in the order the stages first ran
+        self.values = {}
+        self._local = threading.local()  # the 'stack' of the running stages of each thread
+        self._start = time.perf_counter()
+
+    def stage(self, name):
+        """
+        :param name: the name of the stage
+        :return: a context manager timing the stage, yielding its 'StageMetrics' (to 'add' counters to)
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        return _StageContext(self, name)
+
+    def _stack(self):
+        """
+        :return: the running stages of the current thread, innermost last - lists of ['StageMetrics', start time]
+        """
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def start_stage(self, name):
+        now = time.perf_counter()
+        stack = self._stack()
+        if stack:
+            outer, outer_start = stack[-1]
+            with _counters_lock:
+                outer.seconds += now - outer_start
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages.setdefault(name, StageMetrics())
+        stack.append([stage, now])
+        return stage
+
+    def stop_stage(self):
+        now = time.perf_counter()
+        stack = self._stack()
+        stage, start = stack.pop()
+        with _counters_lock:
+            stage.seconds += now - start
+        stage.process_peak_rss = peak_rss()
+        if stack:
+            stack[-1][1] = now
+
+    def add(self, name, records=0, bytes_read=0, bytes_written=0):
+        """
+        Adds counters to a stage without timing it
+        """
+        if self.enabled:
+            self.stages.setdefault(name, StageMetrics()).add(records, bytes_read, bytes_written)
+
+    def count_records(self, stage, iterable):
+        """
+        :param stage: a 'StageMetrics' (of 'stage')
+        :param iterable: an iterable of records
+        :return: the iterable, counting its items as records of the stage (the iterable itself if disabled)
+        """
+        if not self.enabled:
+            return iterable
+        return _counted(stage, iterable)
+
+    def increment(self, name, value=1):
+        """
+        Adds to a numeric value of the run (e.g. 'unique_sequences')
+        """
+        if self.enabled:
+            self.values[name] = self.values.get(name, 0) + value
+
+    def set(self, name, value):
+        """
+        :param name: the name of a value of the run (e.g. 'partitions')
+        :param value: a JSON serializable value
+        """
+        if self.enabled:
+            self.values[name] = value
+
+    def merge(self, report):
+        """
+        Adds the stages of a report of another process (e.g. a worker) - times and counters are summed (so the time
+        of a stage run by several workers is their total time, not the wall time), peak memory is the maximum
+        :param report: a dictionary of 'report'
+        """
+        if not self.enabled or not report:
+            return
+        for name, stage_report in report["stages"].items():
+            stage = self.stages.setdefault(name, StageMetrics())
+            stage.seconds += stage_report["seconds"]
+            stage.add(stage_report["records"], stage_report["bytes_read"], stage_report["bytes_written"])
+            stage.process_peak_rss = max(stage.process_peak_rss, int(stage_report["process_peak_rss_mb"] * (1 << 20)))
+        for name, value in report["values"].items():
+            if isinstance(value, (int, float)):
+                self.increment(name, value)
+            else:
+                self.values[name] = value
+
+    def report(self):
+        """
+        :return: a JSON serializable dictionary of the metrics
+        """
+        return {"wall_seconds": round(time.perf_counter() - self._start, 6),
+                "process_peak_rss_mb": round(peak_rss() / float(1 << 20), 1),
+                "notes": {"process_peak_rss_mb": PROCESS_PEAK_RSS_NOTE},
+                "stages": {name: stage.report() for name, stage in self.stages.items()},
+                "values": dict(self.values)}
+
+    def write_report(self, filename):
+        with open(filename, "w") as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+
+def _counted(stage, iterable):
+    for item in iterable:
+        stage.records += 1
+        yield item
+
+
+_current_metrics = Metrics(enabled=False)
+
+
+def current_metrics():
+    """
+    :return: the metrics of the current run (disabled unless 'enable_metrics' was called)
+    """
+    return _current_metrics
+
+
+def enable_metrics():
+    """
+    Starts collecting metrics for the current run (worker processes forked afterwards collect their own)
+    :return: the new 'Metrics'
+    """
+    global _current_metrics
+    _current_metrics = Metrics()
+    return _current_metrics
+
+
+def reset_worker_metrics():
+    """
+    Starts fresh metrics in a worker process (so the metrics it reports are of its own work only)
+    :return: the new 'Metrics' (or the disabled metrics if metrics are not collected)
+    """
+    global _current_metrics
+    if _current_metrics.enabled:
+        _current_metrics = Metrics()
+    return _current_metrics
+
+
+def run_profiled(profile_filename, function, *args, **kwargs):
+    """
+    Runs a function - under cProfile if 'profile_filename' is given (the stats are dumped to the file, to be read
+    with 'pstats' or 'snakeviz'; worker processes are not profiled)
+    :return: the return value of the function
+    """
+    if not profile_filename:
+        return function(*args, **kwargs)
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(function, *args, **kwargs)
+    finally:
+        profile.dump_stats(profile_filename)
@@ -0,0 +1,126 @@
+import resource
+from collections import OrderedDict
+from Utility.pipelined_io import WriterThread
+from Utility.compressed_io import open_file, TEMP_COMPRESSION_LEVEL
+
+DEFAULT_FLUSH_THRESHOLD = 1 << 20  # bytes buffered for a single partition before it is written
+DEFAULT_MAX_BUFFERED_BYTES = 256 << 20  # bytes buffered for all the partitions together
+RESERVED_FILE_DESCRIPTORS = 64  # file descriptors left free for the rest of the process
+
+
+def max_open_files():
+    """
+    :return: the number of partition files that can be kept open, according to the file-descriptor limit
+    """
+    soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft_limit == resource.RLIM_INFINITY:
+        soft_limit = 4096
+    return max(1, soft_limit - RESERVED_FILE_DESCRIPTORS)
+
+
+class PartitionWriterPool:
+    """
+    Writes data to many partition files at once.
+    Data of each partition is buffered in memory and written when the buffer reaches 'flush_threshold' bytes (or when
+    all the buffers together reach 'max_buffered_bytes', in which case the largest buffer is written).
+    Open files are kept in an LRU pool bounded by 'max_open', so a partition file is opened again only if it was
+    evicted - and then in append mode.
+    Partition files with a compressed extension (see 'compressed_io.is_compressed') are written compressed with a
+    fast level.
+    With 'writer_queue_size' the buffers are written by a writer thread (which alone touches the files), so the
+    caller goes on splitting while they are written.
+    """
+
+    def __init__(self, max_open=None, flush_threshold=DEFAULT_FLUSH_THRESHOLD,
+                 max_buffered_bytes=DEFAULT_MAX_BUFFERED_BYTES, mode="w", writer_queue_size=0):
+        """
+        :param max_open: maximal number of open files (default - derived from the file-descriptor limit)
+        :param flush_threshold: bytes buffered for a partition before it is written
+        :param max_buffered_bytes: bytes buffered for all partitions before the largest buffer is written
+        :param mode: the mode a partition file is opened with the first time ('w' truncates leftovers, 'a' keeps them)
+        :param writer_queue_size: if positive, the buffers are written by a writer thread, and up to this number of
+                                  them wait to be written (on top of 'max_buffered_bytes')
+        """
+        self.max_open = max_open if max_open else max_open_files()
+        self.flush_threshold = flush_threshold
+        self.max_buffered_bytes = max_buffered_bytes
+        self.mode = mode
+        self.names = []  # partition names, in the order of their first write
+        self._names_set = set()
+        self._opened = set()  # partitions that were opened at least once
+        self._handles = OrderedDict()  # name -> open file, least recently used first
+        self._buffers = {}  # name -> list of buffered strings
+        self._buffered_bytes = {}  # name -> number of buffered bytes
+        self._total_buffered_bytes = 0
+        self._writer = WriterThread(self._write_buffer, writer_queue_size) if writer_queue_size else None
+
+    def write(self, name, data):
+        """
+        :param name: the partition filename
+        :param data: a string to append to the partition
+        """
+        if name not in self._names_set:
+            self._names_set.add(name)
+            self.names.append(name)
+            self._buffers[name] = []
+            self._buffered_bytes[name] = 0
+        self._buffers[name].append(data)
+        self._buffered_bytes[name] += len(data)
+        self._total_buffered_bytes += len(data)
+        if self._buffered_bytes[name] >= self.flush_threshold:
+            self.flush(name)
+        elif self._total_buffered_bytes >= self.max_buffered_bytes:
+            self.flush(max(self._buffered_bytes, key=self._buffered_bytes.get))
+
+    def flush(self, name):
+        """
+        Writes the buffered data of a single partition to its file
+        """
+        if not self._buffers[name]:
+            return
+        if self._writer is None:
+            self._write_buffer((name, "".join(self._buffers[name])))
+        else:
+            self._writer.write((name, "".join(self._buffers[name])))
+        self._buffers[name] = []
+        self._total_buffered_bytes -= self._buffered_bytes[name]
+        self._buffered_bytes[name] = 0
+
+    def flush_all(self):
+        for name in self.names:
+            self.flush(name)
+
+    def close(self):
+        try:
+            self.flush_all()
+        finally:
+            try:
+                if self._writer is not None:
+                    self._writer.close()  # waits for the queued buffers
+            finally:
+                for handle in self._handles.values():
+                    handle.close()
+                self._handles.clear()
+
+    def _write_buffer(self, name_and_data):
+        name, data = name_and_data
+        self._get_handle(name).write(data)
+
+    def _get_handle(self, name):
+        handle = self._handles.get(name)
+        if handle is not None:
+            self._handles.move_to_end(name)
+            return handle
+        if len(self._handles) >= self.max_open:
+            _, evicted_handle = self._handles.popitem(last=False)
+            evicted_handle.close()
+        handle = open_file(name, "a" if name in self._opened else self.mode, level=TEMP_COMPRESSION_LEVEL)
+        self._opened.add(name)
+        self._handles[name] = handle
+        return handle
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,161 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+DEFAULT_QUEUE_SIZE = 4  # number of items (e.g. record batches) waiting in each queue between the threads
+WORKER_TYPES = ("thread", "process")
+DEFAULT_WORKER_TYPE = "thread"
+_END = object()  # marks the end of the items of a queue
+
+
+class _ThreadError:
+    """
+    An exception raised in a thread, passed through a queue to be raised again by its consumer
+    """
+    __slots__ = ("exception",)
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def _put(items_queue, item, stop):
+    """
+    Puts an item in a bounded queue, waiting for room unless 'stop' is set (the consumer is gone)
+    :return: True if the item was put in the queue
+    """
+    while not stop.is_set():
+        try:
+            items_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(iterable, items_queue, stop):
+    try:
+        for item in iterable:
+            if not _put(items_queue, item, stop):
+                return
+    except BaseException as exp:
+        _put(items_queue, _ThreadError(exp), stop)
+        return
+    _put(items_queue, _END, stop)
+
+
+def threaded_generator(iterable, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Iterates over an iterable in a reader thread, so reading the next items overlaps the work on the current ones.
+    The reader runs at most 'queue_size' items ahead (backpressure), so memory stays bounded.
+    :param iterable: the items (e.g. a generator of record batches) - iterated in the reader thread only
+    :param queue_size: the maximal number of items read ahead
+    :return: yields the items, in order; an exception of the reader is raised here
+    """
+    items_queue = queue.Queue(maxsize=max(1, queue_size))
+    stop = threading.Event()
+    reader = threading.Thread(target=_produce, args=(iterable, items_queue, stop), name="reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = items_queue.get()
+            if item is _END:
+                return
+            if isinstance(item, _ThreadError):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()  # a consumer that stopped early releases the reader
+        reader.join()
+
+
+def ordered_map(function, iterable, workers=1, worker_type=DEFAULT_WORKER_TYPE, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Maps a function over an iterable in a pool of compute workers, keeping the order of the items.
+    At most 'workers + queue_size' items are in flight, so a slow consumer holds the producer back instead of piling
+    up results in memory.
+    :param function: the function to apply (picklable, e.g. a module function or a 'functools.partial' of one, for
+                     process workers)
+    :param iterable: the items
+    :param workers: the number of compute workers
+    :param worker_type: 'thread' - for work that releases the GIL (numpy, zlib, I/O), or 'process' - for pure Python
+                        work (the items and the results are pickled between the processes)
+    :param queue_size: the number of items submitted beyond the number of workers
+    :return: yields the results, in the order of the items
+    """
+    if worker_type not in WORKER_TYPES:
+        raise ValueError("Unknown worker type '%s' - should be one of: %s" % (worker_type, ", ".join(WORKER_TYPES)))
+    executor_class = ThreadPoolExecutor if worker_type == "thread" else ProcessPoolExecutor
+    max_in_flight = workers + max(1, queue_size)
+    in_flight = deque()
+    with executor_class(max_workers=workers) as executor:
+        try:
+            for item in iterable:
+                in_flight.append(executor.submit(function, item))
+                if len(in_flight) >= max_in_flight:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+
+class WriterThread:
+    """
+    Writes in a dedicated thread - 'write' queues the data and returns at once, so the caller goes on computing while
+    the data is written. The queue is bounded by 'queue_size', so a slow disk holds the caller back (backpressure).
+    An error of the writer is raised by the following 'write' (or by 'close').
+    """
+
+    def __init__(self, write, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        :param write: the function that writes a single item (e.g. the 'write' method of an open file) - called in
+                      the writer thread only, in the order of the items
+        :param queue_size: the maximal number of items waiting to be written
+        """
+        self._write = write
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            if self._error is None:  # after an error the queue is drained, so 'write' never blocks
+                try:
+                    self._write(item)
+                except BaseException as exp:
+                    self._error = exp
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, item):
+        self._raise_error()
+        self._queue.put(item)
+
+    def close(self):
+        """
+        Waits for all the queued items to be written
+        """
+        if self._thread.is_alive():
+            self._queue.put(_END)
+            self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:  # the original exception is the one to report
+            try:
+                self.close()
+            except BaseException:
+                pass
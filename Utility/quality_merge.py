@@ -0,0 +1,173 @@
+import numpy as np
+from Utility.metrics import current_metrics
+
+PHRED_OFFSET = 33
+DEFAULT_QUALITY_CAP = 41  # highest phred score of the capped-sum strategy
+# bytes of duplicate quality strings held in memory before they are merged - about the 1M pending 150 bp qualities
+# the merge was tuned for; a memory budget lowers it (see 'memory_utilities.max_pending_bytes_for_budget')
+DEFAULT_MAX_PENDING_BYTES = 256 << 20
+MIN_MAX_PENDING_BYTES = 4 << 20  # the smallest buffer of pending qualities, whatever the memory budget
+PENDING_STRING_OVERHEAD = 57  # bytes of a pending quality string on top of its characters (str object, list slot)
+MERGE_STRATEGIES = ("max", "mean", "sum")
+DEFAULT_MERGE_STRATEGY = "max"
+
+
+def qualities_to_array(qualities):
+    """
+    :param qualities: a list of quality strings, all of the same length
+    :return: a 2D uint8 array of phred scores - a row for each quality string
+    """
+    joined = "".join(qualities).encode("ascii")
+    return np.frombuffer(joined, dtype=np.uint8).reshape(len(qualities), -1) - PHRED_OFFSET
+
+
+def array_to_quality(phred_scores):
+    """
+    :param phred_scores: a 1D array of phred scores
+    :return: the quality string of the scores
+    """
+    return (phred_scores.astype(np.uint8) + PHRED_OFFSET).tobytes().decode("ascii")
+
+
+def merge_qualities(qualities, strategy=DEFAULT_MERGE_STRATEGY, cap=DEFAULT_QUALITY_CAP):
+    """
+    :param qualities: a list of quality strings (of duplicates of the same sequence), all of the same length
+    :param strategy: 'max' - per-position maximum, 'mean' - per-position (rounded) mean phred,
+                     'sum' - per-position sum of phred capped at 'cap'
+    :param cap: the highest phred score of the 'sum' strategy
+    :return: the merged quality string
+    """
+    phred_scores = qualities_to_array(qualities)
+    if strategy == "max":
+        return array_to_quality(phred_scores.max(axis=0))
+    sums = phred_scores.sum(axis=0, dtype=np.uint32)
+    return array_to_quality(_finalize_sums(sums, len(qualities), strategy, cap))
+
+
+def _finalize_sums(sums, count, strategy, cap):
+    if strategy == "mean":
+        return np.rint(sums / count)
+    return np.minimum(sums, cap)
+
+
+class QualityAggregator:
+    """
+    Merges the quality strings of duplicated sequences in batches.
+    Qualities of duplicates are collected per key, and once they take 'max_pending_bytes' all the collected qualities
+    are merged at once (so the buffer of pending qualities is bounded, whatever the number of duplicates): the
+    qualities of all the keys with the same length are stacked into a single array and reduced per key with
+    'reduceat', so the work per quality character is done by numpy rather than by a Python loop.
+    A 'max' or a (capped) 'sum' merge is itself a quality string that later duplicates are merged into, so it can be
+    written back to where the best quality of the key is kept (see 'load_quality' and 'store_quality'); a 'mean' can
+    not be merged further once it is rounded, so its phred sums and counts are kept until 'merged'.
+    """
+
+    def __init__(self, strategy=DEFAULT_MERGE_STRATEGY, max_pending_bytes=DEFAULT_MAX_PENDING_BYTES,
+                 cap=DEFAULT_QUALITY_CAP, load_quality=None, store_quality=None):
+        """
+        :param strategy: one of 'MERGE_STRATEGIES' (see 'merge_qualities')
+        :param max_pending_bytes: memory of the collected qualities (see 'PENDING_STRING_OVERHEAD') that triggers a
+                                  merge
+        :param cap: the highest phred score of the 'sum' strategy
+        :param load_quality: if given, a function of a key returning its best quality so far - it is called for the
+                             first duplicate of the key after each merge, instead of 'add' being given that quality
+                             for every duplicate
+        :param store_quality: if given (with 'load_quality'), a function of a key and a quality string - the 'max'
+                              and 'sum' merges are written back with it on each merge rather than kept by the
+                              aggregator, so they take no memory on top of the pending qualities
+        """
+        if strategy not in MERGE_STRATEGIES:
+            raise ValueError("Unknown quality merge strategy '%s' - should be one of: %s"
+                             % (strategy, ", ".join(MERGE_STRATEGIES)))
+        self.strategy = strategy
+        self.max_pending_bytes = max_pending_bytes
+        self.cap = cap
+        self.load_quality = load_quality
+        self.store_quality = store_quality
+        self._pending = {}  # key -> list of quality strings not merged yet
+        self._num_pending = 0
+        self._pending_bytes = 0
+        self._merged = {}  # key -> merged quality string ('max', 'sum') or uint32 array of phred sums ('mean')
+        self._counts = {}  # key -> number of merged qualities ('mean' only)
+
+    def add(self, key, quality, first_quality=None):
+        """
+        :param key: the key (sequence) of a duplicate
+        :param quality: the quality string of the duplicate
+        :param first_quality: the quality string of the first occurrence of the key (used only the first time the
+                              key is added; not needed with 'load_quality')
+        """
+        pending = self._pending.get(key)
+        if pending is None:
+            if key in self._merged:
+                pending = self._pending[key] = []
+            else:
+                if self.load_quality is not None:
+                    first_quality = self.load_quality(key)
+                pending = self._pending[key] = [first_quality]
+                self._num_pending += 1
+                self._pending_bytes += len(first_quality) + PENDING_STRING_OVERHEAD
+        pending.append(quality)
+        self._num_pending += 1
+        self._pending_bytes += len(quality) + PENDING_STRING_OVERHEAD
+        if self._pending_bytes >= self.max_pending_bytes:
+            self.flush()
+
+    def flush(self):
+        """
+        Merges all the pending qualities
+        """
+        with current_metrics().stage("quality_merge") as stage:
+            stage.add(records=self._num_pending)
+            self._flush()
+
+    def _flush(self):
+        by_length = {}
+        for key, qualities in self._pending.items():
+            if self.strategy != "mean" and key in self._merged:
+                qualities.append(self._merged[key])
+            by_length.setdefault(len(qualities[0]), []).append((key, qualities))
+        for keyed_qualities in by_length.values():
+            offsets = []
+            all_qualities = []
+            for _, qualities in keyed_qualities:
+                offsets.append(len(all_qualities))
+                all_qualities.extend(qualities)
+            phred_scores = qualities_to_array(all_qualities)
+            if self.strategy == "mean":
+                reduced = np.add.reduceat(phred_scores.astype(np.uint32), offsets, axis=0)
+                for (key, qualities), row in zip(keyed_qualities, reduced):
+                    previous = self._merged.get(key)
+                    self._merged[key] = row if previous is None else previous + row
+                    self._counts[key] = self._counts.get(key, 0) + len(qualities)
+                continue
+            if self.strategy == "max":
+                reduced = np.maximum.reduceat(phred_scores, offsets, axis=0)
+            else:  # capping a capped sum of some of the qualities plus the rest gives the capped sum of all of them
+                reduced = np.minimum(np.add.reduceat(phred_scores.astype(np.uint32), offsets, axis=0), self.cap)
+            # the merged qualities of the group are decoded at once, and sliced per key
+            merged_text = array_to_quality(reduced.ravel())
+            width = reduced.shape[1]
+            for index, (key, _) in enumerate(keyed_qualities):
+                merged = merged_text[index * width:(index + 1) * width]
+                if self.store_quality is None:
+                    self._merged[key] = merged
+                else:
+                    self.store_quality(key, merged)
+        self._pending = {}
+        self._num_pending = 0
+        self._pending_bytes = 0
+
+    def merged(self):
+        """
+        :return: yields (key, merged quality string) for every key that was added (but not for the merges already
+                 written back with 'store_quality'), and resets the aggregator
+        """
+        self.flush()
+        for key, merged in self._merged.items():
+            if self.strategy == "mean":
+                yield key, array_to_quality(_finalize_sums(merged, self._counts[key], self.strategy, self.cap))
+            else:
+                yield key, merged
+        self._merged = {}
+        self._counts = {}
@@ -0,0 +1,170 @@
+import numpy as np
+from Utility.quality_merge import PHRED_OFFSET
+
+TRIM_BLOCK_CELLS = 1 << 20  # positions of the reads of a batch whose scores are held at a time (see 'length_buckets')
+
+
+def parse_window(window_spec):
+    """
+    :param window_spec: '<size>:<phred threshold>', e.g. '4:20'
+    :return: (size, threshold)
+    """
+    try:
+        size, threshold = map(int, window_spec.split(":"))
+    except ValueError:
+        raise ValueError("Incorrect window '%s' - should be <size>:<phred threshold>" % window_spec)
+    if size < 1:
+        raise ValueError("The size of the window should be positive")
+    return size, threshold
+
+
+def length_buckets(lengths, max_cells=TRIM_BLOCK_CELLS):
+    """
+    Groups the reads of a batch so that the arrays of their scores (a row for each read, as wide as the longest read
+    of the group) stay small: reads are grouped by length within a factor of 2 of each other (so a few long reads do
+    not widen the rows of all the others), and each group is taken 'max_cells' positions at a time.
+    :param lengths: an array of the length of each read
+    :param max_cells: the maximal number of rows x width of a group (a single longer read is a group of its own)
+    :return: yields (an array of the indexes of the reads of a group, its width)
+    """
+    if not len(lengths):
+        return
+    order = np.argsort(lengths, kind="stable")
+    sorted_lengths = lengths[order]
+    length_classes = np.frexp(sorted_lengths)[1]  # reads of lengths [2 ** (k - 1), 2 ** k) share the class k
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(length_classes)) + 1, [len(order)]))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        width = int(sorted_lengths[end - 1])
+        step = max(1, max_cells // max(width, 1))
+        for rows_start in range(start, end, step):
+            yield order[rows_start:min(rows_start + step, end)], width
+
+
+def quality_scores(batch, from_end=False, rows=None, width=None):
+    """
+    :param batch: a 'FastqBatch'
+    :param from_end: if True, the scores of each read are in reverse order (from its 3' end)
+    :param rows: if given, an array of the indexes of the reads to score (see 'length_buckets') - otherwise all of them
+    :param width: the width of the array - at least the longest quality of 'rows' (by default, exactly it)
+    :return: (a 2D int16 array of the phred scores of the qualities - a row for each read, padded with 0 past the end
+              of its quality, a boolean array of the same shape of the positions within the qualities)
+    """
+    data = np.frombuffer(batch.buffer, dtype=np.uint8)
+    line_starts, line_ends = batch.line_starts[3::4], batch.line_ends[3::4]
+    if rows is not None:
+        line_starts, line_ends = line_starts[rows], line_ends[rows]
+    lengths = line_ends - line_starts
+    if width is None:
+        width = int(lengths.max()) if len(lengths) else 0
+    positions = np.arange(width)
+    inside = positions < lengths[:, None]
+    if from_end:
+        indexes = line_ends[:, None] - 1 - positions
+    else:
+        indexes = line_starts[:, None] + positions
+    scores = data[np.where(inside, indexes, 0)].astype(np.int16)
+    scores -= PHRED_OFFSET
+    scores[~inside] = 0
+    return scores, inside
+
+
+def bwa_trim_counts(scores, inside, threshold):
+    """
+    BWA's quality trimming (as 'bwa aln -q' and cutadapt) of a single edge of every read at once: going inward from
+    the edge, the read is cut where the sum of (threshold - score) is maximal, the sum stopping once it is negative.
+    :param scores: phred scores from the trimmed edge inward (see 'quality_scores')
+    :param inside: the positions within the qualities
+    :param threshold: the phred threshold
+    :return: an array of the number of bases trimmed from the edge of each read
+    """
+    if not scores.shape[1]:
+        return np.zeros(len(scores), dtype=np.int64)
+    partial_sums = np.cumsum(threshold - scores, axis=1, dtype=np.int32)
+    running = np.logical_and.accumulate((partial_sums >= 0) & inside, axis=1)
+    partial_sums = np.where(running, partial_sums, 0)
+    best = partial_sums.argmax(axis=1)  # the first maximum, as the scan keeps only a strictly larger sum
+    best_sums = partial_sums[np.arange(len(best)), best]
+    return np.where(best_sums > 0, best + 1, 0)
+
+
+def window_cut_ends(scores, inside, cut_starts, size, threshold):
+    """
+    Sliding-window trimming (as Trimmomatic's SLIDINGWINDOW) of every read at once: scanning from 'cut_starts', each
+    read is cut at the start of the first window of 'size' bases whose mean score is below the threshold (a remainder
+    shorter than the window is a single window)
+    :param scores: phred scores from the 5' end (see 'quality_scores')
+    :param inside: the positions within the qualities
+    :param cut_starts: an array of the position each scan starts from (e.g. after trimming the 5' end)
+    :param size: the size of the window
+    :param threshold: the phred threshold of the mean score of a window
+    :return: an array of the end of each read after trimming
+    """
+    lengths = inside.sum(axis=1)
+    rows = np.arange(len(scores))
+    sums = np.zeros((len(scores), scores.shape[1] + 1), dtype=np.int32)
+    np.cumsum(scores, axis=1, out=sums[:, 1:])
+    window_sums = sums[:, size:] - sums[:, :-size] if size <= scores.shape[1] else sums[:, :0]
+    positions = np.arange(window_sums.shape[1])
+    failing = (window_sums < threshold * size) & (positions >= cut_starts[:, None]) & \
+              (positions <= (lengths - size)[:, None])
+    first_failing = failing.argmax(axis=1) if failing.shape[1] else np.zeros(len(scores), dtype=np.int64)
+    cut_ends = np.where(failing.any(axis=1), first_failing, lengths)
+    remainders = lengths - cut_starts
+    short_failing = (remainders < size) & (sums[rows, lengths] - sums[rows, cut_starts] < threshold * remainders)
+    return np.where(short_failing, cut_starts, cut_ends)
+
+
+def quality_cut_points(batch, threshold_5=None, threshold_3=None, window=None):
+    """
+    :param batch: a validated 'FastqBatch'
+    :param threshold_5: if given, the phred threshold of BWA-style trimming of the 5' end (see 'bwa_trim_counts')
+    :param threshold_3: if given, the phred threshold of BWA-style trimming of the 3' end
+    :param window: if given, (size, threshold) of sliding-window trimming after the 5' end (see 'window_cut_ends')
+    :return: (an array of the start of each read after trimming, an array of its end - not before its start)
+    """
+    lengths = batch.line_lengths(3)
+    cut_starts = np.zeros(len(lengths), dtype=np.int64)
+    cut_ends = lengths.astype(np.int64)
+    if threshold_5 is None and threshold_3 is None and window is None:
+        return cut_starts, cut_ends
+    for rows, width in length_buckets(lengths):
+        if threshold_5 is not None or window is not None:
+            scores, inside = quality_scores(batch, rows=rows, width=width)
+            if threshold_5 is not None:
+                cut_starts[rows] = bwa_trim_counts(scores, inside, threshold_5)
+            if window is not None:
+                cut_ends[rows] = window_cut_ends(scores, inside, cut_starts[rows], *window)
+            del scores, inside  # before the scores from the 3' end are computed
+        if threshold_3 is not None:
+            cut_ends[rows] = np.minimum(cut_ends[rows], lengths[rows] - bwa_trim_counts(
+                *quality_scores(batch, from_end=True, rows=rows, width=width), threshold_3))
+    return cut_starts, np.maximum(cut_starts, cut_ends)
+
+
+def quality_trim_batch(batch, threshold_5=None, threshold_3=None, window=None, min_length=0):
+    """
+    Trims the low-quality edges of all the reads of a batch at once - the cut points are computed on arrays of the
+    quality scores, with no per-base (or per-read) work in Python.
+    :param batch: a validated 'FastqBatch'
+    :param threshold_5, threshold_3, window: the trimming (see 'quality_cut_points')
+    :param min_length: reads shorter than this after trimming are dropped
+    :return: a new 'FastqBatch' of the trimmed reads
+    """
+    cut_starts, cut_ends = quality_cut_points(batch, threshold_5, threshold_3, window)
+    return batch.cut_records(cut_starts, cut_ends, keep=cut_ends - cut_starts >= min_length if min_length else None)
+
+
+def quality_trim_pair(batch_1, batch_2, threshold_5=None, threshold_3=None, window=None, min_length=0):
+    """
+    Trims the mates of paired-end reads (see 'quality_trim_batch') - a pair is dropped if either of its reads is
+    shorter than 'min_length' after trimming, so the outputs stay paired
+    :param batch_1: a validated 'FastqBatch' of R1 reads
+    :param batch_2: a validated 'FastqBatch' of their mates, in the same order
+    :return: (a new 'FastqBatch' of the trimmed R1 reads, a new 'FastqBatch' of the trimmed R2 reads)
+    """
+    cut_points_1 = quality_cut_points(batch_1, threshold_5, threshold_3, window)
+    cut_points_2 = quality_cut_points(batch_2, threshold_5, threshold_3, window)
+    keep = None
+    if min_length:
+        keep = (cut_points_1[1] - cut_points_1[0] >= min_length) & (cut_points_2[1] - cut_points_2[0] >= min_length)
+    return batch_1.cut_records(*cut_points_1, keep=keep), batch_2.cut_records(*cut_points_2, keep=keep)
@@ -0,0 +1,33 @@
+SAM_HEADER_PREFIX = "@"
+UNMAPPED_REFERENCE = "*"  # the reference name (RNAME) of an unmapped read
+# columns of a SAM alignment line
+QNAME, FLAG, RNAME, POS, MAPQ, CIGAR = range(6)
+
+
+def sam_column(line, column):
+    """
+    :param line: a SAM alignment line (with or without its newline)
+    :param column: the (zero-based) column to extract
+    :return: the column - the line is split only up to the column, the rest of the line is never scanned
+    """
+    return line.split("\t", column + 1)[column].rstrip("\n")
+
+
+def sam_column_getter(column, convert=None):
+    """
+    :param column: the (zero-based) column to extract
+    :param convert: a function applied to the column (e.g. 'int' for POS), or None
+    :return: a function extracting the column from a line (e.g. a key for 'generators_utilities.window_generator')
+    """
+    if convert is None:
+        return lambda line: sam_column(line, column)
+    return lambda line: convert(sam_column(line, column))
+
+
+def is_header_or_unmapped(line):
+    """
+    :param line: a SAM line (with or without its newline)
+    :return: True for header lines and unmapped alignments
+    """
+    return line[:1] == SAM_HEADER_PREFIX or sam_column(line, RNAME) == UNMAPPED_REFERENCE
+
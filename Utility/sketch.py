@@ -0,0 +1,43 @@
+DEFAULT_COUNTERS_PER_ITEM = 8  # with 4 hashes, less than 3% of the singletons are mistaken for duplicates
+DEFAULT_NUM_HASHES = 4
+MAX_COUNT = 2  # counters saturate - only 'once' and 'more than once' are told apart
+HASH_MASK = (1 << 64) - 1
+
+
+class CountingBloomFilter:
+    """
+    A counting Bloom filter that tells items seen once from items seen more than once.
+    'count' never underestimates: an item seen more than once always counts as 2, so an item that counts as 1 was
+    certainly seen exactly once (an item seen once may count as 2 because of collisions).
+    Items are hashed with Python's built-in (salted) 'hash', so a filter is only valid within the process that
+    filled it - which is also what makes it fast, as the hash of a string is computed once and cached on it.
+    """
+
+    def __init__(self, capacity, counters_per_item=DEFAULT_COUNTERS_PER_ITEM, num_hashes=DEFAULT_NUM_HASHES):
+        """
+        :param capacity: the expected number of items added
+        :param counters_per_item: number of counters (bytes) allocated per expected item
+        :param num_hashes: number of counters each item is counted in
+        """
+        self.size = max(64, int(capacity * counters_per_item))
+        self.num_hashes = num_hashes
+        self.counters = bytearray(self.size)
+
+    def _indexes(self, item):
+        item_hash = hash(item) & HASH_MASK
+        first_hash = item_hash & 0xFFFFFFFF
+        second_hash = (item_hash >> 32) | 1
+        return [(first_hash + i * second_hash) % self.size for i in range(self.num_hashes)]
+
+    def add(self, item):
+        counters = self.counters
+        for index in self._indexes(item):
+            if counters[index] < MAX_COUNT:
+                counters[index] += 1
+
+    def count(self, item):
+        """
+        :return: 0 if the item was never added, 1 if it was added once, 2 if it was (probably) added more than once
+        """
+        counters = self.counters
+        return min([counters[index] for index in self._indexes(item)])
@@ -0,0 +1,76 @@
+import os
+import random
+import pytest
+from Processing import fastq_collapse as fastq_collapse_module
+from Processing.fastq_collapse import fastq_collapse
+from Utility.checkpoint import CHECKPOINT_SUFFIX
+
+
+def write_reads(path, num_reads=2000, seed=1):
+    rng = random.Random(seed)
+    sequences = ["".join(rng.choice("ACGT") for _ in range(12)) for _ in range(num_reads // 3)]
+    path.write_text("".join("@r%d\n%s\n+\n%s\n" % (index, rng.choice(sequences),
+                                                   "".join(rng.choice("#+5?I") for _ in range(12)))
+                            for index in range(num_reads)))
+    return str(path)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(monkeypatch, num_partitions):
+    """
+    Interrupts the collapse once 'num_partitions' partitions are finished - the next partition is appended to the
+    output, but the run is killed before it is recorded as finished
+    """
+    finish_partition = fastq_collapse_module.finish_partition
+    finished = []
+
+    def interrupting_finish_partition(filename, *args, **kwargs):
+        if len(finished) == num_partitions:
+            raise Interrupted()
+        finish_partition(filename, *args, **kwargs)
+        finished.append(filename)
+    monkeypatch.setattr(fastq_collapse_module, "finish_partition", interrupting_finish_partition)
+
+
+@pytest.mark.parametrize("output_name", ["collapsed.fq", "collapsed.fq.gz"])
+def test_resumed_run_matches_an_uninterrupted_run(tmp_path, monkeypatch, output_name):
+    fastq_filename = write_reads(tmp_path / "reads.fq")
+    expected_filename = str(tmp_path / ("expected_" + output_name))
+    fastq_collapse(fastq_filename, expected_filename, prefix=2, checkpoint=True)
+    new_filename = str(tmp_path / output_name)
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 5)
+        with pytest.raises(Interrupted):
+            fastq_collapse(fastq_filename, new_filename, prefix=2, checkpoint=True)
+    assert os.path.exists(new_filename + CHECKPOINT_SUFFIX)
+    fastq_collapse(fastq_filename, new_filename, prefix=2, checkpoint=True)
+    with open(expected_filename, "rb") as expected_file, open(new_filename, "rb") as new_file:
+        assert new_file.read() == expected_file.read()
+    assert sorted(os.listdir(str(tmp_path))) == sorted(["reads.fq", "expected_" + output_name, output_name])
+
+
+def test_resumed_split_keeps_the_partitions_of_other_runs(tmp_path, monkeypatch):
+    fastq_filename = write_reads(tmp_path / "reads.fq")
+    expected_filename = str(tmp_path / "expected.fq")
+    fastq_collapse(fastq_filename, expected_filename, prefix=2)
+    new_filename = str(tmp_path / "out")
+    # the partitions of a concurrent run whose output is 'out_2'
+    other_run_files = [tmp_path / "out_2_AAA.temp", tmp_path / "out_2_x.part"]
+    for other_run_file in other_run_files:
+        other_run_file.write_text("@r\nAAA\n+\nIII\n")
+
+    def interrupting_split_large_partitions(list_of_files, max_partition_size):
+        raise Interrupted()
+    with monkeypatch.context() as patch:
+        patch.setattr(fastq_collapse_module, "split_large_partitions", interrupting_split_large_partitions)
+        with pytest.raises(Interrupted):
+            fastq_collapse(fastq_filename, new_filename, prefix=2, checkpoint=True, max_partition_size=1 << 30)
+    assert os.listdir(new_filename + fastq_collapse_module.PARTITIONS_DIR_SUFFIX)
+    fastq_collapse(fastq_filename, new_filename, prefix=2, checkpoint=True, max_partition_size=1 << 30)
+    with open(expected_filename, "rb") as expected_file, open(new_filename, "rb") as new_file:
+        assert new_file.read() == expected_file.read()
+    assert all(other_run_file.read_text() == "@r\nAAA\n+\nIII\n" for other_run_file in other_run_files)
+    assert not os.path.exists(new_filename + fastq_collapse_module.PARTITIONS_DIR_SUFFIX)
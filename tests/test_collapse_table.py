@@ -0,0 +1,55 @@
+from Utility.collapse_table import CollapseTable, pack_sequence, unpack_sequence
+
+
+def collapse(records):
+    table = CollapseTable()
+    for record in records:
+        table.add(*record)
+    return sorted((fastq_obj.strings[1], count) for fastq_obj, count in table.values())
+
+
+def test_digits_are_not_packed_as_bases():
+    for sequence in ("A0", "T0123", "0123"):
+        assert pack_sequence(sequence) == sequence
+    assert unpack_sequence(pack_sequence("TACGT")) == "TACGT"
+
+
+def test_reads_with_digits_are_not_merged():
+    records = [("@a", "T0123", "+", "IIIII"), ("@b", "TACGT", "+", "IIIII"), ("@c", "A0", "+", "II"),
+               ("@d", "AA", "+", "II")]
+    assert collapse(records) == [("A0", 1), ("AA", 1), ("T0123", 1), ("TACGT", 1)]
+
+
+def test_long_reads():
+    sequence = "ACGT" * 20000
+    records = [("@" + "h" * 70000, sequence, "+", "I" * len(sequence)), ("@b", sequence, "+", "#" * len(sequence))]
+    table = CollapseTable()
+    for record in records:
+        table.add(*record)
+    [(fastq_obj, count)] = table.values()
+    assert (fastq_obj.strings[0], fastq_obj.strings[3], count) == (records[0][0], records[0][3], 2)
+
+
+def test_mates_of_a_pair_are_packed_apart():
+    key = pack_sequence("ACGT\x1fTTGCA")
+    assert isinstance(key, tuple) and all(isinstance(mate_key, int) for mate_key in key)
+    assert unpack_sequence(key) == "ACGT\x1fTTGCA"
+    assert pack_sequence("ACNT\x1fTTGCA")[0] == "ACNT"
+    assert unpack_sequence(pack_sequence("ACNT\x1fTTGCA")) == "ACNT\x1fTTGCA"
+    assert pack_sequence("A\x1fCA") != pack_sequence("AC\x1fA")
+
+
+def test_merged_qualities_are_written_back_into_the_table():
+    qualities = ["%c" % (33 + (index * 7) % 41) * 4 for index in range(12)]
+    records = [("@r%d" % index, ("ACGT", "ACGA", "ACNT")[index % 3], "+", quality)
+               for index, quality in enumerate(qualities)]
+    for strategy in ("max", "mean", "sum"):
+        merged = []
+        for max_pending_bytes in (1, 1 << 20):
+            table = CollapseTable(strategy, max_pending_bytes)
+            for record in records:
+                table.add(*record)
+            if max_pending_bytes == 1 and strategy != "mean":  # nothing is kept by the aggregator between merges
+                assert table._quality_aggregator._merged == {}
+            merged.append([(fastq_obj.strings[3], count) for fastq_obj, count in table.values()])
+        assert merged[0] == merged[1]
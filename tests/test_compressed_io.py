@@ -0,0 +1,90 @@
+import os
+import gzip
+import random
+import pytest
+from Utility.compressed_io import open_file, generate_decompressed_chunks, bgzf_uncompressed_size, BGZF_BLOCK_SIZE, \
+    BGZF_EOF, BLOCKS_PER_TASK, BGZF_HEADER
+from Utility.fastq_reader import generate_fastq_records
+from Processing import fastq_collapse as fastq_collapse_module
+
+
+def fastq_text(num_bytes, seed=1):
+    rng = random.Random(seed)
+    records = []
+    size = 0
+    while size < num_bytes:
+        sequence = "".join(rng.choices("ACGT", k=100))
+        records.append("@r%d\n%s\n+\n%s\n" % (len(records), sequence, "".join(rng.choices("#5I", k=100))))
+        size += len(records[-1])
+    return "".join(records)
+
+
+def block_sizes(filename):
+    sizes = []
+    with open(filename, "rb") as fp:
+        data = fp.read()
+    position = 0
+    while position < len(data):
+        block_size = BGZF_HEADER.unpack_from(data, position)[-1] + 1
+        sizes.append(block_size)
+        position += block_size
+    return sizes
+
+
+def decompress(filename, read_size=1 << 16):
+    with open(filename, "rb") as fp:
+        return b"".join(generate_decompressed_chunks(fp, read_size))
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_round_trip_across_blocks(tmp_path, threads):
+    text = fastq_text(3 * BLOCKS_PER_TASK * BGZF_BLOCK_SIZE + 12345)  # several tasks of blocks, and a short block
+    filename = str(tmp_path / "reads.fq.gz")
+    with open_file(filename, "w", threads=threads) as compressed_file:
+        for start in range(0, len(text), 100000):  # writes that do not end on block borders
+            compressed_file.write(text[start:start + 100000])
+    sizes = block_sizes(filename)
+    assert len(sizes) > 3 * BLOCKS_PER_TASK and max(sizes) <= 1 << 16
+    assert open(filename, "rb").read().endswith(BGZF_EOF)
+    assert decompress(filename) == decompress(filename, read_size=777) == text.encode()
+    assert gzip.open(filename, "rt").read() == text
+    assert bgzf_uncompressed_size(filename) == len(text)
+
+
+def test_zero_padding_after_the_eof_block(tmp_path):
+    text = fastq_text(3 * BGZF_BLOCK_SIZE)
+    filename = str(tmp_path / "reads.fq.gz")
+    with open_file(filename, "w", threads=2) as compressed_file:
+        compressed_file.write(text)
+    with open(filename, "ab") as fp:
+        fp.write(b"\0" * 1000)
+    assert decompress(filename) == decompress(filename, read_size=5) == text.encode()
+    assert bgzf_uncompressed_size(filename) == len(text)
+    assert "".join("\n".join(record) + "\n" for record in generate_fastq_records(filename)) == text
+    with open(filename, "ab") as fp:
+        fp.write(b"\0garbage")
+    assert bgzf_uncompressed_size(filename) is None
+
+
+def test_truncated_file_is_an_error(tmp_path):
+    filename = str(tmp_path / "reads.fq.gz")
+    with open_file(filename, "w") as compressed_file:
+        compressed_file.write(fastq_text(2 * BGZF_BLOCK_SIZE))
+    with open(filename, "r+b") as fp:
+        fp.truncate(BGZF_BLOCK_SIZE // 4)
+    with pytest.raises(EOFError):
+        decompress(filename)
+
+
+def test_a_small_gzip_input_is_collapsed_in_memory(tmp_path, monkeypatch):
+    fastq_filename = str(tmp_path / "reads.fq.gz")
+    with gzip.open(fastq_filename, "wt") as fastq_file:  # gzip, not BGZF - its uncompressed size is not known
+        fastq_file.write(fastq_text(50000))
+    assert bgzf_uncompressed_size(fastq_filename) is None
+
+    def split_file_to_sub_files_by_prefix(*args, **kwargs):
+        raise AssertionError("the input was split into partitions")
+    monkeypatch.setattr(fastq_collapse_module, "split_file_to_sub_files_by_prefix", split_file_to_sub_files_by_prefix)
+    new_filename = str(tmp_path / "collapsed.fq")
+    fastq_collapse_module.fastq_collapse(fastq_filename, new_filename, mem_budget=1 << 30)
+    assert sorted(os.listdir(str(tmp_path))) == ["collapsed.fq", "reads.fq.gz"]
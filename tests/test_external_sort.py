@@ -0,0 +1,51 @@
+import io
+import os
+import random
+import pytest
+from Utility import external_sort as external_sort_module
+from Utility.external_sort import external_sort
+from Utility.generators_utilities import key_sorted_gen
+
+
+def items(num_items, seed=1):
+    rng = random.Random(seed)
+    return [(rng.randrange(50), index) for index in range(num_items)]  # many equal keys, the index is the order
+
+
+@pytest.mark.parametrize("fanin", [external_sort_module.MAX_MERGE_FANIN, 3])
+def test_spilled_runs_are_sorted_and_stable(tmp_path, monkeypatch, fanin):
+    monkeypatch.setattr(external_sort_module, "MAX_MERGE_FANIN", fanin)  # 3 - the runs are merged in several levels
+    unsorted = items(1000)
+    spilled = []
+    original_write_run = external_sort_module.write_run
+
+    def write_run(run, temp_dir=None):
+        spilled.append(original_write_run(run, temp_dir))
+        return spilled[-1]
+    monkeypatch.setattr(external_sort_module, "write_run", write_run)
+    assert list(external_sort(unsorted, key=lambda item: item[0], run_size=70, temp_dir=str(tmp_path))) == \
+        sorted(unsorted, key=lambda item: item[0])
+    assert len(spilled) > 10
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_temp_files_are_removed_when_the_merge_is_not_finished(tmp_path):
+    sorted_items = external_sort(items(1000), run_size=70, temp_dir=str(tmp_path))
+    assert next(sorted_items) == min(items(1000))
+    assert os.listdir(str(tmp_path))
+    sorted_items.close()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_a_single_run_is_not_spilled(tmp_path):
+    assert list(external_sort([3, 1, 2], run_size=70, temp_dir=str(tmp_path))) == [1, 2, 3]
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_key_sorted_gen_of_lines(tmp_path):
+    lines = ["%d\tline%d\n" % (key, index) for key, index in items(500, seed=2)]
+    expected = sorted(lines, key=lambda line: int(line.split("\t")[0]))
+    sorted_lines = list(key_sorted_gen(lambda line: int(line.split("\t")[0]), io.StringIO("".join(lines)),
+                                       run_size=40, temp_dir=str(tmp_path)))
+    assert sorted_lines == expected[:-1] + [expected[-1][:-1]]
+    assert os.listdir(str(tmp_path)) == []
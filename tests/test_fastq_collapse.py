@@ -0,0 +1,115 @@
+import os
+import random
+import pytest
+from Processing import fastq_collapse as fastq_collapse_module
+from Processing.fastq_collapse import fastq_collapse, collapse_fastq_to_dict
+from Utility.Fastq_class import FastqRecord
+from Utility.compressed_io import open_file
+
+READS = "@a\nACGT\n+\nIIII\n@b\nACGT\n+\n####\n@c\nTTTT\n+\nIIII\n"
+
+
+@pytest.mark.parametrize("options", [{}, {"mem_budget": 1 << 30}, {"method": "sort"}, {"workers": 2},
+                                     {"pipelined": True}])
+@pytest.mark.parametrize("output_name", ["collapsed.fq", "collapsed.fq.gz"])
+def test_a_second_run_replaces_the_output(tmp_path, options, output_name):
+    (tmp_path / "reads.fq").write_text(READS)
+    new_filename = str(tmp_path / output_name)
+    fastq_collapse(str(tmp_path / "reads.fq"), new_filename, prefix=1, **options)
+    with open(new_filename, "rb") as new_file:
+        first_output = new_file.read()
+    fastq_collapse(str(tmp_path / "reads.fq"), new_filename, prefix=1, **options)
+    with open(new_filename, "rb") as new_file:
+        assert new_file.read() == first_output
+
+
+def test_the_output_can_not_be_the_input(tmp_path):
+    (tmp_path / "reads.fq").write_text(READS)
+    with pytest.raises(ValueError):
+        fastq_collapse(str(tmp_path / "reads.fq"), str(tmp_path / "reads.fq"))
+    assert (tmp_path / "reads.fq").read_text() == READS
+
+
+@pytest.mark.parametrize("strategy", ["max", "mean", "sum"])
+def test_qualities_merged_into_the_records_do_not_depend_on_the_buffer(strategy):
+    records = [("@r%d" % index, ("ACGT", "ACGA", "ACNT")[index % 3], "+", "%c" % (33 + (index * 7) % 41) * 4)
+               for index in range(12)]
+    collapsed = [[(fastq_obj.strings[0], fastq_obj.strings[3], count) for fastq_obj, count in
+                  collapse_fastq_to_dict((FastqRecord(*record) for record in records), strategy,
+                                         max_pending_bytes).values()] for max_pending_bytes in (1, 1 << 20)]
+    assert collapsed[0] == collapsed[1]
+    assert [count for _, _, count in collapsed[0]] == [4, 4, 4]
+
+
+@pytest.mark.parametrize("options", [{}, {"checkpoint": True}])
+def test_a_missing_input_leaves_the_output_as_is(tmp_path, options):
+    (tmp_path / "collapsed.fq").write_text(READS)
+    with pytest.raises(OSError):
+        fastq_collapse(str(tmp_path / "typo.fq"), str(tmp_path / "collapsed.fq"), **options)
+    assert (tmp_path / "collapsed.fq").read_text() == READS
+
+
+def collapsed_records(filename):
+    lines = open(filename).read().split("\n")[:-1]
+    return sorted(zip(lines[0::4], lines[1::4], lines[3::4]))
+
+
+@pytest.mark.parametrize("merge_strategy", ["max", "mean"])
+def test_the_sort_method_matches_the_partition_method(tmp_path, merge_strategy):
+    rng = random.Random(1)
+    sequences = ["".join(rng.choice("ACGTN") for _ in range(10)) for _ in range(300)]
+    (tmp_path / "reads.fq").write_text("".join("@r%d\n%s\n+\n%s\n" % (index, rng.choice(sequences),
+                                                                     "".join(rng.choice("#+5?I") for _ in range(10)))
+                                               for index in range(3000)))
+    collapsed = []
+    for method in ("partition", "sort"):
+        new_filename = str(tmp_path / (method + ".fq"))
+        fastq_collapse(str(tmp_path / "reads.fq"), new_filename, prefix=2, merge_strategy=merge_strategy,
+                       method=method, run_size=500)
+        collapsed.append(collapsed_records(new_filename))
+    # the header of the first occurrence with the count, the sequence and the merged quality of every sequence
+    assert collapsed[0] == collapsed[1]
+    assert sum(int(header.rpartition("_count:")[2]) for header, _, _ in collapsed[0]) == 3000
+    assert len(collapsed[0]) == len(set(sequences))
+
+
+def test_oversized_partitions_are_resplit_into_the_same_output(tmp_path, monkeypatch):
+    rng = random.Random(2)
+    sequences = ["".join(rng.choice("ACGT") for _ in range(10)) for _ in range(200)]
+    reads = [rng.choice(sequences) for _ in range(2000)] + ["A" * 10] * 500  # a poly-A partition can not be split
+    rng.shuffle(reads)
+    (tmp_path / "reads.fq").write_text("".join("@r%d\n%s\n+\n%s\n" % (index, sequence,
+                                                                     "".join(rng.choice("#+5?I") for _ in range(10)))
+                                               for index, sequence in enumerate(reads)))
+    resplit_depths = []
+    resplit_partition = fastq_collapse_module.resplit_partition
+
+    def counting_resplit_partition(filename, depth):
+        resplit_depths.append(depth)
+        return resplit_partition(filename, depth)
+    monkeypatch.setattr(fastq_collapse_module, "resplit_partition", counting_resplit_partition)
+    collapsed = []
+    for max_partition_size in (None, 2000):
+        new_filename = str(tmp_path / ("collapsed_%s.fq" % max_partition_size))
+        fastq_collapse(str(tmp_path / "reads.fq"), new_filename, prefix=1, max_partition_size=max_partition_size)
+        collapsed.append(collapsed_records(new_filename))
+    assert collapsed[0] == collapsed[1]
+    assert max(resplit_depths) > 0  # some sub-partitions were re-split again
+    assert not os.path.exists(str(tmp_path / "collapsed_2000.fq") + fastq_collapse_module.PARTITIONS_DIR_SUFFIX)
+
+
+@pytest.mark.parametrize("output_name", ["collapsed.fq", "collapsed.fq.gz"])
+def test_partitions_collapsed_by_workers_are_joined_in_order(tmp_path, output_name):
+    rng = random.Random(3)
+    sequences = ["".join(rng.choice("ACGT") for _ in range(10)) for _ in range(400)]
+    (tmp_path / "reads.fq").write_text("".join("@r%d\n%s\n+\n%s\n" % (index, rng.choice(sequences),
+                                                                     "".join(rng.choice("#+5?I") for _ in range(10)))
+                                               for index in range(3000)))
+    outputs = []
+    for workers in (1, 3):
+        new_filename = str(tmp_path / ("%d_%s" % (workers, output_name)))
+        fastq_collapse(str(tmp_path / "reads.fq"), new_filename, prefix=2, workers=workers)
+        with open_file(new_filename, "rb") as new_file:
+            outputs.append(new_file.read())
+    assert outputs[0] == outputs[1]
+    assert sorted(os.listdir(str(tmp_path))) == sorted(["reads.fq", "1_" + output_name, "3_" + output_name])
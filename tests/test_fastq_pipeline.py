@@ -0,0 +1,45 @@
+import os
+import random
+import pytest
+from Processing.fastq_pipeline import fastq_pipeline
+from Processing.fastq_trimming import fastq_trimming
+from Processing.fastq_collapse import fastq_collapse, fastq_collapse_paired
+
+
+def write_reads(path, num_reads=1000, seed=1):
+    rng = random.Random(seed)
+    # reads that differ only out of the trimming range are duplicates once trimmed
+    sequences = ["".join(rng.choice("ACGT") for _ in range(8)) for _ in range(100)]
+
+    def random_bases(length):
+        return "".join(rng.choice("ACGT") for _ in range(length))
+    path.write_text("".join("@r%d\n%s\n+\n%s\n" % (index, random_bases(2) + rng.choice(sequences) + random_bases(2),
+                                                   "".join(rng.choice("#+5?I") for _ in range(12)))
+                            for index in range(num_reads)))
+    return str(path)
+
+
+@pytest.mark.parametrize("options", [{}, {"mem_budget": 1 << 30}, {"workers": 2}, {"method": "sort"},
+                                     {"pipelined": True, "compact": True}])
+def test_the_pipeline_matches_trimming_then_collapsing(tmp_path, options):
+    fastq_filename = write_reads(tmp_path / "reads.fq")
+    fastq_trimming(fastq_filename, str(tmp_path / "trimmed.fq"), 2, 10)
+    fastq_collapse(str(tmp_path / "trimmed.fq"), str(tmp_path / "expected.fq"), prefix=2, **options)
+    os.remove(str(tmp_path / "trimmed.fq"))
+    fastq_pipeline(fastq_filename, str(tmp_path / "collapsed.fq"), 2, 10, prefix=2, **options)
+    assert (tmp_path / "collapsed.fq").read_text() == (tmp_path / "expected.fq").read_text()
+    # no intermediate trimmed file is left behind
+    assert sorted(os.listdir(str(tmp_path))) == ["collapsed.fq", "expected.fq", "reads.fq"]
+
+
+def test_the_paired_pipeline_matches_trimming_then_collapsing(tmp_path):
+    fastq_filename = write_reads(tmp_path / "reads_1.fq")
+    paired_filename = write_reads(tmp_path / "reads_2.fq", seed=2)
+    fastq_trimming(fastq_filename, str(tmp_path / "trimmed_1.fq"), 2, 10, paired_filename=paired_filename,
+                   paired_out_filename=str(tmp_path / "trimmed_2.fq"))
+    fastq_collapse_paired(str(tmp_path / "trimmed_1.fq"), str(tmp_path / "trimmed_2.fq"),
+                          str(tmp_path / "expected_1.fq"), str(tmp_path / "expected_2.fq"), prefix=2)
+    fastq_pipeline(fastq_filename, str(tmp_path / "collapsed_1.fq"), 2, 10, prefix=2, paired_filename=paired_filename,
+                   paired_new_filename=str(tmp_path / "collapsed_2.fq"))
+    for mate in ("1", "2"):
+        assert (tmp_path / ("collapsed_%s.fq" % mate)).read_text() == (tmp_path / ("expected_%s.fq" % mate)).read_text()
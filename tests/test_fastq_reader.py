@@ -0,0 +1,42 @@
+import gzip
+import pytest
+from Utility.Fastq_class import NumOfLinesNotDivisibleBy4
+from Utility.fastq_reader import generate_fastq_records, generate_fastq_batches
+
+SEQUENCES = ["ACGTN"[index % 5:] + "AC" * index for index in range(8)]
+# qualities starting with '@' and '+' lines with a header, so no line can be told apart by its first character alone
+RECORDS = [("@r%d" % index, sequence, "+" * (index % 2) or "+r%d" % index, ("@I#5?" * len(sequence))[:len(sequence)])
+           for index, sequence in enumerate(SEQUENCES)]
+READS = "".join("\n".join(record) + "\n" for record in RECORDS)
+
+
+@pytest.mark.parametrize("read_ahead", [0, 1])  # memory-mapped, and read with plain reads
+def test_records_cut_by_every_block_size(tmp_path, read_ahead):
+    fastq_filename = str(tmp_path / "reads.fq")
+    with open(fastq_filename, "w") as fastq_file:
+        fastq_file.write(READS)
+    for block_size in range(1, len(READS) + 2):
+        assert list(map(tuple, generate_fastq_records(fastq_filename, block_size=block_size,
+                                                      read_ahead=read_ahead))) == RECORDS
+        assert b"".join(batch.tobytes() for batch in generate_fastq_batches(fastq_filename, block_size=block_size,
+                                                                          read_ahead=read_ahead)) == READS.encode()
+
+
+def test_compressed_records_cut_by_every_block_size(tmp_path):
+    fastq_filename = str(tmp_path / "reads.fq.gz")
+    with gzip.open(fastq_filename, "wt") as fastq_file:
+        fastq_file.write(READS)
+    for block_size in range(1, len(READS) + 2):
+        assert list(map(tuple, generate_fastq_records(fastq_filename, decode=False, block_size=block_size))) == \
+            [tuple(line.encode() for line in record) for record in RECORDS]
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 1 << 20])
+def test_a_truncated_record_is_an_error(tmp_path, block_size):
+    fastq_filename = str(tmp_path / "reads.fq")
+    with open(fastq_filename, "w") as fastq_file:
+        fastq_file.write(READS + "@cut\nACGT\n")
+    with pytest.raises(NumOfLinesNotDivisibleBy4):
+        list(generate_fastq_records(fastq_filename, block_size=block_size))
+    with pytest.raises(NumOfLinesNotDivisibleBy4):
+        list(generate_fastq_batches(fastq_filename, block_size=block_size))
@@ -0,0 +1,26 @@
+import pickle
+import pytest
+from Utility.Fastq_class import FastqRecord, FastqRecordView, ThirdLineNotStartWithPlus
+
+
+def test_record_reads_as_its_lines():
+    record = FastqRecord("@a", "ACGT", "+a", "IIII")
+    assert list(record) == ["@a", "ACGT", "+a", "IIII"]
+    assert (record[1], record[3]) == ("ACGT", "IIII")
+    assert pickle.loads(pickle.dumps(record)).strings == record.strings
+
+
+def test_validation_is_opt_in():
+    FastqRecord("@a", "ACGT", "-", "IIII")
+    with pytest.raises(ThirdLineNotStartWithPlus):
+        FastqRecord("@a", "ACGT", "-", "IIII", validate=True)
+
+
+def test_slices_are_views():
+    record = FastqRecord("@a", "ACGTACGT", "+", "ABCDEFGH")
+    view = record[2:7][1:3]
+    assert isinstance(view, FastqRecordView) and view.record is record
+    assert view.strings == ["@a", "TA", "+", "DE"]
+    record.quality = "abcdefgh"
+    assert view.quality == "de"
+    assert view.materialize().strings == ["@a", "TA", "+", "de"]
@@ -0,0 +1,44 @@
+import random
+import pytest
+from Utility.fastq_shards import split_to_shards, find_record_start
+from Utility.fastq_reader import generate_fastq_records
+
+
+def write_records(path, num_records=300, seed=1):
+    """
+    :return: the filename and the byte offsets of its records - quality lines often start with '@' and headers and
+             plus lines vary in length, so record starts can not be told by a single line
+    """
+    rng = random.Random(seed)
+    records = []
+    for index in range(num_records):
+        length = rng.randrange(1, 40)
+        sequence, quality = "".join(rng.choices("ACGTN", k=length)), "".join(rng.choices("@+I#", k=length))
+        records.append("@r%d%s\n%s\n+%s\n%s\n" % (index, "x" * rng.randrange(5), sequence, "r" * rng.randrange(3),
+                                                 quality))
+    offsets = [0]
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    path.write_bytes("".join(records).encode())
+    return str(path), offsets[:-1]
+
+
+@pytest.mark.parametrize("num_shards", [1, 2, 7, 64, 5000])
+def test_shards_start_on_records(tmp_path, num_shards):
+    filename, record_offsets = write_records(tmp_path / "reads.fq")
+    shards = split_to_shards(filename, num_shards)
+    assert shards[0][0] == 0 and shards[-1][1] == (tmp_path / "reads.fq").stat().st_size
+    assert all(end == next_start for (_, end), (next_start, _) in zip(shards, shards[1:]))
+    assert set(start for start, _ in shards) <= set(record_offsets)
+    sharded_records = [record.strings for start, end in shards
+                       for record in generate_fastq_records(filename, start=start, end=end, validate=True)]
+    assert sharded_records == [record.strings for record in generate_fastq_records(filename)]
+
+
+def test_every_offset_syncs_to_the_next_record(tmp_path):
+    filename, record_offsets = write_records(tmp_path / "reads.fq", num_records=40)
+    file_size = (tmp_path / "reads.fq").stat().st_size
+    with open(filename, "rb") as fp:
+        for offset in range(file_size + 1):
+            expected = next((start for start in record_offsets if start >= offset), file_size)
+            assert find_record_start(fp, offset) == expected
@@ -0,0 +1,59 @@
+import io
+import os
+import sys
+import pytest
+from Processing import fastq_trimming as fastq_trimming_module
+from Processing.fastq_trimming import trimmByRanges, trimmByRange
+
+
+def test_a_bad_range_opens_no_output(tmp_path):
+    fastq_filename = str(tmp_path / "reads.fq")
+    with open(fastq_filename, "w") as fastq_file:
+        fastq_file.write("@a\nACGTACGT\n+\nIIII####\n")
+    with pytest.raises(ValueError, match="insert.fq:6:2"):
+        trimmByRanges(fastq_filename, [(str(tmp_path / "umi.fq"), 0, 4), (str(tmp_path / "insert.fq"), 6, 2)])
+    assert os.listdir(str(tmp_path)) == ["reads.fq"]
+
+
+def test_ranges_into_their_outputs(tmp_path):
+    fastq_filename = str(tmp_path / "reads.fq")
+    with open(fastq_filename, "w") as fastq_file:
+        fastq_file.write("@a\nACGTACGT\n+\nIIII####\n")
+    trimmByRanges(fastq_filename, [(str(tmp_path / "umi.fq"), 0, 3), (str(tmp_path / "insert.fq"), 3, 7)])
+    assert open(str(tmp_path / "umi.fq")).read() == "@a\nACG\n+\nIII\n"
+    assert open(str(tmp_path / "insert.fq")).read() == "@a\nTACG\n+\nI###\n"
+
+
+READS = "".join("@r%d\n%s\n+\n%s\n" % (index, "ACGTTGCA"[index % 4:] + "ACGT", "I#5?+I#5"[index % 4:] + "IIII")
+                for index in range(40))
+
+
+def expected_trimmed(start, end):
+    lines = READS.split("\n")[:-1]
+    return "".join("%s\n%s\n+\n%s\n" % (lines[line], lines[line + 1][start:end], lines[line + 3][start:end])
+                   for line in range(0, len(lines), 4))
+
+
+@pytest.mark.parametrize("block_size", [1, 5, 64, 1 << 20])
+def test_trimming_is_written_in_batches_of_the_block_size(tmp_path, monkeypatch, block_size):
+    fastq_filename = str(tmp_path / "reads.fq")
+    with open(fastq_filename, "w") as fastq_file:
+        fastq_file.write(READS)
+    writes = []
+    write_trimmed = fastq_trimming_module.write_trimmed
+
+    def counting_write_trimmed(out_fp, trimmed):
+        writes.append(len(trimmed))
+        write_trimmed(out_fp, trimmed)
+    monkeypatch.setattr(fastq_trimming_module, "write_trimmed", counting_write_trimmed)
+    trimmByRange(fastq_filename, str(tmp_path / "trimmed.fq"), 1, 6, block_size=block_size)
+    assert open(str(tmp_path / "trimmed.fq")).read() == expected_trimmed(1, 6)
+    assert (len(writes) > 1) == (block_size < len(READS))  # the output is written as the input is read
+
+
+def test_trimming_from_stdin_to_stdout(monkeypatch):
+    stdout = io.TextIOWrapper(io.BytesIO())
+    monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(io.BytesIO(READS.encode())))
+    monkeypatch.setattr(sys, "stdout", stdout)
+    trimmByRange("-", "-", 2, 9, block_size=100)
+    assert stdout.buffer.getvalue().decode() == expected_trimmed(2, 9)
@@ -0,0 +1,42 @@
+import random
+import pytest
+from Processing.fastq_collapse import fastq_collapse
+
+
+def reads(num_reads, sequences, seed):
+    rng = random.Random(seed)
+    return "".join("@s%dr%d\n%s\n+\n%s\n" % (seed, index, rng.choice(sequences),
+                                            "".join(rng.choice("#+5?I") for _ in range(10)))
+                   for index in range(num_reads))
+
+
+def read_collapsed(filename):
+    lines = open(filename).read().split("\n")[:-1]
+    return sorted((lines[index + 1], lines[index], lines[index + 3]) for index in range(0, len(lines), 4))
+
+
+@pytest.mark.parametrize("options", [{}, {"mem_budget": 1 << 30}, {"compact": True}, {"buckets": 3, "workers": 2}])
+def test_existing_then_new_reads_is_a_collapse_of_both(tmp_path, options):
+    rng = random.Random(1)
+    sequences = ["".join(rng.choice("ACGT") for _ in range(10)) for _ in range(300)]
+    # some sequences only in A, some only in B, most in both
+    reads_a, reads_b = reads(800, sequences[:250], seed=1), reads(800, sequences[50:], seed=2)
+    (tmp_path / "a.fq").write_text(reads_a)
+    (tmp_path / "b.fq").write_text(reads_b)
+    (tmp_path / "ab.fq").write_text(reads_a + reads_b)
+    fastq_collapse(str(tmp_path / "a.fq"), str(tmp_path / "collapsed_a.fq"), prefix=1, **options)
+    fastq_collapse(str(tmp_path / "b.fq"), str(tmp_path / "collapsed_ab.fq"), prefix=1,
+                   existing_filename=str(tmp_path / "collapsed_a.fq"), **options)
+    fastq_collapse(str(tmp_path / "ab.fq"), str(tmp_path / "expected_ab.fq"), prefix=1, **options)
+    assert read_collapsed(str(tmp_path / "collapsed_ab.fq")) == read_collapsed(str(tmp_path / "expected_ab.fq"))
+
+
+def test_existing_file_needs_counts(tmp_path):
+    (tmp_path / "a.fq").write_text("@a\nACGT\n+\nIIII\n")
+    fastq_collapse(str(tmp_path / "a.fq"), str(tmp_path / "collapsed_a.fq"), write_count_flag=False)
+    with pytest.raises(ValueError, match="--count"):
+        fastq_collapse(str(tmp_path / "a.fq"), str(tmp_path / "new.fq"),
+                       existing_filename=str(tmp_path / "collapsed_a.fq"))
+    with pytest.raises(ValueError, match="'max' merge strategy"):
+        fastq_collapse(str(tmp_path / "a.fq"), str(tmp_path / "new.fq"), merge_strategy="mean",
+                       existing_filename=str(tmp_path / "collapsed_a.fq"))
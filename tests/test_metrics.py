@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import pytest
+from Utility.metrics import Metrics
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 6 reads of 3 sequences - a duplicate ratio of 0.5
+READS = "".join("@r%d\n%s\n+\n%s\n" % (index, sequence, "I" * len(sequence))
+                for index, sequence in enumerate(["ACGT", "ACGT", "TTGA", "ACGT", "GGCA", "TTGA"]))
+
+
+def run_collapse_script(tmp_path, *options):
+    (tmp_path / "reads.fq").write_text(READS)
+    return subprocess.run([sys.executable, os.path.join(REPO_ROOT, "Processing", "fastq_collapse.py"), "reads.fq",
+                           "collapsed.fq", "2", "--count"] + list(options), cwd=str(tmp_path),
+                          env=dict(os.environ, PYTHONPATH=REPO_ROOT), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          check=True)
+
+
+@pytest.mark.parametrize("options", [[], ["--workers=2"]])
+def test_metrics_report_of_a_collapse(tmp_path, options):
+    run_collapse_script(tmp_path, "--metrics=metrics.json", "--no-progress", *options)
+    with open(str(tmp_path / "metrics.json")) as report_file:
+        report = json.load(report_file)
+    assert {"read", "parse", "split", "collapse", "write"} <= set(report["stages"])
+    assert report["stages"]["collapse"]["records"] == 6
+    assert report["stages"]["read"]["bytes_read"] == len(READS) * 2  # the input, then its partitions
+    assert report["stages"]["write"]["bytes_written"] == os.path.getsize(str(tmp_path / "collapsed.fq"))
+    assert all(stage["process_peak_rss_mb"] > 0 for stage in report["stages"].values())
+    assert "process_peak_rss_mb" in report["notes"]
+    assert report["values"]["collapsed_reads"] == 6 and report["values"]["unique_sequences"] == 3
+    assert report["values"]["duplicate_ratio"] == 0.5
+    assert report["values"]["partitions"]["count"] == 3
+
+
+def test_no_progress_bars(tmp_path):
+    assert run_collapse_script(tmp_path).stderr
+    assert not run_collapse_script(tmp_path, "--no-progress").stderr
+
+
+def test_nested_stage_time_is_not_counted_twice():
+    metrics = Metrics()
+    with metrics.stage("outer"):
+        time.sleep(0.01)
+        with metrics.stage("inner"):
+            time.sleep(0.2)
+    assert metrics.stages["inner"].seconds >= 0.2
+    assert 0.01 <= metrics.stages["outer"].seconds < 0.15
@@ -0,0 +1,33 @@
+from Processing.fastq_collapse import fastq_collapse_paired
+
+
+def write_fastq(path, records):
+    path.write_text("".join("\n".join(record) + "\n" for record in records))
+    return str(path)
+
+
+def read_fastq(path):
+    lines = open(path).read().split("\n")[:-1]
+    return [lines[index:index + 4] for index in range(0, len(lines), 4)]
+
+
+def test_plus_lines_of_both_mates_are_kept(tmp_path):
+    fastq_1 = write_fastq(tmp_path / "r1.fq", [["@a/1", "ACGT", "+a/1", "IIII"], ["@b/1", "ACGT", "+b/1", "####"],
+                                               ["@c/1", "TTTT", "+", "IIII"]])
+    fastq_2 = write_fastq(tmp_path / "r2.fq", [["@a/2", "GGCC", "+a/2", "IIII"], ["@b/2", "GGCC", "+b/2", "####"],
+                                               ["@c/2", "AAAA", "+", "IIII"]])
+    new_1, new_2 = str(tmp_path / "c1.fq"), str(tmp_path / "c2.fq")
+    fastq_collapse_paired(fastq_1, fastq_2, new_1, new_2, prefix=1)
+    assert sorted(read_fastq(new_1)) == [["@a/1_count:2", "ACGT", "+a/1", "IIII"],
+                                         ["@c/1_count:1", "TTTT", "+", "IIII"]]
+    assert sorted(read_fastq(new_2)) == [["@a/2_count:2", "GGCC", "+a/2", "IIII"],
+                                         ["@c/2_count:1", "AAAA", "+", "IIII"]]
+
+
+def test_mixed_plus_lines(tmp_path):
+    fastq_1 = write_fastq(tmp_path / "r1.fq", [["@a/1", "ACGT", "+", "IIII"]])
+    fastq_2 = write_fastq(tmp_path / "r2.fq", [["@a/2", "GGCC", "+a/2", "IIII"]])
+    new_1, new_2 = str(tmp_path / "c1.fq"), str(tmp_path / "c2.fq")
+    fastq_collapse_paired(fastq_1, fastq_2, new_1, new_2, write_count_flag=False, compact=True)
+    assert read_fastq(new_1) == [["@a/1", "ACGT", "+", "IIII"]]
+    assert read_fastq(new_2) == [["@a/2", "GGCC", "+a/2", "IIII"]]
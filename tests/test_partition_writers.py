@@ -0,0 +1,35 @@
+import pytest
+from Utility.partition_writers import PartitionWriterPool
+from Utility.compressed_io import open_file
+
+
+@pytest.mark.parametrize("suffix", [".temp", ".temp.gz"])
+@pytest.mark.parametrize("writer_queue_size", [0, 2])
+def test_evicted_partitions_keep_every_line(tmp_path, suffix, writer_queue_size):
+    names = [str(tmp_path / ("part_%d%s" % (index, suffix))) for index in range(6)]
+    (tmp_path / ("part_0" + suffix)).write_text("a leftover of an earlier run\n")
+    expected = {name: [] for name in names}
+    opened = []
+    first_writes = []
+    with PartitionWriterPool(max_open=2, flush_threshold=30, max_buffered_bytes=100,
+                             writer_queue_size=writer_queue_size) as partition_writers:
+        original_get_handle = partition_writers._get_handle
+
+        def get_handle(name):
+            if name not in partition_writers._handles:
+                opened.append(name)
+            return original_get_handle(name)
+        partition_writers._get_handle = get_handle
+        for line_number in range(500):
+            name = names[(line_number * 7) % 5 if line_number % 11 else 5]
+            line = "line %d\n" % line_number
+            partition_writers.write(name, line)
+            expected[name].append(line)
+            if name not in first_writes:
+                first_writes.append(name)
+            assert len(partition_writers._handles) <= 2
+    assert partition_writers.names == sorted(names, key=lambda name: first_writes.index(name))
+    assert len(opened) > len(names)  # partitions were evicted and opened again (in append mode)
+    for name in names:
+        with open_file(name) as partition_file:
+            assert partition_file.read() == "".join(expected[name])
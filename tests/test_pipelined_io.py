@@ -0,0 +1,58 @@
+import time
+import random
+import operator
+import pytest
+from Utility.pipelined_io import ordered_map, threaded_generator
+
+
+def slow_square(item):
+    time.sleep(random.random() / 1000)  # the results are done out of order
+    return item * item
+
+
+def failing_square(item):
+    if item == 5:
+        raise ValueError("bad item %d" % item)
+    return item * item
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_ordered_map_keeps_the_order(workers):
+    assert list(ordered_map(slow_square, range(200), workers=workers, queue_size=2)) == [i * i for i in range(200)]
+
+
+def test_ordered_map_in_processes():
+    assert list(ordered_map(operator.neg, range(50), workers=2, worker_type="process")) == [-i for i in range(50)]
+
+
+def test_ordered_map_raises_worker_errors():
+    received = []
+    with pytest.raises(ValueError, match="bad item 5"):
+        for result in ordered_map(failing_square, range(10), workers=3):
+            received.append(result)
+    assert received == [0, 1, 4, 9, 16]  # the results before the failing item
+
+
+def test_ordered_map_raises_worker_errors_of_processes():
+    received = []
+    with pytest.raises(IndexError):
+        for result in ordered_map(operator.itemgetter(1), [(0, 1), (0,), (0, 2)], workers=2, worker_type="process"):
+            received.append(result)
+    assert received == [1]
+
+
+def test_unknown_worker_type():
+    with pytest.raises(ValueError):
+        list(ordered_map(abs, [1], worker_type="fiber"))
+
+
+def test_threaded_generator_raises_reader_errors():
+    def items():
+        yield 1
+        yield 2
+        raise ValueError("bad input")
+    received = []
+    with pytest.raises(ValueError, match="bad input"):
+        for item in threaded_generator(items(), queue_size=1):
+            received.append(item)
+    assert received == [1, 2]
@@ -0,0 +1,77 @@
+import os
+import pytest
+from Processing import fastq_collapse as fastq_collapse_module
+from Processing import fastq_trimming as fastq_trimming_module
+from Utility import generators_utilities
+from Utility.generators_utilities import num_of_lines_in_file
+from Utility.file_utilities import input_size
+from Utility.compressed_io import open_file
+
+READS = "".join("@r%d\n%s\n+\n%s\n" % (index, "ACGT"[index % 4:] + "TTGCA", "I#5?"[index % 4:] + "IIIII")
+                for index in range(50))
+
+
+class RecordingProgressBar:
+    """
+    Stands for a tqdm progress bar - records its total and the updates of its progress
+    """
+    def __init__(self, iterable=None, **kwargs):
+        self.iterable = iterable
+        self.total = kwargs.get("total")
+        self.unit = kwargs.get("unit")
+        self.progress = 0
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def update(self, n=1):
+        self.progress += n
+
+    def reset(self, total=None):
+        self.total = total
+        self.progress = 0
+
+    def close(self):
+        pass
+
+
+def record_progress_bars(monkeypatch, module):
+    progress_bars = []
+
+    def recording_progress_bar(iterable=None, **kwargs):
+        progress_bars.append(RecordingProgressBar(iterable, **kwargs))
+        return progress_bars[-1]
+    monkeypatch.setattr(module, "progress_bar", recording_progress_bar)
+    return progress_bars
+
+
+def byte_progress_bars(progress_bars):
+    return [(progress_bar.total, progress_bar.progress) for progress_bar in progress_bars if progress_bar.unit == "B"]
+
+
+@pytest.mark.parametrize("fastq_name", ["reads.fq", "reads.fq.gz"])
+def test_progress_is_counted_in_bytes_of_the_input(tmp_path, monkeypatch, fastq_name):
+    fastq_filename = str(tmp_path / fastq_name)
+    with open_file(fastq_filename, "w") as fastq_file:  # a compressed input is BGZF, so its size is known
+        fastq_file.write(READS)
+    assert input_size(fastq_filename) == len(READS)
+    progress_bars = record_progress_bars(monkeypatch, fastq_trimming_module)
+    fastq_trimming_module.trimmByRange(fastq_filename, str(tmp_path / "trimmed.fq"), 0, 4, block_size=64)
+    assert byte_progress_bars(progress_bars) == [(len(READS), len(READS))]
+    progress_bars = record_progress_bars(monkeypatch, fastq_collapse_module)
+    fastq_collapse_module.fastq_collapse(fastq_filename, str(tmp_path / "collapsed.fq"), prefix=1)
+    assert byte_progress_bars(progress_bars) == [(len(READS), len(READS))]
+
+
+def test_stdin_and_pipes_have_no_size(tmp_path):
+    os.mkfifo(str(tmp_path / "pipe"))
+    assert input_size("-") is None
+    assert input_size(str(tmp_path / "pipe")) is None
+
+
+@pytest.mark.parametrize("text", ["", "a\n", "a\nb", "a\n\n\nb\n", READS, READS + "tail"])
+def test_lines_are_counted_across_blocks(tmp_path, monkeypatch, text):
+    (tmp_path / "lines.txt").write_text(text)
+    for block_size in (1, 3, 1 << 20):
+        monkeypatch.setattr(generators_utilities, "COUNT_BLOCK_SIZE", block_size)
+        assert num_of_lines_in_file(str(tmp_path / "lines.txt")) == len(text.splitlines())
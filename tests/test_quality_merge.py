@@ -0,0 +1,27 @@
+from Utility.quality_merge import QualityAggregator, merge_qualities, DEFAULT_MAX_PENDING_BYTES, \
+    MIN_MAX_PENDING_BYTES
+from Utility.memory_utilities import max_pending_bytes_for_budget, parse_memory_size
+
+
+def test_pending_buffer_shrinks_only_with_a_tight_budget():
+    assert max_pending_bytes_for_budget(None) == DEFAULT_MAX_PENDING_BYTES
+    assert max_pending_bytes_for_budget(parse_memory_size("64G")) == DEFAULT_MAX_PENDING_BYTES
+    assert MIN_MAX_PENDING_BYTES < max_pending_bytes_for_budget(parse_memory_size("1G")) < DEFAULT_MAX_PENDING_BYTES
+    assert max_pending_bytes_for_budget(parse_memory_size("1G"), workers=4) < \
+        max_pending_bytes_for_budget(parse_memory_size("1G"))
+    assert max_pending_bytes_for_budget(parse_memory_size("10M")) == MIN_MAX_PENDING_BYTES
+
+
+def test_merged_qualities_do_not_depend_on_the_buffer():
+    qualities = {"k%d" % key: ["%c" % (33 + (key * 7 + i * 13) % 41) * 5 for i in range(key % 4 + 2)]
+                 for key in range(50)}
+    for strategy in ("max", "mean", "sum"):
+        results = []
+        for max_pending_bytes in (1, DEFAULT_MAX_PENDING_BYTES):
+            aggregator = QualityAggregator(strategy, max_pending_bytes)
+            for key, key_qualities in qualities.items():
+                for quality in key_qualities[1:]:
+                    aggregator.add(key, quality, key_qualities[0])
+            results.append(dict(aggregator.merged()))
+        assert results[0] == results[1] == {key: merge_qualities(key_qualities, strategy)
+                                            for key, key_qualities in qualities.items()}
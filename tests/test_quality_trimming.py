@@ -0,0 +1,28 @@
+import numpy as np
+from Utility.Fastq_class import FastqBatch
+from Utility.quality_trimming import length_buckets, quality_cut_points
+
+
+def batch_of(qualities):
+    text = "".join("@r%d\n%s\n+\n%s\n" % (i, "A" * len(quality), quality) for i, quality in enumerate(qualities))
+    return FastqBatch.from_block(text.encode())[0].validate()
+
+
+def test_buckets_cover_every_read_once():
+    lengths = np.array([150, 3, 0, 50000, 149, 76, 150, 1, 2])
+    buckets = list(length_buckets(lengths, max_cells=400))
+    rows = np.concatenate([bucket for bucket, _ in buckets])
+    assert sorted(rows) == list(range(len(lengths)))
+    for bucket, width in buckets:
+        assert lengths[bucket].max() == width
+        assert len(bucket) == 1 or (len(bucket) * width <= 400 and width < 2 * max(lengths[bucket].min(), 1))
+
+
+def test_long_reads_do_not_change_the_cut_points():
+    qualities = ["I" * 20 + "#" * 10, "#" * 3 + "I" * 30, "I#I#I#" * 5, "", "I" * 40000 + "#" * 7]
+    batch = batch_of(qualities)
+    cut_points = quality_cut_points(batch, threshold_5=20, threshold_3=20, window=(4, 20))
+    for index, quality in enumerate(qualities):
+        single = quality_cut_points(batch_of([quality]), threshold_5=20, threshold_3=20, window=(4, 20))
+        assert (cut_points[0][index], cut_points[1][index]) == (single[0][0], single[1][0])
+    assert (cut_points[0][4], cut_points[1][4]) == (0, 39999)  # the first failing window starts at the last "I"
@@ -0,0 +1,31 @@
+import random
+from collections import Counter
+from Utility.sketch import CountingBloomFilter
+
+
+def test_no_false_negatives():
+    rng = random.Random(1)
+    items = ["".join(rng.choices("ACGT", k=20)) for _ in range(20000)]
+    items += rng.choices(items, k=5000)  # duplicates
+    counts = Counter(items)
+    sequences_filter = CountingBloomFilter(len(counts))
+    for item in items:
+        sequences_filter.add(item)
+    assert all(sequences_filter.count(item) == 2 for item, count in counts.items() if count > 1)
+    singletons = [item for item, count in counts.items() if count == 1]
+    counted_once = sum(sequences_filter.count(item) == 1 for item in singletons)
+    assert counted_once > 0.95 * len(singletons)  # singletons are rarely mistaken for duplicates
+
+
+def test_an_overfilled_filter_still_has_no_false_negatives():
+    sequences_filter = CountingBloomFilter(10)
+    for index in range(5000):
+        sequences_filter.add(index % 2500)
+    assert all(sequences_filter.count(index) == 2 for index in range(2500))
+
+
+def test_never_added():
+    sequences_filter = CountingBloomFilter(100)
+    sequences_filter.add("ACGT")
+    assert sequences_filter.count("ACGT") == 1
+    assert CountingBloomFilter(100).count("ACGT") == 0
@@ -0,0 +1,33 @@
+import pytest
+from Benchmarks.synthetic_fastq import generate_synthetic_fastq, POLYA_LENGTH
+from Benchmarks.bench_suite import benchmark
+from Utility.fastq_reader import generate_fastq_records
+
+
+@pytest.mark.parametrize("duplication_rate", [0.0, 0.3, 0.9])
+def test_synthetic_reads_have_the_requested_shape(tmp_path, duplication_rate):
+    fastq_filename = str(tmp_path / "synthetic.fq")
+    num_unique = generate_synthetic_fastq(fastq_filename, 2000, read_length=40, duplication_rate=duplication_rate,
+                                          polya_fraction=0.2)
+    records = list(generate_fastq_records(fastq_filename, validate=True))
+    sequences = set(record.sequence for record in records)
+    assert len(records) == 2000
+    assert all(len(record.sequence) == 40 for record in records)
+    assert num_unique == len(sequences) == round(2000 * (1 - duplication_rate))
+    polya_sequences = sum(sequence.startswith("A" * POLYA_LENGTH) for sequence in sequences)
+    assert 0.1 * num_unique < polya_sequences < 0.3 * num_unique
+
+
+def test_synthetic_reads_are_reproducible(tmp_path):
+    contents = []
+    for name, seed in (("first.fq", 1), ("second.fq", 1), ("other_seed.fq", 2)):
+        generate_synthetic_fastq(str(tmp_path / name), 500, read_length=30, seed=seed)
+        contents.append((tmp_path / name).read_bytes())
+    assert contents[0] == contents[1] != contents[2]
+
+
+def test_benchmark_results(tmp_path):
+    results = benchmark([300], ["fastq_reader", "collapse_fastq_to_table"], str(tmp_path), read_length=30)
+    assert [(result["stage"], result["reads"]) for result in results] == [("fastq_reader", 300),
+                                                                          ("collapse_fastq_to_table", 300)]
+    assert all(result["seconds"] > 0 and result["peak_rss_mb"] > 0 and result["input_mb"] > 0 for result in results)
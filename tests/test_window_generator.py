@@ -0,0 +1,58 @@
+import random
+from itertools import groupby
+import pytest
+from Utility.generators_utilities import window_generator
+
+
+def brute_force_windows(gate_items, items, closed_first, closed_second):
+    """
+    :return: the windows of 'window_generator' - every item in the first window it fits in
+    """
+    gates = [list(group) for _, group in groupby(gate_items, key=lambda item: item[0])]
+    if not gates:
+        return []
+    windows = []
+    remaining = list(items)
+    for gate_1, gate_2 in zip([[]] + gates, gates + [[]]):
+        def fits(key):
+            after_gate_1 = not gate_1 or (key >= gate_1[0][0] if closed_first else key > gate_1[0][0])
+            before_gate_2 = not gate_2 or (key <= gate_2[0][0] if closed_second else key < gate_2[0][0])
+            return after_gate_1 and before_gate_2
+        middle = [item for item in remaining if fits(item[0])]
+        remaining = [item for item in remaining if not fits(item[0])]
+        windows.append((gate_1, middle, gate_2))
+    return windows
+
+
+def keyed_items(rng, num_items, name, keys):
+    return sorted((rng.choice(keys), "%s%d" % (name, index)) for index in range(num_items))
+
+
+@pytest.mark.parametrize("closed_first", [False, True])
+@pytest.mark.parametrize("closed_second", [False, True])
+@pytest.mark.parametrize("batch_size", [1, 3, 4096])
+def test_windows_match_a_brute_force_join(closed_first, closed_second, batch_size):
+    rng = random.Random(batch_size)
+    for _ in range(200):
+        # overlapping key ranges - some keys are in both inputs, some only in one of them
+        gate_items = keyed_items(rng, rng.randrange(8), "gate", range(0, 20, 2))
+        items = keyed_items(rng, rng.randrange(30), "item", range(rng.randrange(-5, 5), 25, rng.choice([1, 3])))
+        windows = list(window_generator(iter(gate_items), iter(items), lambda item: item[0], lambda item: item[0],
+                                        closed_first, closed_second, batch_size))
+        assert windows == brute_force_windows(gate_items, items, closed_first, closed_second)
+
+
+def test_empty_inputs():
+    key = lambda item: item[0]
+    assert list(window_generator(iter([]), iter([(1, "a")]), key, key)) == []
+    assert list(window_generator(iter([]), iter([]), key, key)) == []
+    assert list(window_generator(iter([(1, "g"), (1, "h")]), iter([]), key, key)) == \
+        [([], [], [(1, "g"), (1, "h")]), ([(1, "g"), (1, "h")], [], [])]
+
+
+def test_keys_in_one_input_only():
+    key = lambda item: item[0]
+    gate_items = [(2, "g"), (6, "h")]
+    items = [(1, "a"), (3, "b"), (5, "c"), (7, "d")]
+    assert list(window_generator(iter(gate_items), iter(items), key, key)) == \
+        [([], [(1, "a")], [(2, "g")]), ([(2, "g")], [(3, "b"), (5, "c")], [(6, "h")]), ([(6, "h")], [(7, "d")], [])]